@@ -0,0 +1,212 @@
+'''
+Server classes built on asyncio streams (python 3.7 or later).
+
+Started by running waferslim.server with the --async option: every
+connection is handled by a coroutine on a single event loop rather than by
+an OS thread of its own, so many slim clients can share one long-lived
+process. Framing, the ACK, the 'bye' handshake and packing of the results
+all happen on the event loop; only the execution of each message's
+instructions -- which calls fixture code that may block -- is handed to an
+executor (by default a thread pool of --threads workers), so the event loop
+never stalls waiting for a fixture. As successive messages of a session may
+run on different threads of the pool, each session carries its own
+converter registry to whichever thread executes its next message.
+
+Unlike WaferSlimServer, the server carries on accepting connections until
+it is interrupted, rather than shutting down after the first one.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import asyncio
+import codecs
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from . import converters, profiling, protocol, recorder, stats, tracing
+from .execution import ExecutionContext, Instructions, InstructionPlans
+
+
+_LOGGER_NAME = 'WaferSlimServer'
+
+
+class AsyncRequestResponder(protocol.RequestResponder):
+    ''' Responds to Slim protocol requests read from an asyncio StreamReader
+    and written to a StreamWriter. Instructions are executed in the executor
+    passed to __init__, one message at a time, in the order received. '''
+
+    def __init__(self, reader, writer, executor=None):
+        ''' Specify the streams of the connection and the executor in which
+        to execute instructions (None for the event loop's default) '''
+        self._reader = reader
+        self._writer = writer
+        self._executor = executor
+        self._received = 0
+        self._registry = None  # converters registered by the session
+
+    async def respond_to_request(self,
+                                 instructions=Instructions,
+                                 execution_context=ExecutionContext,
+                                 results=protocol.FrameResults):
+        ''' Respond to a Slim protocol request, as RequestResponder does:
+        ACK with the Slim Version, then receive messages and send responses
+        until a 'bye' message is received '''
+        ack = protocol._VERSION.encode(protocol.BYTE_ENCODING)
+        tracing.record('ack')
+        self._writer.write(ack)
+        await self._writer.drain()
+
+        loop = asyncio.get_event_loop()
+        context = await loop.run_in_executor(self._executor,
+                                             execution_context)
+        context.symbol_objects = self.symbol_objects
+        try:
+            sent = await self._message_loop(context, instructions, results)
+        finally:
+            context.cleanup()
+            await loop.run_in_executor(self._executor, tracing.dump, True)
+            await loop.run_in_executor(self._executor, stats.write)
+        return self._received, sent + len(ack)
+
+    async def _message_loop(self, context, instructions, results):
+        ''' Receive messages and send responses until a 'bye' message '''
+        loop = asyncio.get_event_loop()
+        disconnect = protocol._DISCONNECT.encode(protocol.BYTE_ENCODING)
+        sent = 0
+        recording = recorder.current()
+        session = recording and recording.new_session()
+        number = 0
+        while True:
+            length = await self.read_length()
+            received = recording and stats.clock()
+            message = await self.read_chars(length)
+            tracing.record('message', len(message))
+            if disconnect == message:
+                break
+
+            executing = recording and stats.clock()
+            response = await loop.run_in_executor(self._executor,
+                                                  self._respond_in_session,
+                                                  message, instructions,
+                                                  context, results)
+            timings = stats.current()
+            start = (timings or recording) and stats.clock()
+            self._writer.write(response)
+            await self._writer.drain()
+            if timings is not None:
+                timings.add(stats.PROTOCOL, 'send', stats.clock() - start)
+            sent += len(response)
+            if recording is not None:
+                number += 1
+                recording.record(session, number, message, response,
+                                 executing - received, start - executing,
+                                 stats.clock() - start)
+
+        return sent
+
+    def _respond_in_session(self, *args):
+        ''' _respond() with the session's converter registry, leaving the
+        executing thread's own registry as it was '''
+        previous = converters._swap_registry(self._registry)
+        try:
+            return self._respond(*args)
+        finally:
+            self._registry = converters._swap_registry(previous)
+
+    async def read_length(self):
+        ''' Receive the numeric header of the next message '''
+        try:
+            header = await self._reader.readuntil(protocol._SEPARATOR_BYTE)
+        except asyncio.LimitOverrunError as error:
+            header = await self._reader.read(error.consumed)
+        except asyncio.IncompleteReadError as error:
+            if not error.partial:
+                raise EOFError('Connection closed while reading a message')
+            header = error.partial
+        self._received += len(header)
+        digits = header[:-protocol._SEPARATOR_LENGTH]
+        if len(digits) > protocol._MAX_HEADER_LENGTH \
+                or not digits.isdigit():
+            msg = '%r is not a numeric message length' % header
+            raise protocol.UnpackingError(msg)
+        return int(digits)
+
+    async def read_chars(self, num_chars):
+        ''' Receive and return the bytes of the next num_chars characters,
+        feeding an incremental decoder as MessageReader.read_chars does '''
+        data = await self._reader.readexactly(num_chars)
+        if not protocol._is_ascii(data, 0, num_chars):
+            decoder = codecs.getincrementaldecoder(protocol.BYTE_ENCODING)()
+            decoded = len(decoder.decode(data))
+            parts = [data]
+            while decoded < num_chars:
+                more = await self._reader.readexactly(num_chars - decoded)
+                decoded += len(decoder.decode(more))
+                parts.append(more)
+            data = b''.join(parts)
+        self._received += len(data)
+        return data
+
+
+class AsyncWaferSlimServer(object):
+    ''' Serves Slim protocol requests on an asyncio event loop, delegating
+    each connection to an AsyncRequestResponder '''
+
+    def __init__(self, options, executor=None):
+        ''' Initialise with the server options and, optionally, the executor
+        in which to execute instructions '''
+        self.options = options
+        self.lazy_unpacking = getattr(options, 'lazy', False)
+        self.symbol_objects = getattr(options, 'symbol_objects', False)
+        plan_cache_size = getattr(options, 'plan_cache', 0)
+        self.plan_cache = plan_cache_size \
+            and InstructionPlans(plan_cache_size) or None
+        if executor is None:
+            executor = ThreadPoolExecutor(getattr(options, 'threads', None))
+        self.executor = executor
+        self.server_address = None
+
+    async def serve(self):
+        ''' Start listening and serve connections until cancelled '''
+        logger = logging.getLogger(_LOGGER_NAME)
+        logger.info("Starting server with options: %s" % (self.options,))
+        server = await asyncio.start_server(self._handle,
+                                            self.options.inethost,
+                                            int(self.options.port))
+        self.server_address = server.sockets[0].getsockname()[:2]
+        logger.info("Started and listening on %s:%s" % self.server_address)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        ''' Run the event loop until interrupted '''
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logging.getLogger(_LOGGER_NAME).info('Shutting down')
+            self.executor.shutdown(wait=False)
+
+    async def _handle(self, reader, writer):
+        ''' Respond to the request on a newly accepted connection '''
+        logger = logging.getLogger(_LOGGER_NAME)
+        from_addr = '%s:%s' % writer.get_extra_info('peername')[:2]
+        logger.info('Handling request from %s' % from_addr)
+        responder = AsyncRequestResponder(reader, writer, self.executor)
+        responder.lazy_unpacking = self.lazy_unpacking
+        responder.plan_cache = self.plan_cache
+        responder.symbol_objects = self.symbol_objects
+        responder.profile = profiling.session(
+            writer.get_extra_info('peername'), scope=profiling.EXECUTION)
+        try:
+            received, sent = await responder.respond_to_request()
+            done_msg = 'Done with %s: %s bytes received, %s bytes sent'
+            logger.info(done_msg % (from_addr, received, sent))
+        except Exception as error:
+            logging.error(error, exc_info=1)
+        finally:
+            writer.close()
+            if responder.profile is not None:
+                await asyncio.get_event_loop().run_in_executor(
+                    self.executor, responder.profile.stop)
@@ -0,0 +1,30 @@
+'''
+Benchmarks for measuring the performance of waferslim internals.
+
+Run individual benchmark modules directly, e.g.
+
+    python -m waferslim.bench.unpack
+
+or by name, e.g. to replay recorded sessions end to end (see replay.py):
+
+    python -m waferslim.bench replay FILE
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import timeit
+
+
+def best_of(fn, number, repeat=5):
+    ''' Best time per call of fn, in seconds, over repeat runs '''
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def report(name, seconds, baseline=None):
+    ''' Print a single benchmark result line, relative to a baseline '''
+    if baseline:
+        print('%-40s %10.3f ms  (x%.2f)' % (name, seconds * 1000,
+                                             baseline / seconds))
+    else:
+        print('%-40s %10.3f ms' % (name, seconds * 1000))
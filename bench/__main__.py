@@ -0,0 +1,18 @@
+'''
+Run a benchmark module by name, e.g.
+
+    python -m waferslim.bench replay FILE [options]
+    python -m waferslim.bench unpack
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import runpy
+import sys
+
+if len(sys.argv) < 2 or sys.argv[1].startswith('-'):
+    sys.exit('usage: python -m waferslim.bench BENCHMARK [args]')
+sys.argv = sys.argv[1:]
+runpy.run_module('waferslim.bench.%s' % sys.argv[0], run_name='__main__',
+                 alter_sys=True)
@@ -0,0 +1,75 @@
+'''
+Benchmark the conversion of the str args of calls to fixture methods: a
+convert_arg decorated method, against the previous decorator which reset
+and advanced a shared iterator over the converters for every call, and a
+method converting from its parameters' annotations via target_for.
+
+    python -m waferslim.bench.arguments [calls]
+'''
+import sys
+from .. import converters, execution
+from . import best_of
+
+
+class _LegacyReIterable(object):
+    ''' The shared iterator convert_arg used to use '''
+    def __init__(self, underlying):
+        self._underlying = underlying
+
+    def reset(self, num_params):
+        self._num_params = num_params
+        try:
+            self._iterator = iter(self._underlying)
+        except TypeError:
+            self._iterator = None
+        return True
+
+    def next(self):
+        return self._iterator and next(self._iterator) or self._underlying
+
+
+def legacy_convert_arg(to_type):
+    ''' The convert_arg decorator used to be, for a tuple of to_type '''
+    def conversion_decorator(base_fn):
+        reiterable = _LegacyReIterable(converters._converters_for(to_type))
+        _reset = reiterable.reset
+        _next = reiterable.next
+
+        def convert_args_and_return_result(self, *args):
+            _reset(len(args))
+            return base_fn(self,
+                           *tuple([_next().from_string(arg) for arg in args]))
+        return convert_args_and_return_result
+    return conversion_decorator
+
+
+class Fixture(object):
+    ''' The same method, converting its args each way '''
+    @legacy_convert_arg(to_type=(int, float, bool))
+    def legacy(self, an_int, a_float, a_bool):
+        return an_int, a_float, a_bool
+
+    @converters.convert_arg(to_type=(int, float, bool))
+    def compiled(self, an_int, a_float, a_bool):
+        return an_int, a_float, a_bool
+
+    def annotated(self, an_int, a_float, a_bool):
+        return an_int, a_float, a_bool
+    annotated.__annotations__ = {'an_int': int, 'a_float': float,
+                                 'a_bool': bool}
+
+
+def main(calls=100000):
+    ''' Run the benchmark '''
+    context = execution.ExecutionContext()
+    context.methods[Fixture] = frozenset(['legacy', 'compiled', 'annotated'])
+    fixture = Fixture()
+    print('%s calls' % calls)
+    for name in ('legacy', 'compiled', 'annotated'):
+        seconds = best_of(lambda: context.target_for(fixture, name)(
+            '12', '1.5', 'true'), calls)
+        print('%-10s %12.0f calls/s' % (name, 1 / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,42 @@
+'''
+Benchmark the conversion of table arguments: converters.convert_table, as a
+tuple of values per column and (if numpy is installed) as numpy arrays,
+against converting each cell with the from_string of its column's
+converter, as table fixtures otherwise do.
+
+    python -m waferslim.bench.columns [rows]
+'''
+import sys
+from .. import converters
+from . import best_of, report
+
+
+def per_cell(rows, to_types):
+    ''' Convert each cell of each row in turn '''
+    from_strings = [converters.converter_for(to_type).from_string
+                    for to_type in to_types]
+    return [[from_string(cell) for from_string, cell in zip(from_strings, row)]
+            for row in rows]
+
+
+def main(rows=10000):
+    ''' Run the benchmark for a table of int, float and bool columns '''
+    to_types = (int, float, bool)
+    table = [[str(row), '%s.25' % row, row % 3 and 'true' or 'false']
+             for row in range(rows)]
+    assert per_cell(table, to_types) == \
+        converters.convert_table(table, to_types)
+    print('%s rows x %s columns' % (rows, len(to_types)))
+    baseline = best_of(lambda: per_cell(table, to_types), 1)
+    report('from_string per cell', baseline)
+    report('convert_table', best_of(
+        lambda: converters.convert_table(table, to_types), 1), baseline)
+    report('convert_table, columns', best_of(
+        lambda: converters.convert_table(table, to_types, as_array=True),
+        1), baseline)
+    if converters.numpy is None:
+        print('numpy is not installed: columns are tuples')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
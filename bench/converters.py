@@ -0,0 +1,69 @@
+'''
+Benchmark converters.to_string throughput, as used to stringify every
+result, against the previous lookup: a thread-local registry check, then
+the registered converter for the value itself, then for its exact type.
+
+    python -m waferslim.bench.converters [values]
+'''
+import datetime
+import sys
+import threading
+from .. import converters
+from . import best_of
+
+_LEGACY_CONVERTERS = {
+    bool: converters.TrueFalseConverter(),
+    int: converters.FromConstructorConverter(int),
+    float: converters.FromConstructorConverter(float),
+    datetime.date: converters.DateConverter(),
+    list: converters.IterableConverter(),
+    str: converters.StrConverter(),
+}
+
+
+_THREADLOCAL = threading.local()
+
+
+def _init_converters():
+    ''' As converters.__init_converters used to, per thread '''
+    if hasattr(_THREADLOCAL, 'converters'):
+        return
+    _THREADLOCAL.converters = dict(_LEGACY_CONVERTERS)
+
+
+def _strict_converter_for(type_or_value):
+    ''' The lookup converters._strict_converter_for used to do '''
+    _init_converters()
+    try:
+        return _THREADLOCAL.converters[type_or_value]
+    except (KeyError, TypeError):
+        return _THREADLOCAL.converters[type(type_or_value)]
+
+
+def legacy_to_string(value, using=None):
+    ''' The to_string used to be, minus converters for types not used in
+    this benchmark '''
+    if using and hasattr(using, 'to_string'):
+        return using.to_string(value)
+    try:
+        converter = _strict_converter_for(value)
+    except KeyError:
+        converter = converters._DEFAULT_CONVERTER
+    return converter.to_string(value)
+
+
+def main(values=100000):
+    ''' Run the benchmark for each kind of value '''
+    samples = [('str', 'some text'), ('int', 12345), ('bool', True),
+               ('float', 1.5), ('date', datetime.date(2010, 1, 2)),
+               ('object', object())]
+    print('%s values' % values)
+    for name, value in samples:
+        legacy = best_of(lambda: legacy_to_string(value), values)
+        current = best_of(lambda: converters.to_string(value), values)
+        print('%-10s %12.0f/s -> %12.0f/s  (x%.2f)' % (
+            name, 1 / legacy, 1 / current, legacy / current))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,79 @@
+'''
+Benchmark the date, time and datetime converters against the previous
+datetime.strptime() based conversion (trying the format with microseconds
+first, then without), for a column of distinct values and for a column
+repeating a few values, as date-heavy tables tend to.
+
+    python -m waferslim.bench.dates [values]
+'''
+import datetime
+import sys
+from .. import converters
+from . import best_of, report
+
+
+def legacy_date(value):
+    ''' The DateConverter.from_string there used to be '''
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def legacy_time(value):
+    ''' The TimeConverter.from_string there used to be '''
+    try:
+        return datetime.datetime.strptime(value, '%H:%M:%S.%f').time()
+    except ValueError:
+        return datetime.datetime.strptime(value, '%H:%M:%S').time()
+
+
+def legacy_datetime(value):
+    ''' The DatetimeConverter.from_string there used to be '''
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def main(values=10000):
+    ''' Run the benchmark for columns of values '''
+    start = datetime.datetime(2010, 1, 1)
+    moments = [start + datetime.timedelta(seconds=37 * n, microseconds=n)
+               for n in range(values)]
+    samples = (
+        ('date', legacy_date, converters.DateConverter,
+         [str(moment.date() + datetime.timedelta(days=n))
+          for n, moment in enumerate(moments)]),
+        ('time', legacy_time, converters.TimeConverter,
+         [str(moment.time().replace(microsecond=0)) for moment in moments]),
+        ('time.micros', legacy_time, converters.TimeConverter,
+         [str(moment.time()) for moment in moments]),
+        ('datetime', legacy_datetime, converters.DatetimeConverter,
+         [str(moment.replace(microsecond=0)) for moment in moments]),
+        ('datetime.micros', legacy_datetime, converters.DatetimeConverter,
+         [str(moment) for moment in moments]),
+    )
+    print('%s values' % values)
+    for name, legacy, converter_class, column in samples:
+        converter = converter_class()
+        assert [legacy(value) for value in column] == \
+            [converter.from_string(value) for value in column]
+        baseline = best_of(lambda: [legacy(value) for value in column], 1)
+
+        def distinct():
+            converter_class._parsed.clear()
+            return [converter.from_string(value) for value in column]
+        repeated = column[:10] * (values // 10)
+        report('%s: strptime' % name, baseline)
+        report('%s: parser' % name, best_of(distinct, 1), baseline)
+        report('%s: parser, repeated values' % name, best_of(
+            lambda: [converter.from_string(value) for value in repeated], 1),
+            baseline)
+        parsed = [converter.from_string(value) for value in column]
+        baseline = best_of(lambda: [str(value) for value in parsed], 1)
+        report('%s: str()' % name, baseline)
+        report('%s: to_string' % name, best_of(
+            lambda: [converter.to_string(value) for value in parsed], 1),
+            baseline)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
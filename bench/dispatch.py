@@ -0,0 +1,61 @@
+'''
+Benchmark the resolution of the method to call for each call instruction:
+ExecutionContext.target_for, with its dispatch cache, against the previous
+alias lookup followed by hasattr() and getattr() -- both on their own and
+as part of executing Call instructions.
+
+    python -m waferslim.bench.dispatch [calls]
+'''
+import os
+import sys
+from .. import execution, instructions
+from . import best_of
+
+_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                        'tests', 'fixtures', 'echo_fixture.py')
+
+
+def legacy_target_for(aliases, instance, method_name):
+    ''' The method resolution that target_for used to do '''
+    class_name = instance.__class__.__name__
+    method_name = aliases[class_name][method_name]
+    if hasattr(instance, method_name):
+        return getattr(instance, method_name)
+    else:
+        return None
+
+
+def main(calls=100000):
+    ''' Run the benchmark '''
+    context = execution.ExecutionContext()
+    context.import_path(_FIXTURE)
+    echoer = context.get_type('EchoFixture')()
+    context.store_instance('echoer', echoer)
+    aliases = {'EchoFixture': execution.ExecutionContext.get_aliases(
+        context.methods[type(echoer)])}
+
+    def legacy():
+        legacy_target_for(aliases, echoer, 'echo')('x')
+
+    def cached():
+        context.target_for(echoer, 'echo')('x')
+
+    call = instructions.Call('call_1', ['echoer', 'echo', 'x'])
+    results = execution.Results()
+
+    def execute():
+        call.execute(context, results)
+        del results._collected[:]
+
+    print('%s calls' % calls)
+    for name, fn in (('alias + hasattr + getattr', legacy),
+                     ('target_for (dispatch cache)', cached)):
+        seconds = best_of(fn, calls)
+        print('%-30s %12.0f calls/s' % (name, 1 / seconds))
+
+    seconds = best_of(execute, calls)
+    print('%-30s %12.0f calls/s' % ('Call.execute', 1 / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
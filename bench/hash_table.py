@@ -0,0 +1,74 @@
+'''
+Benchmark the round trip of a dict through DictConverter: to_string, then
+from_string with its single-pass parser, against parsing with an
+HTMLParser subclass, for hash tables of a few thousand rows, and with a
+nested hash table in every 10th row.
+
+    python -m waferslim.bench.hash_table [rows]
+'''
+import sys
+from six.moves.html_parser import HTMLParser
+from .. import converters
+from . import best_of, report
+
+
+class LegacyParser(HTMLParser):
+    ''' An html parser collecting the cells of the rows of the outermost
+    table, keeping nested tables as markup '''
+    def to_dict(self, markup):
+        ''' Parse markup into a dict '''
+        self._dict, self._cells, self._depth, self._cell = {}, [], 0, None
+        self.feed(markup)
+        self.close()
+        return self._dict
+
+    def handle_starttag(self, tag, attrs):
+        ''' Start a cell, or a table, or keep a tag nested in a cell '''
+        if tag == 'table':
+            self._depth += 1
+        if self._depth == 1 and tag == 'td':
+            self._cell = []
+        elif self._cell is not None:
+            self._cell.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        ''' End a cell, row or table, or keep a tag nested in a cell '''
+        if self._depth == 1 and tag == 'td':
+            self._cells.append(''.join(self._cell).strip())
+            self._cell = None
+        elif self._depth == 1 and tag == 'tr':
+            if len(self._cells) >= 2:
+                self._dict[self._cells[0]] = self._cells[1]
+            self._cells = []
+        elif self._cell is not None:
+            self._cell.append('</%s>' % tag)
+        if tag == 'table':
+            self._depth -= 1
+
+    def handle_data(self, data):
+        ''' Keep the text of a cell '''
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def main(rows=5000):
+    ''' Run the benchmark for hash tables of rows name,value pairs '''
+    converter = converters.DictConverter()
+    flat = dict(('name %s' % row, 'value %s' % row) for row in range(rows))
+    nested = dict(flat)
+    for row in range(0, rows, 10):
+        nested['name %s' % row] = {'inner': row, 'other': 'x'}
+    print('%s rows' % rows)
+    for name, a_dict in (('flat', flat), ('nested', nested)):
+        markup = converter.to_string(a_dict)
+        assert LegacyParser().to_dict(markup) == converter.from_string(markup)
+        baseline = best_of(lambda: LegacyParser().to_dict(markup), 1)
+        report('%s: HTMLParser' % name, baseline)
+        report('%s: from_string' % name, best_of(
+            lambda: converter.from_string(markup), 1), baseline)
+        report('%s: to_string + from_string' % name, best_of(
+            lambda: converter.from_string(converter.to_string(a_dict)), 1))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
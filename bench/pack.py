@@ -0,0 +1,41 @@
+'''
+Benchmark protocol.pack_response() against packing a response with pack()
+then encoding and framing it, as RequestResponder used to do.
+
+    python -m waferslim.bench.pack [rows] [columns]
+'''
+import sys
+from . import best_of, report
+from .. import protocol
+
+
+def table_results(rows, columns, cell=u'cell'):
+    ''' Results as returned from a single call to a table fixture '''
+    table = [[u'pass:%s_%s_%s' % (cell, row, col) for col in range(columns)]
+             for row in range(rows)]
+    return [[u'make_0', u'OK'], [u'call_0', table]]
+
+
+def format_response(results):
+    ''' The previous pack, encode, measure, frame and re-encode sequence '''
+    msg = protocol.pack(results)
+    msg_bytes = msg.encode('utf-8')
+    response_str = u'%06d:%s' % (len(msg_bytes), msg)
+    return response_str.encode('utf-8')
+
+
+def main(rows=2000, columns=10):
+    ''' Run the benchmark for an ascii and a multibyte utf-8 table '''
+    for label, cell in (('ascii', u'cell'), ('utf-8', u'c\xe9ll€')):
+        results = table_results(rows, columns, cell)
+        assert format_response(results) == protocol.pack_response(results)
+        print('%s table %sx%s, %s bytes' % (
+            label, rows, columns, len(protocol.pack_response(results))))
+        baseline = best_of(lambda: format_response(results), 5)
+        report('pack() + format', baseline)
+        report('pack_response()',
+               best_of(lambda: protocol.pack_response(results), 5), baseline)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,88 @@
+'''
+Benchmark the time from connecting to the response to the first make
+instruction -- the import of a fixture module and the make of one of its
+classes -- with and without the fixture module preloaded at startup.
+
+The fixture module is generated, with a number of classes and methods, and
+imports some larger standard library modules, as real fixtures do.
+
+    python -m waferslim.bench.preload [classes] [sessions]
+'''
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from .. import execution, protocol
+from .reader import loopback_pair
+
+_FIXTURE_HEADER = '''
+import decimal, email.parser, json, xml.dom.minidom
+'''
+_FIXTURE_CLASS = '''
+class Fixture%(n)s(object):
+''' + ''.join('''
+    def method_%%(n)s_%(m)s(self, value):
+        return value
+''' % {'m': m} for m in range(20))
+
+
+def write_fixture(directory, classes):
+    ''' Write a fixture module with classes, returning its path '''
+    path = os.path.join(directory, 'bench_fixture.py')
+    with open(path, 'w') as fixture:
+        fixture.write(_FIXTURE_HEADER)
+        for n in range(classes):
+            fixture.write(_FIXTURE_CLASS % {'n': n})
+    return path
+
+
+def first_make(path):
+    ''' Time from connecting to the response to import and make '''
+    message = protocol.pack([
+        [u'import_1', u'import', path],
+        [u'make_1', u'make', u'fixture', u'Fixture0'],
+    ])
+    body = message.encode('utf-8')
+    start = time.time()
+    client, server = loopback_pair()
+    responder = protocol.RequestResponder()
+    responder.request = server
+    thread = threading.Thread(target=responder.respond_to_request)
+    thread.start()
+    client.sendall(b'%06d:' % len(message) + body)
+    reader = protocol.MessageReader(client)
+    reader.read_chars(len(protocol._VERSION))
+    response = reader.read_response()
+    elapsed = time.time() - start
+    client.sendall(b'000003:bye')
+    thread.join()
+    client.close()
+    server.close()
+    assert response.count(b':OK:') == 2, response
+    return elapsed
+
+
+def main(classes=200, sessions=20):
+    ''' Run the benchmark for a fixture module with classes '''
+    directory = tempfile.mkdtemp()
+    try:
+        path = write_fixture(directory, classes)
+        print('fixture module with %s classes, best of %s sessions' %
+              (classes, sessions))
+        cold = min(first_make(path) for _ in range(sessions))
+        print('%-30s %10.3f ms' % ('import per session', cold * 1000))
+        start = time.time()
+        execution.preload([path])
+        print('%-30s %10.3f ms' % ('preload (once)',
+                                   (time.time() - start) * 1000))
+        warm = min(first_make(path) for _ in range(sessions))
+        print('%-30s %10.3f ms  (x%.2f)' % ('preloaded', warm * 1000,
+                                            cold / warm))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
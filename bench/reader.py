@@ -0,0 +1,98 @@
+'''
+Benchmark protocol.MessageReader against the previous recv()-based reading
+of messages, over a loopback TCP connection: recv syscalls per message and
+throughput. The sender waits for a one byte reply after each message, as
+a slim client waits for its response.
+
+    python -m waferslim.bench.reader [message_kb] [messages]
+'''
+import socket
+import sys
+import threading
+import time
+from .. import protocol
+
+
+class CountingSocket(object):
+    ''' Wrap a socket to count the recv / recv_into calls made on it '''
+    def __init__(self, sock):
+        self._sock = sock
+        self.calls = 0
+
+    def recv(self, size):
+        self.calls += 1
+        return self._sock.recv(size)
+
+    def recv_into(self, buf):
+        self.calls += 1
+        return self._sock.recv_into(buf)
+
+
+class LegacyReader(object):
+    ''' The message reading that RequestResponder used to do '''
+    def __init__(self, sock):
+        self._sock = sock
+
+    def read_message(self):
+        length = int(self._sock.recv(7).decode('utf-8')[0:6])
+        parts = []
+        remaining = length
+        while remaining > 0:
+            data = self._sock.recv(4098)
+            parts.append(data)
+            remaining -= len(data)
+        return b''.join(parts)
+
+
+def loopback_pair():
+    ''' A connected pair of TCP sockets on 127.0.0.1 '''
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def run(reader_type, message, count):
+    ''' Time reading count messages with a reader_type, returning the
+    elapsed seconds and the number of recv calls made '''
+    client, server = loopback_pair()
+    counting = CountingSocket(server)
+    reader = reader_type(counting)
+
+    def send():
+        for _ in range(count):
+            client.sendall(message)
+            client.recv(1)
+
+    sender = threading.Thread(target=send)
+    sender.daemon = True
+    start = time.time()
+    sender.start()
+    for _ in range(count):
+        reader.read_message()
+        server.sendall(b'.')
+    sender.join()
+    elapsed = time.time() - start
+    client.close()
+    server.close()
+    return elapsed, counting.calls
+
+
+def main(message_kb=512, count=50):
+    ''' Run the benchmark for one message size '''
+    body = u'[%s]' % (u'x' * (message_kb * 1024 - 2))
+    message = (u'%06d:%s' % (len(body), body)).encode('utf-8')
+    print('%s messages of %s KB' % (count, message_kb))
+    for name, reader_type in (('recv(4098) loop', LegacyReader),
+                              ('MessageReader', protocol.MessageReader)):
+        elapsed, calls = run(reader_type, message, count)
+        print('%-20s %8.1f recv calls/message %10.1f MB/s' % (
+            name, float(calls) / count,
+            len(message) * count / elapsed / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
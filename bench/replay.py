@@ -0,0 +1,328 @@
+'''
+Benchmark whole Slim sessions end to end by replaying recorded traffic: the
+messages of each session are sent one at a time, each waiting for its
+response as a slim client does, and the throughput, per message latency
+and peak memory use are reported.
+
+    python -m waferslim.bench replay FILE [options]
+
+FILE holds JSON lines, one per message received, in the order received:
+
+    {"request_id": "1-3", "session": 1, "body": "<message>", ...}
+
+where "body" is the message (without its length header) and "session"
+groups the messages into sessions (all one session if absent). Any other
+keys, such as the response and timings written by the server's --record
+option, are ignored. Each session is ended with a "bye" message.
+
+Sessions are replayed either in-process, against a RequestResponder over
+a socketpair, or over loopback TCP against a server started for each
+session -- which may be another implementation of waferslim (a directory
+to add to PYTHONPATH, in which there is a waferslim package) or another
+git revision of this one, so that the two can be compared on realistic
+traffic. The servers of this tree and of the one compared with take their
+own extra options (--server-args and --compare-server-args), as options
+added since may not be understood by the other.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+from .. import protocol
+
+try:
+    import resource
+except ImportError:  # not POSIX: peak RSS is not reported in-process
+    resource = None
+
+SOCKETPAIR = 'socketpair'
+TCP = 'tcp'
+_BYE = u'bye'
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SERVER_START_TIMEOUT = 30  # seconds to wait for a spawned server to listen
+
+
+def load(path):
+    ''' The sessions recorded in a file: a list of lists of messages '''
+    sessions = []
+    by_name = {}
+    with open(path) as record_file:
+        for line in record_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            body = record.get('body')
+            if body is None or body == _BYE:
+                continue
+            name = record.get('session')
+            if name not in by_name:
+                by_name[name] = []
+                sessions.append(by_name[name])
+            by_name[name].append(body)
+    return sessions
+
+
+class Replay(object):
+    ''' Outcome of replaying sessions: counts, elapsed seconds and the
+    latency of each message '''
+
+    def __init__(self, label):
+        ''' Specify what was replayed against '''
+        self.label = label
+        self.messages = 0
+        self.bytes = 0  # sent and received
+        self.elapsed = 0.0
+        self.latencies = []
+        self.peak_rss = None  # KB
+
+    def add_session(self, sock, messages):
+        ''' Send the messages of a session to a connected socket, timing the
+        response to each; the Slim Version has not been received yet '''
+        reader = protocol.MessageReader(sock)
+        reader.read_chars(len(protocol._VERSION))
+        start = time.time()
+        for message in messages:
+            framed = _frame(message)
+            sent = time.time()
+            sock.sendall(framed)
+            response = reader.read_response()
+            self.latencies.append(time.time() - sent)
+            self.bytes += len(framed) + len(response)
+            self.messages += 1
+        self.elapsed += time.time() - start
+        sock.sendall(_frame(_BYE))
+
+    def percentile(self, percent):
+        ''' The latency that percent of the messages took no longer than '''
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = max(1, int(round(len(ordered) * percent / 100.0)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def report(self, baseline=None):
+        ''' A line reporting the outcome, relative to a baseline Replay '''
+        elapsed = self.elapsed or 1e-9
+        line = '%-24s %8d msgs %10.1f msgs/s %8.2f MB/s ' \
+               'p50 %8.3f ms p99 %8.3f ms' % (
+                   self.label, self.messages, self.messages / elapsed,
+                   self.bytes / elapsed / 1024 / 1024,
+                   self.percentile(50) * 1000, self.percentile(99) * 1000)
+        if self.peak_rss is not None:
+            line += ' RSS %6.1f MB' % (self.peak_rss / 1024.0)
+        if baseline is not None and baseline.elapsed:
+            line += '  (x%.2f)' % (baseline.elapsed / elapsed)
+        return line
+
+
+def _frame(message):
+    ''' The bytes of a message, with its length header '''
+    return (u'%06d:%s' % (len(message), message)).encode(
+        protocol.BYTE_ENCODING)
+
+
+def _kilobytes(maxrss):
+    ''' An ru_maxrss value in KB '''
+    if sys.platform == 'darwin':  # bytes, not KB
+        return maxrss // 1024
+    return maxrss
+
+
+def _wait(process):
+    ''' Wait for a spawned server to stop, returning its peak RSS in KB if
+    known '''
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    usage = os.wait4(process.pid, 0)[2]
+    process.returncode = 0  # reaped here rather than by process.wait()
+    return _kilobytes(usage.ru_maxrss)
+
+
+def replay_socketpair(sessions, syspath=''):
+    ''' Replay the sessions in-process, each against a RequestResponder
+    over a socketpair '''
+    for element in syspath.split(os.pathsep):
+        if element and element not in sys.path:
+            sys.path.append(element)
+    replay = Replay(SOCKETPAIR)
+    for messages in sessions:
+        client, server = socket.socketpair()
+        responder = protocol.RequestResponder()
+        responder.request = server
+        thread = threading.Thread(target=responder.respond_to_request)
+        thread.start()
+        try:
+            replay.add_session(client, messages)
+        finally:
+            thread.join()
+            client.close()
+            server.close()
+    if resource is not None:
+        replay.peak_rss = _kilobytes(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    return replay
+
+
+def replay_tcp(sessions, pythonpath=None, syspath='', label=TCP,
+               server_args=()):
+    ''' Replay the sessions over loopback TCP, each against a server started
+    for it with the waferslim package found in pythonpath (by default, this
+    one) and stopping at the end of the session '''
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [pythonpath or os.path.dirname(_PACKAGE_DIR)]
+        + [path for path in [environment.get('PYTHONPATH')] if path])
+    replay = Replay(label)
+    for messages in sessions:
+        port = _free_port()
+        command = [sys.executable, '-m', 'waferslim.server',
+                   '--inethost', '127.0.0.1', '--port', str(port)] \
+            + list(server_args)
+        if syspath:
+            command += ['--syspath', syspath]
+        process = subprocess.Popen(command, env=environment)
+        try:
+            sock = _connect(port, process)
+            try:
+                replay.add_session(sock, messages)
+            finally:
+                sock.close()
+            peak_rss = _wait(process)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        if peak_rss is not None:
+            replay.peak_rss = max(replay.peak_rss or 0, peak_rss)
+    return replay
+
+
+def _free_port():
+    ''' A port on 127.0.0.1 that nothing is listening on (for now) '''
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _connect(port, process):
+    ''' Connect to a spawned server once it is listening on port '''
+    deadline = time.time() + _SERVER_START_TIMEOUT
+    while True:
+        try:
+            return socket.create_connection(('127.0.0.1', port))
+        except socket.error:
+            if process.poll() is not None or time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def checkout(revision, directory):
+    ''' Export a git revision of waferslim into directory/waferslim,
+    returning directory, for use as pythonpath '''
+    target = os.path.join(directory, 'waferslim')
+    os.makedirs(target)
+    archive = subprocess.Popen(['git', 'archive', revision],
+                               cwd=_PACKAGE_DIR, stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', target], stdin=archive.stdout)
+    archive.stdout.close()
+    if archive.wait():
+        raise ValueError('Cannot export git revision %s' % revision)
+    return directory
+
+
+def best(replays):
+    ''' The fastest of several Replay-s '''
+    return min(replays, key=lambda replay: replay.elapsed)
+
+
+def _get_options(args):
+    ''' Parse the command line '''
+    parser = OptionParser(usage='python -m waferslim.bench replay FILE '
+                                '[options]')
+    parser.add_option('--mode', dest='mode', type='choice',
+                      choices=[SOCKETPAIR, TCP, 'both'], default='both',
+                      help='replay in-process over a "socketpair", over '
+                           'loopback "tcp" to a spawned server, or "both" '
+                           '(default: both)')
+    parser.add_option('--repeat', dest='repeat',
+                      metavar='N', type='int', default=3,
+                      help='replay N times, reporting the fastest '
+                           '(default: 3)')
+    parser.add_option('-s', '--syspath', dest='syspath',
+                      metavar='SYSPATH', default='',
+                      help='add entries from SYSPATH to sys.path, to find '
+                           'the fixtures')
+    parser.add_option('--compare', dest='compare',
+                      metavar='REVISION|DIR', default='',
+                      help='also replay over tcp against the waferslim of a '
+                           'git REVISION, or of DIR on PYTHONPATH')
+    parser.add_option('--server-args', dest='server_args',
+                      metavar='ARGS', default='',
+                      help='extra options for the spawned servers of this '
+                           'tree, e.g. "--lazy --streaming"')
+    parser.add_option('--compare-server-args', dest='compare_server_args',
+                      metavar='ARGS', default='',
+                      help='with --compare, extra options for the spawned '
+                           'servers compared with')
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error('a single FILE to replay is required')
+    return options, args[0]
+
+
+def main(args=None):
+    ''' Replay a file of recorded sessions and report the outcome '''
+    options, path = _get_options(sys.argv[1:] if args is None else args)
+    sessions = load(path)
+    server_args = options.server_args.split()
+    compare_server_args = options.compare_server_args.split()
+    print('%s: %s sessions, %s messages' % (
+        path, len(sessions), sum([len(messages) for messages in sessions])))
+    if options.mode in (SOCKETPAIR, 'both'):
+        print(best([replay_socketpair(sessions, options.syspath)
+                    for _ in range(options.repeat)]).report())
+    if options.mode not in (TCP, 'both') and not options.compare:
+        return
+    if not options.compare:
+        print(best([replay_tcp(sessions, syspath=options.syspath,
+                               server_args=server_args)
+                    for _ in range(options.repeat)]).report())
+        return
+    directory = None
+    if os.path.isdir(options.compare):
+        pythonpath = os.path.abspath(options.compare)
+    else:
+        directory = tempfile.mkdtemp()
+        pythonpath = checkout(options.compare, directory)
+    try:
+        label = ('%s %s' % (TCP, options.compare))[:24]
+        replays, baselines = [], []
+        for _ in range(options.repeat):  # interleaved, to share any drift
+            baselines.append(replay_tcp(sessions, pythonpath,
+                                        options.syspath, label,
+                                        compare_server_args))
+            replays.append(replay_tcp(sessions, syspath=options.syspath,
+                                      server_args=server_args))
+        baseline = best(baselines)
+        print(baseline.report())
+        print(best(replays).report(baseline))
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
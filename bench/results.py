@@ -0,0 +1,69 @@
+'''
+Benchmark collecting the results of a message's instructions and framing
+the response: protocol.FrameResults, which encodes each result into the
+frame as it is added, against the previous Results (comparing each result
+with == to NO_RESULT_EXPECTED), its copied collection(), a repr of that
+for the debug log, then pack_response().
+
+    python -m waferslim.bench.results [instructions]
+'''
+import sys
+from .. import execution, protocol
+from ..converters import to_string
+from . import best_of, report
+
+
+class LegacyResults(object):
+    ''' The Results there used to be '''
+    NO_RESULT_EXPECTED = execution.Results.NO_RESULT_EXPECTED
+
+    def __init__(self):
+        self._collected = []
+
+    def completed(self, instruction, result=NO_RESULT_EXPECTED):
+        if result == LegacyResults.NO_RESULT_EXPECTED:
+            str_result = 'OK'
+        elif result is None:
+            str_result = '/__VOID__/'
+        else:
+            str_result = to_string(result)
+        self._collected.append([instruction.instruction_id(), str_result])
+
+    def collection(self):
+        collected = []
+        collected.extend(self._collected)
+        return collected
+
+
+def main(instructions=10000):
+    ''' Run the benchmark for a message of instructions returning nothing,
+    a str or a row of a table '''
+    calls = [execution.Instruction(u'call_%s' % n, []) for n in
+             range(instructions)]
+    values = [execution.Results.NO_RESULT_EXPECTED, u'some value',
+              [u'pass', u'fail:42', u'']]
+
+    def legacy():
+        results = LegacyResults()
+        for n, call in enumerate(calls):
+            results.completed(call, values[n % 3])
+        collection = results.collection()
+        'Results: %r' % collection
+        return protocol.pack_response(collection)
+
+    def framed():
+        results = protocol.FrameResults()
+        for n, call in enumerate(calls):
+            results.completed(call, values[n % 3])
+        'Sending %s results' % results.count
+        return results.frame()
+
+    assert legacy() == framed()
+    print('%s instructions' % instructions)
+    baseline = best_of(legacy, 5)
+    report('Results + repr + pack_response', baseline)
+    report('FrameResults', best_of(framed, 5), baseline)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,55 @@
+'''
+Benchmark the substitution of symbols into the arguments of each row of a
+table: ParamsConverter's cached templates against the previous regular
+expression substitution of every argument, for a table without symbols and
+one with symbols in every cell.
+
+    python -m waferslim.bench.symbols [rows] [columns]
+'''
+import re
+import sys
+from .. import execution
+from . import best_of, report
+
+_SYMBOL_PATTERN = re.compile('\\$([a-zA-Z]\\w*)+', re.UNICODE)
+
+
+def legacy_to_args(context, params):
+    ''' The substitution ParamsConverter.to_args used to do '''
+    def match(match):
+        return context.get_symbol(match.groups()[0])
+
+    def lookup(possible_symbol):
+        if isinstance(possible_symbol, list):
+            return legacy_to_args(context, possible_symbol)
+        return _SYMBOL_PATTERN.sub(match, possible_symbol, re.S)
+    return tuple([lookup(param) for param in params])
+
+
+def main(rows=1000, columns=10):
+    ''' Run the benchmark for tables of rows x columns '''
+    context = execution.ExecutionContext()
+    for column in range(columns):
+        context.store_symbol('symbol%s' % column, 'value %s' % column)
+    tables = {
+        'no symbols': [['cell %s %s' % (row, column)
+                        for column in range(columns)]
+                       for row in range(rows)],
+        'symbols': [['$symbol%s' % column if row % 2 else
+                     'cell $symbol%s of %s' % (column, row)
+                     for column in range(columns)]
+                    for row in range(rows)],
+    }
+    print('%s rows x %s columns' % (rows, columns))
+    for name in sorted(tables):
+        table = tables[name]
+        legacy = best_of(lambda: [legacy_to_args(context, row)
+                                  for row in table], 10)
+        cached = best_of(lambda: [context.to_args(row, 0)
+                                  for row in table], 10)
+        report('%s: re.sub' % name, legacy)
+        report('%s: templates' % name, cached, legacy)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+'''
+Benchmark the cost of tracing the execution of a message of call
+instructions: with tracing disabled, enabled, and (for comparison) logging
+a repr of each instruction at debug level instead, as used to be done when
+verbose -- and of collecting latency statistics for each call.
+
+    python -m waferslim.bench.tracing [calls]
+'''
+import logging
+import os
+import sys
+from .. import execution, protocol, stats, tracing
+from . import best_of, report
+
+_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                        'tests', 'fixtures', 'echo_fixture.py')
+
+
+def main(calls=1000):
+    ''' Run the benchmark for a message of calls '''
+    context = execution.ExecutionContext()
+    context.import_path(_FIXTURE)
+    context.store_instance('echoer', context.get_type('EchoFixture')())
+    unpacked = [[u'call_%s' % n, u'call', u'echoer', u'echo', u'x']
+                for n in range(calls)]
+
+    def execute():
+        execution.Instructions([list(item) for item in unpacked]).execute(
+            context, protocol.FrameResults())
+
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    def execute_logging():
+        results = protocol.FrameResults()
+        for item in unpacked:
+            instruction = execution.instruction_for(list(item))
+            logger.debug('Executing %r' % instruction)
+            instruction.execute(context, results)
+
+    print('%s calls' % calls)
+    tracing.disable()
+    baseline = best_of(execute, 10)
+    report('tracing disabled', baseline)
+    trace = tracing.enable(10000)
+    report('tracing enabled', best_of(execute, 10), baseline)
+    tracing.disable()
+    report('logging debug repr', best_of(execute_logging, 10), baseline)
+    timings = stats.enable()
+    report('stats enabled', best_of(execute, 10), baseline)
+    stats.disable()
+    report('formatting the trace', best_of(
+        lambda: [trace.format(event) for event in trace.events()], 10))
+    report('stats report', best_of(timings.report, 10))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,62 @@
+'''
+Benchmark protocol.unpack_bytes() against the string based protocol.unpack()
+on decision-table sized messages: time per message and peak memory allocated
+while unpacking (which includes the decoded copy made for unpack()), and
+also for a lazy unpack whose table argument is passed to the fixture, as
+the server does, but never used.
+
+    python -m waferslim.bench.unpack [rows] [columns]
+'''
+import sys
+import tracemalloc
+from . import best_of, report
+from .. import execution, protocol
+
+
+def table_message(rows, columns, cell=u'cell'):
+    ''' A message with a single call passing a rows x columns table '''
+    table = [[u'%s_%s_%s' % (cell, row, col) for col in range(columns)]
+             for row in range(rows)]
+    return protocol.pack([[u'call_0', u'call', u'table', u'doTable', table]])
+
+
+def peak_memory(fn):
+    ''' Peak bytes allocated while calling fn '''
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(rows=2000, columns=10):
+    ''' Run the benchmark for small and large, ascii and multibyte utf-8
+    table cells '''
+    for label, size, cell in (('ascii', rows, u'cell'),
+                              ('utf-8', rows, u'c\xe9ll€'),
+                              ('large cell', rows // 40, u'cell' * 200),
+                              ('large utf-8 cell', rows // 40,
+                               u'c\xe9ll€' * 200)):
+        packed_bytes = table_message(size, columns, cell).encode('utf-8')
+        print('%s table %sx%s, %s bytes' % (label, size, columns,
+                                            len(packed_bytes)))
+        old = lambda: protocol.unpack(packed_bytes.decode('utf-8'))
+        new = lambda: protocol.unpack_bytes(packed_bytes)
+        assert old() == new()
+        baseline = best_of(old, 5)
+        report('unpack(decode(bytes))', baseline)
+        report('unpack_bytes(bytes)', best_of(new, 5), baseline)
+        print('%-40s %10.1f KB' % ('peak memory unpack(decode(bytes))',
+                                   peak_memory(old) / 1024.0))
+        print('%-40s %10.1f KB' % ('peak memory unpack_bytes(bytes)',
+                                   peak_memory(new) / 1024.0))
+        context = execution.ExecutionContext()
+        lazy = lambda: [context.to_args(instruction, 4) for instruction in
+                        protocol.unpack_bytes(packed_bytes, lazy=True)]
+        print('%-40s %10.1f KB' % ('peak memory lazy (table not used)',
+                                   peak_memory(lazy) / 1024.0))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -20,32 +20,41 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved
 '''
-import datetime, threading
+import datetime, re, threading
+import six
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from .slim_exceptions import WaferSlimException
 
-__THREADLOCAL = threading.local()
-
-class _ReIterable(object):
-    ''' Class to allow repeatable iteration over to_type / using converters '''
-    def __init__(self, underlying):
-        ''' Specify the iterable for repeatable iteration '''
-        self._underlying = underlying
-    def reset(self, num_params):
-        ''' Reset iteration and note num_params supplied in method call '''
-        self._num_params = num_params
-        try:
-            self._iterator = iter(self._underlying)
-        except TypeError:
-            self._iterator = None
-        return True
-    def next(self):
-        ''' Get next value from the iterable '''
-        try:
-            return self._iterator and next(self._iterator) or self._underlying
-        except StopIteration:
+def _compile_conversion(converters):
+    ''' Compile converters -- one converter for every value, or an iterable
+    with a converter for each value in turn -- into a function converting a
+    sequence of str values into a tuple. The function holds no state, so
+    may be called from several threads at once. '''
+    try:
+        from_strings = tuple([converter.from_string
+                              for converter in converters])
+    except TypeError:
+        from_string = _from_string_function(converters)
+        return lambda values: tuple(map(from_string, values))
+
+    def convert(values):
+        ''' Convert each value with the converter for its position '''
+        if len(values) > len(from_strings):
             msg = '%s to_type or using args insufficient to convert %s params'
-            raise WaferSlimException(msg % (len(self._underlying),
-                                            self._num_params))
+            raise WaferSlimException(msg % (len(from_strings), len(values)))
+        return tuple([from_string(value)
+                      for from_string, value in zip(from_strings, values)])
+    return convert
+
+def _from_string_function(converter):
+    ''' The function to convert a str value with converter: its type itself
+    for a FromConstructorConverter, saving a method call per value '''
+    if type(converter) is FromConstructorConverter:
+        return converter._type
+    return converter.from_string
 
 class TableTableConstants(object):
     ''' String constants for returning results from a TableTable '''
@@ -79,7 +88,7 @@ class Converter(object):
 
     def to_string(self, value):
         ''' Use default str() to convert from a value into a string '''
-        if isinstance(value, str) or isinstance(value, unicode):
+        if isinstance(value, six.string_types):
             return value
         return str(value)
 
@@ -133,18 +142,64 @@ class FromConstructorConverter(Converter):
         ''' Delegate to the type(str) constructor to perform the conversion '''
         return self._type(value)
 
-class DateConverter(Converter):
+# Regular expressions matching exactly what datetime.strptime() matches for
+# the %Y-%m-%d, %H:%M:%S and .%f parts of the formats below, which it
+# compiles with re.IGNORECASE and with each space in the format as \s+
+_DATE_PATTERN = '(\\d\\d\\d\\d)-(1[0-2]|0[1-9]|[1-9])' \
+    '-(3[0-1]|[1-2]\\d|0[1-9]|[1-9]| [1-9])'
+_TIME_PATTERN = '(2[0-3]|[0-1]\\d|\\d):([0-5]\\d|\\d)' \
+    ':(6[0-1]|[0-5]\\d|\\d)(?:\\.([0-9]{1,6}))?'
+_MAX_PARSED = 10000
+
+def _parser(pattern, construct, microseconds=False):
+    ''' A function parsing a str that wholly matches pattern into
+    construct(*ints of its groups), raising ValueError as strptime would for
+    anything else. With microseconds the last group is optional, and padded
+    on the right with 0s as strptime does '''
+    match = re.compile(pattern, re.IGNORECASE).match
+    def parse(value):
+        ''' Parse value, as strptime would '''
+        found = match(value)
+        if found is None or found.end() != len(value):
+            raise ValueError('%r does not match format %r' % (value, pattern))
+        if not microseconds:
+            return construct(*[int(group) for group in found.groups()])
+        groups = found.groups()
+        fields = [int(group) for group in groups[:-1]]
+        fields.append(int(((groups[-1] or '') + '000000')[:6]))
+        return construct(*fields)
+    return parse
+
+class _ParsingConverter(Converter):
+    ''' Base class for converters that parse values with their _parse
+    function, remembering (up to _MAX_PARSED of) the values parsed by all
+    instances of the class. Only for types whose values are immutable. '''
+
+    def from_string(self, value):
+        ''' The parsed value, from the memo if the str was parsed before '''
+        try:
+            return self._parsed[value]
+        except KeyError:
+            parsed = self._parse(value)
+        if len(self._parsed) >= _MAX_PARSED:
+            self._parsed.clear()
+        self._parsed[value] = parsed
+        return parsed
+
+    def to_string(self, value):
+        ''' Use the iso-standard format '''
+        return value.isoformat()
+
+class DateConverter(_ParsingConverter):
     ''' Converter to/from datetime.date type via iso-standard format
     (4digityear-2digitmonth-2digitday, e.g. 2009-02-28) '''
 
     DATE_FORMAT = '%Y-%m-%d'
 
-    def from_string(self, value):
-        ''' Generate datetime.date from iso-standard format str '''
-        return datetime.datetime.strptime(value,
-                                          DateConverter.DATE_FORMAT).date()
+    _parsed = {}
+    _parse = staticmethod(_parser(_DATE_PATTERN, datetime.date))
 
-class TimeConverter(Converter):
+class TimeConverter(_ParsingConverter):
     ''' Converter to/from datetime.date type via iso-standard format
     (2digithour:2digitminute:2digitsecond - with or without
     an additional optional .6digitmillis, e.g. 01:02:03 or 01:02:03.456789).
@@ -153,16 +208,10 @@ class TimeConverter(Converter):
     TIME_FORMAT_WITHOUT_MICROSECONDS = '%H:%M:%S'
     TIME_FORMAT_WITH_MICROSECONDS = TIME_FORMAT_WITHOUT_MICROSECONDS + '.%f'
 
-    def from_string(self, value):
-        ''' Generate datetime.time from formatted str '''
-        try:
-            return datetime.datetime.strptime(value,
-                TimeConverter.TIME_FORMAT_WITH_MICROSECONDS).time()
-        except ValueError:
-            return datetime.datetime.strptime(value,
-                TimeConverter.TIME_FORMAT_WITHOUT_MICROSECONDS).time()
+    _parsed = {}
+    _parse = staticmethod(_parser(_TIME_PATTERN, datetime.time, True))
 
-class DatetimeConverter(Converter):
+class DatetimeConverter(_ParsingConverter):
     ''' Converter to/from datetime.datetime type via iso-standard formats
     ("dateformat<space>timeformat", e.g. "2009-02-28 21:54:32.987654"). '''
 
@@ -171,14 +220,13 @@ class DatetimeConverter(Converter):
     FORMAT_WITHOUT_MICROSECONDS = '%s %s' % (DateConverter.DATE_FORMAT,
                                 TimeConverter.TIME_FORMAT_WITHOUT_MICROSECONDS)
 
-    def from_string(self, value):
-        ''' Generate a datetime.datetime from a str '''
-        try:
-            return datetime.datetime.strptime(value,
-                                DatetimeConverter.FORMAT_WITH_MICROSECONDS)
-        except ValueError:
-            return datetime.datetime.strptime(value,
-                                DatetimeConverter.FORMAT_WITHOUT_MICROSECONDS)
+    _parsed = {}
+    _parse = staticmethod(_parser('%s\\s+%s' % (_DATE_PATTERN, _TIME_PATTERN),
+                                  datetime.datetime, True))
+
+    def to_string(self, value):
+        ''' Use the iso-standard format, with a space before the time '''
+        return value.isoformat(' ')
 
 class IterableConverter(Converter):
     ''' Converter to/from an iterable type (e.g. list, tuple).
@@ -199,7 +247,7 @@ class IterableConverter(Converter):
             converters = _converters_for(to_type)
         else:
             converters = _strict_converter_for(to_type)
-        self._converters = _ReIterable(converters)
+        self._convert_items = _compile_conversion(converters)
 
     def to_string(self, iterable_values):
         ''' Generate a list of str values from a list of typed values.
@@ -218,18 +266,44 @@ class IterableConverter(Converter):
         if value.startswith('[') and value.endswith(']'):
             return self.from_string(value[1:len(value)-1])
         items = value.split(',')
-        self._converters.reset(len(items))
-        return tuple([self._convert(item.strip()) for item in items])
-
-    def _convert(self, item):
-        ''' Perform the actual conversion of an item '''
-        return self._converters.next().from_string(item)
+        return self._convert_items([item.strip() for item in items])
 
 class _MarkupHashTableParser(object):
-    ''' Subclass HTMLParser to extract name-value pairs from an html table '''
+    ''' Extract name-value pairs from an html hash table, in a single pass
+    over its table, tr and td tags. The text of the first 2 cells of each
+    row of the outermost table are the name and value; any tables nested in
+    cells are left as markup, to be converted in turn if required. '''
+    _TAG = re.compile('<(/?)(table|tr|td)\\b[^>]*>', re.IGNORECASE)
+
     def to_dict(self, markup):
-        '''I broke it, because I don't understand why it is needed'''
-        return self._dict
+        ''' Generate a dict of name,value str pairs from hash table markup '''
+        a_dict = {}
+        depth = 0
+        cells = []
+        cell_start = None
+        for tag in self._TAG.finditer(markup):
+            closing, name = tag.group(1), tag.group(2).lower()
+            if name == 'table':
+                depth += closing and -1 or 1
+                if depth < 0:
+                    break
+            elif depth != 1:
+                continue
+            elif name == 'tr':  # which may not be closed, in html
+                if len(cells) >= 2:
+                    a_dict[cells[0]] = cells[1]
+                cells = []
+            elif closing:
+                if cell_start is not None:
+                    cells.append(markup[cell_start:tag.start()].strip())
+                cell_start = None
+            else:
+                cell_start = tag.end()
+            if depth == 0:
+                if len(cells) >= 2:
+                    a_dict[cells[0]] = cells[1]
+                return a_dict
+        raise ValueError('%r is not hash table markup' % markup[:100])
 
 class DictConverter(Converter):
     ''' Converter to/from dict type via slim-table format
@@ -281,39 +355,95 @@ class DictConverter(Converter):
                 a_dict[key] = from_string(a_dict[key], to_type_or_using)
         return a_dict
 
+class _Registry(object):
+    ''' Immutable mapping of types to their registered converters, with a
+    cache of the converter resolved for each type looked up: that of the
+    first type in its mro that has one (or none, for the default). '''
+
+    def __init__(self, converters):
+        ''' Specify the (type, converter) items to register '''
+        self._converters = dict(converters)
+        self._resolved = {}
+        self.plain_str = type(self._converters.get(str)) is StrConverter
+
+    def with_converter(self, for_type, converter_instance):
+        ''' A new _Registry with converter_instance registered as well '''
+        converters = list(self._converters.items())
+        converters.append((for_type, converter_instance))
+        return _Registry(converters)
+
+    def strict_converter_for(self, type_or_value):
+        ''' The converter for a type (or the type of a value) or KeyError '''
+        if isinstance(type_or_value, six.class_types):
+            cls = type_or_value
+        else:
+            cls = type(type_or_value)
+        converter = self._resolved.get(cls)
+        if converter is None:
+            converter = self._resolved[cls] = self._resolve(cls)
+        if converter is _UNREGISTERED:
+            raise KeyError(cls)
+        return converter
+
+    def _resolve(self, cls):
+        ''' Find the converter registered for cls or its nearest base '''
+        for base in getattr(cls, '__mro__', (cls,)):
+            if base in self._converters:
+                return self._converters[base]
+        return _UNREGISTERED
+
+_UNREGISTERED = object()
+
 def register_converter(for_type, converter_instance):
-    ''' Register a converter_instance to be used with all for_type instances.
+    ''' Register a converter_instance to be used with all for_type instances
+    (and instances of its subclasses, unless they have their own).
     Registration is 'forever' (across all fitnesse tables run as a suite): the
     decision_table example demonstrates how to use an alternative converter
     with the @using method decorator.
-    A converter_instance must implement from_string() and to_string(). '''
+    A converter_instance must implement from_string() and to_string().
+    Registrations are held as thread-local to ensure that
+    ExecutionContext-s (which are created per thread by the server) really
+    are isolated from each other: until a thread registers a converter it
+    shares the standard registry, after which it has its own copy.'''
     if hasattr(converter_instance, 'from_string') and \
     hasattr(converter_instance, 'to_string'):
-        __init_converters()
-        __THREADLOCAL.converters[for_type] = converter_instance
+        __THREADLOCAL.registry = \
+            _registry().with_converter(for_type, converter_instance)
         return
     msg = 'Converter for %s requires from_string() and to_string()' % for_type
     raise TypeError(msg)
 
-def __init_converters():
-    ''' Ensure standard converters exist for bool, int, float, datetime, ...
-    All registered converters, keyed on type, are held as thread-local to
-    ensure that ExecutionContext-s (which are created per thread by the
-    server) really are isolated from each other'''
-    if hasattr(__THREADLOCAL, 'converters'):
-        return
-
-    __THREADLOCAL.converters = {}
-    register_converter(bool, TrueFalseConverter())
-    register_converter(int, FromConstructorConverter(int))
-    register_converter(float, FromConstructorConverter(float))
-    register_converter(datetime.date, DateConverter())
-    register_converter(datetime.time, TimeConverter())
-    register_converter(datetime.datetime, DatetimeConverter())
-    register_converter(list, IterableConverter())
-    register_converter(tuple, IterableConverter())
-    register_converter(str, StrConverter())
-    register_converter(dict, DictConverter())
+def _registry():
+    ''' The converter registry for this thread '''
+    return __THREADLOCAL.registry
+
+def _swap_registry(registry=None):
+    ''' Make registry (by default, the standard one) the converter registry
+    for this thread, returning the one it replaces. Lets a session that is
+    not confined to a thread of its own carry its registrations with it. '''
+    previous = __THREADLOCAL.registry
+    __THREADLOCAL.registry = registry or _STANDARD_REGISTRY
+    return previous
+
+# Standard converters for bool, int, float, datetime, ...
+_STANDARD_REGISTRY = _Registry([
+    (bool, TrueFalseConverter()),
+    (int, FromConstructorConverter(int)),
+    (float, FromConstructorConverter(float)),
+    (datetime.date, DateConverter()),
+    (datetime.time, TimeConverter()),
+    (datetime.datetime, DatetimeConverter()),
+    (list, IterableConverter()),
+    (tuple, IterableConverter()),
+    (str, StrConverter()),
+    (dict, DictConverter()),
+])
+
+class _ThreadLocal(threading.local):
+    ''' Per-thread state: the class attributes are the defaults '''
+    registry = _STANDARD_REGISTRY
+
+__THREADLOCAL = _ThreadLocal()
 
 def _converters_for(to_types):
     ''' Return a list of converters based on the target types in to_types '''
@@ -347,14 +477,10 @@ def convert_arg(to_type=None, using=None):
             converter = using and using or _converters_for(to_type)
         else:
             converter = using and using or _strict_converter_for(to_type)
-        reiterable = _ReIterable(converter)
-        _reset = reiterable.reset
-        _next = reiterable.next
+        convert = _compile_conversion(converter)
         def convert_args_and_return_result(self, *args):
             ''' callable that delegates to the decorated fn '''
-            _reset(len(args))
-            return base_fn(self,
-                    *tuple([_next().from_string(arg) for arg in args]))
+            return base_fn(self, *convert(args))
         return convert_args_and_return_result
     return conversion_decorator
 
@@ -391,7 +517,14 @@ def to_string(value, using=None):
     '''
     if using and hasattr(using, 'to_string'):
         return using.to_string(value)
-    return converter_for(value).to_string(value)
+    registry = __THREADLOCAL.registry
+    if value.__class__ is str and registry.plain_str:
+        return value
+    try:
+        converter = registry.strict_converter_for(value)
+    except KeyError:
+        converter = _DEFAULT_CONVERTER
+    return converter.to_string(value)
 
 def from_string(value, to_type_or_using):
     ''' Shortcut for converter_for(to_type).from_string(value) or
@@ -405,12 +538,68 @@ def from_string(value, to_type_or_using):
         return to_type_or_using.from_string(value)
     return converter_for(to_type_or_using).from_string(value)
 
-def _strict_converter_for(type_or_value):
-    ''' Returns the exact converter for a particular type_or_value.
-    This will be a registered type-specific converter if one exists,
-    otherwise a KeyError will be raised.'''
-    __init_converters()
+def convert_column(values, to_type=None, using=None, as_array=False):
+    ''' Convert a whole column of str values, e.g. from a table argument,
+    in one call: with the converter "using", if supplied, or else the one
+    registered for "to_type" -- as for convert_arg, but only 1 of them.
+    Returns a tuple of the converted values or, if as_array is True and
+    numpy is installed, a numpy array. Columns of int and float values (with
+    the standard converters) are then converted by numpy in one go, falling
+    back to converting each value if numpy does not accept them all.
+    '''
+    converter = using or _strict_converter_for(to_type)
+    if as_array and numpy is not None:
+        array = _numpy_column(converter, values)
+        if array is not None:
+            return array
+        return numpy.array(list(map(_from_string_function(converter),
+                                    values)))
+    return tuple(map(_from_string_function(converter), values))
+
+def convert_table(rows, to_type=None, using=None, as_array=False):
+    ''' Convert a table argument (a list of rows, each a list of str values)
+    column by column with convert_column. "to_type" or "using" may be a
+    tuple, with an item for each column, or a single type or converter used
+    for every column. Returns a list of rows, each a list -- or, if as_array
+    is True, a tuple of columns, as converted by convert_column. '''
+    conversion_strategy = to_type and to_type or using
+    if not conversion_strategy:
+        raise TypeError('One of "to_type" or "using" must be supplied')
+    columns = list(zip(*rows))
+    if any(len(row) != len(columns) for row in rows):
+        raise WaferSlimException('Table rows must all have the same length')
+    if type(conversion_strategy) is tuple:
+        converters = using and using or _converters_for(to_type)
+        if len(converters) < len(columns):
+            msg = '%s to_type or using args insufficient to convert %s columns'
+            raise WaferSlimException(msg % (len(converters), len(columns)))
+    else:
+        converters = (using and using or _strict_converter_for(to_type),) \
+            * len(columns)
+    converted = tuple([convert_column(column, using=converter,
+                                      as_array=as_array)
+                       for column, converter in zip(columns, converters)])
+    if as_array:
+        return converted
+    return [list(row) for row in zip(*converted)]
+
+def _numpy_column(converter, values):
+    ''' A numpy array of values converted by numpy, or None if converter is
+    not a standard int, float or bool one or numpy cannot convert them all
+    (numpy parses str values into int or float as their constructors do) '''
+    if type(converter) is TrueFalseConverter:
+        return numpy.fromiter(map(converter.from_string, values),
+                              dtype=bool, count=len(values))
+    if type(converter) is not FromConstructorConverter \
+            or converter._type not in (int, float):
+        return None
     try:
-        return __THREADLOCAL.converters[type_or_value]
-    except (KeyError, TypeError):
-        return __THREADLOCAL.converters[type(type_or_value)]
+        return numpy.array(values, dtype=converter._type)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def _strict_converter_for(type_or_value):
+    ''' Returns the converter for a particular type_or_value. This will be
+    the converter registered for its type, or the nearest base type in its
+    mro, if one exists, otherwise a KeyError will be raised.'''
+    return _registry().strict_converter_for(type_or_value)
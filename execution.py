@@ -7,25 +7,43 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved
 '''
+import gc
+import inspect
 import os
 import re
 import sys
 import logging
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+try:
+    import typing
+except ImportError:
+    typing = None
+from functools import partial
+import six
+from six.moves import map
 from .instructions import (Instruction,
                            Make,
                            Call,
                            CallAndAssign,
                            Import)
-from .converters import to_string
+from . import stats, tracing
+from .converters import (to_string, converter_for,
+                         Converter, StrConverter)
 
 _OK = 'OK'
 _EXCEPTION = '__EXCEPTION__:'
 _STOP_TEST = '%sABORT_SLIM_TEST:' % _EXCEPTION
 _NONE_STRING = '/__VOID__/'
+_PRELOADED = {}  # import path: [(class name, class data), ...]
+_FIXTURE_CACHE = None  # a fixture_cache.FixtureCache, if enabled
 
 
 class Results(object):
-    ''' Collecting parameter for results of Instruction execute() methods '''
+    ''' Collecting parameter for results of Instruction execute() methods.
+    Subclasses may override _add() to do something else with each result
+    than collect it into a list. '''
     NO_RESULT_EXPECTED = object()
 
     def __init__(self, convert_to_string=to_string):
@@ -33,29 +51,36 @@ class Results(object):
         currently registered type converters '''
         self._collected = []
         self._convert_to_string = convert_to_string
+        self.count = 0
+        self.failures = 0
 
     def completed(self, instruction, result=NO_RESULT_EXPECTED):
         ''' An instruction has completed, perhaps with a result '''
-        if result == Results.NO_RESULT_EXPECTED:
+        if result is Results.NO_RESULT_EXPECTED:
             str_result = _OK
         elif result is None:
             str_result = _NONE_STRING
         else:
             str_result = self._convert_to_string(result)
-        self._collected.append([instruction.instruction_id(), str_result])
+        self._add(instruction.instruction_id(), str_result)
+        self.count += 1
 
     def failed(self, instruction, cause, stop_test=False):
         ''' An instruction has failed due to some underlying cause '''
         failed_type = stop_test and _STOP_TEST or _EXCEPTION
-        self._collected.append([instruction.instruction_id(),
-                                '%s message:<<%s>>' % (failed_type, cause)])
+        self._add(instruction.instruction_id(),
+                  '%s message:<<%s>>' % (failed_type, cause))
+        self.count += 1
+        self.failures += 1
+
+    def _add(self, instruction_id, str_result):
+        ''' Collect the result of an instruction '''
+        self._collected.append([instruction_id, str_result])
 
     def collection(self):
         ''' Get the collected list of results - modifications to the list
         will not be reflected in this collection '''
-        collected = []
-        collected.extend(self._collected)
-        return collected
+        return list(self._collected)
 
 _INSTRUCTION_TYPES = {'make': Make,
                       'import': Import,
@@ -63,10 +88,14 @@ _INSTRUCTION_TYPES = {'make': Make,
                       'callAndAssign': CallAndAssign}
 _ID_POSITION = 0
 _TYPE_POSITION = 1
+_PARAMS_POSITION = 2
+_INSTRUCTION_TYPE = itemgetter(_TYPE_POSITION)
 
 
 def instruction_for(params):
     ''' Factory method for Instruction types '''
+    if not isinstance(params, list):  # lazily unpacked
+        params = list(params)
     instruction_type = params.pop(_TYPE_POSITION)
     instruction_id = params.pop(_ID_POSITION)
     try:
@@ -75,32 +104,126 @@ def instruction_for(params):
         return Instruction(instruction_id, [instruction_type])
 
 
-def _debug(logger, msg, substitutions):
-    ''' Log to logger a msg with potentially some substitutions '''
-    try:
-        logger.debug(msg % substitutions)
-    except:
-        logger.warn('Error logging %s:' % msg, exc_info=1)
+class InstructionPlans(object):
+    ''' Bounded, least recently used, cache of compiled execution plans,
+    shared by all sessions. A plan is compiled for each message "shape" --
+    the type of each of its instructions -- and has a PlanStep for each
+    instruction, so executing a message with the same shape again creates
+    its Instruction-s straight from their classes and calls the methods the
+    steps resolved before. '''
+
+    def __init__(self, size):
+        ''' Specify the maximum number of plans to keep '''
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('Instructions')
+
+    def plan_for(self, unpacked_list):
+        ''' The plan for executing unpacked_list: a tuple with a PlanStep
+        for each instruction, or None if unpacked_list is malformed '''
+        try:
+            shape = tuple(map(_INSTRUCTION_TYPE, unpacked_list))
+        except (IndexError, TypeError):
+            return None
+        with self._lock:
+            plan = self._plans.pop(shape, None)
+            if plan is None:
+                self.misses += 1
+                outcome = 'miss'
+                plan = tuple([PlanStep(instruction_type)
+                              for instruction_type in shape])
+                if len(self._plans) >= self.size:
+                    self._plans.popitem(last=False)
+            else:
+                self.hits += 1
+                outcome = 'hit'
+            self._plans[shape] = plan
+            hits, misses = self.hits, self.misses
+        tracing.record('plan', outcome, hits, misses)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug('Plan cache %s: %s hits, %s misses',
+                               outcome, hits, misses)
+        return plan
+
+    def hit_ratio(self):
+        ''' The proportion of plan_for() calls that found a cached plan '''
+        lookups = self.hits + self.misses
+        return lookups and float(self.hits) / lookups
+
+
+class PlanStep(object):
+    ''' One instruction of a compiled plan: the Instruction class for its
+    type and, once it has been called, the method it resolved to '''
+
+    def __init__(self, instruction_type):
+        ''' Specify the type of instruction, as sent '''
+        self.instruction_type = instruction_type
+        self.instruction_class = _INSTRUCTION_TYPES.get(instruction_type)
+        self._dispatch = None  # (dispatch cache, class, method, resolution)
+
+    def bind(self, item):
+        ''' Create the Instruction for item, as instruction_for(item) would '''
+        if self.instruction_class is None:
+            return Instruction(item[_ID_POSITION], [self.instruction_type])
+        instruction = self.instruction_class(item[_ID_POSITION],
+                                             item[_PARAMS_POSITION:])
+        instruction.plan_step = self
+        return instruction
+
+    def target_for(self, execution_context, instance, method_name):
+        ''' As execution_context.target_for(), but reusing the method this
+        step last resolved while it is for the same class and method name,
+        and the context has not imported anything since '''
+        cls, cached = instance.__class__, self._dispatch
+        if cached is None or cached[0] is not execution_context._dispatch \
+                or cached[1] is not cls or cached[2] != method_name:
+            resolution = execution_context.dispatch_for(cls, method_name)
+            cached = (execution_context._dispatch, cls, method_name,
+                      resolution)
+            self._dispatch = cached
+        return _bound_target(instance, *cached[3])
 
 
 class Instructions(object):
     ''' Container for executable sequence of Instruction-s '''
 
-    def __init__(self, unpacked_list, factory_method=instruction_for):
+    def __init__(self, unpacked_list, factory_method=instruction_for,
+                 plans=None):
         ''' Provide an unpacked list of strings that will be converted
-        into a sequence of Instruction-s to execute '''
+        into a sequence of Instruction-s to execute -- using a plan from
+        the InstructionPlans plans, if specified '''
         self._unpacked_list = unpacked_list
         self._instruction_for = factory_method
+        self._plans = plans
         self._logger = logging.getLogger('Instructions')
 
     def execute(self, execution_context, results):
         ''' Create and execute Instruction-s, collecting the results '''
-        for item in self._unpacked_list:
-            instruction = self._instruction_for(item)
-            _debug(self._logger, 'Executing %r', instruction)
+        plan = None
+        if self._plans is not None:
+            plan = self._plans.plan_for(self._unpacked_list)
+        if plan is not None:
+            instructions = map(PlanStep.bind, plan, self._unpacked_list)
+        else:
+            instructions = map(self._instruction_for, self._unpacked_list)
+        trace, timings = tracing.current(), stats.current()
+        timed = trace is not None or timings is not None
+        for instruction in instructions:
+            if timed:
+                start, failures = tracing.clock(), results.failures
             try:
                 instruction.execute(execution_context, results)
+                if timed:
+                    _timed(trace, timings, execution_context, instruction,
+                           start,
+                           results.failures > failures and 'failed' or 'ok')
             except Exception as error:
+                if timed:
+                    _timed(trace, timings, execution_context, instruction,
+                           start, 'error')
                 self._logger.warn('Error executing %s:', instruction,
                                   exc_info=1)
                 stop_test = 'stoptest' in type(error).__name__.lower()
@@ -113,11 +236,34 @@ class Instructions(object):
                     break
 
 
+def _timed(trace, timings, execution_context, instruction, start, outcome):
+    ''' Record the execution of an instruction that started at start in the
+    trace, and add its latency to the timings for its fixture method --
+    either of which may be None '''
+    elapsed = tracing.clock() - start
+    if trace is not None:
+        trace.record('instruction', instruction.instruction_id(),
+                     type(instruction).__name__, instruction.target(),
+                     outcome, elapsed)
+    if timings is not None:
+        method = instruction.fixture_method(execution_context)
+        if method is not None:
+            timings.add(stats.FIXTURE, '%s.%s' % method, elapsed)
+
+
 class ParamsConverter(object):
     ''' Converter from (possibly nested) list of strings (possibly symbols)
-    into (possibly nested) tuple of string arguments for invocation'''
-
-    _SYMBOL_PATTERN = re.compile('\\$([a-zA-Z]\\w*)+', re.UNICODE)
+    into (possibly nested) tuple of string arguments for invocation.
+    Lazily unpacked chunks without symbols are passed through as they are,
+    so fixtures get a LazyChunk -- a sequence comparing equal to the tuple
+    it stands for -- and only pay for unpacking the items they use.
+    Each distinct string containing a '$' is compiled, once, into a template
+    of literal text and symbol names; strings without one are passed
+    through untouched. '''
+
+    _SYMBOL_PATTERN = re.compile('\\$([a-zA-Z]\\w*)', re.UNICODE)
+    _MAX_TEMPLATES = 10000
+    _templates = {}  # string: template, shared by all ParamsConverter-s
 
     def __init__(self, execution_context):
         ''' Provide the execution_context for symbol lookup '''
@@ -130,19 +276,111 @@ class ParamsConverter(object):
 
     def _lookup_symbol(self, possible_symbol):
         ''' Lookup (recursively if required) a possible symbol '''
-        if isinstance(possible_symbol, list):
-            return self.to_args(possible_symbol, 0)
-        return ParamsConverter._SYMBOL_PATTERN.sub(
-            self._match,
-            possible_symbol,
-            re.S
-        )
+        if not isinstance(possible_symbol, six.string_types):
+            if isinstance(possible_symbol, list):
+                return self.to_args(possible_symbol, 0)
+            if possible_symbol.has_symbols():  # lazily unpacked
+                return self.to_args(possible_symbol, 0)
+            return possible_symbol
+        if '$' not in possible_symbol:
+            return possible_symbol
+        template = ParamsConverter._templates.get(possible_symbol)
+        if template is None:
+            template = ParamsConverter._compile(possible_symbol)
+        if template.__class__ is not tuple:
+            return self._execution_context.get_symbol_value(template)
+        if len(template) == 1:  # no symbols after all
+            return possible_symbol
+        parts = list(template)
+        get_symbol = self._execution_context.get_symbol
+        for position in range(1, len(parts), 2):
+            parts[position] = get_symbol(parts[position])
+        return ''.join(parts)
+
+    @staticmethod
+    def _compile(possible_symbol):
+        ''' Classify possible_symbol, caching the result: as the symbol name
+        if it is a single symbol, or else as a template tuple alternating
+        literal text and symbol names (just the text if there are none) '''
+        parts = ParamsConverter._SYMBOL_PATTERN.split(possible_symbol)
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            template = parts[1]
+        else:
+            template = tuple(parts)
+        if len(ParamsConverter._templates) >= ParamsConverter._MAX_TEMPLATES:
+            ParamsConverter._templates.clear()
+        ParamsConverter._templates[possible_symbol] = template
+        return template
+
+
+def _annotated_conversion(cls, name):
+    ''' A function converting the str args for method name of cls into the
+    types its parameters are annotated with, or None if there are none that
+    a converter is registered for (other than str) '''
+    method = getattr(cls, name, None)
+    if not getattr(method, '__annotations__', None) or typing is None:
+        return None
+    try:
+        signature = inspect.signature(method)
+        hints = typing.get_type_hints(method)
+    except Exception:  # unresolvable annotations are not converted
+        return None
+    parameters = list(signature.parameters.values())
+    if inspect.isfunction(inspect.getattr_static(cls, name)):  # skip self
+        parameters = parameters[1:]
+    from_strings, rest = [], None
+    for parameter in parameters:
+        from_string = _from_string_for(hints.get(parameter.name))
+        if parameter.kind == parameter.VAR_POSITIONAL:
+            rest = from_string
+            break
+        if parameter.kind not in (parameter.POSITIONAL_ONLY,
+                                  parameter.POSITIONAL_OR_KEYWORD):
+            break
+        from_strings.append(from_string)
+    if rest is None and not any(from_strings):
+        return None
+    return partial(_convert_annotated, tuple(from_strings), rest)
+
+
+def _from_string_for(annotation):
+    ''' The from_string of the converter for annotation, or None '''
+    if annotation is None:
+        return None
+    if hasattr(annotation, 'from_string') \
+            and not isinstance(annotation, six.class_types):
+        return annotation.from_string  # annotated with a converter
+    converter = converter_for(annotation)
+    if type(converter) in (Converter, StrConverter):
+        return None
+    return converter.from_string
+
+
+def _convert_annotated(from_strings, rest, args):
+    ''' Convert the str args with the from_string for their position '''
+    converted = list(args)
+    for position, value in enumerate(args):
+        if position < len(from_strings):
+            from_string = from_strings[position]
+        else:
+            from_string = rest
+        if from_string is not None and isinstance(value, six.string_types):
+            converted[position] = from_string(value)
+    return converted
+
 
-    def _match(self, match):
-        ''' Actually perform the substitution identified by the match '''
-        if match:
-            return self._execution_context.get_symbol(match.groups()[0])
-        return ''
+def _call_converted(target, convert, *args):
+    ''' Call target with args, converted '''
+    return target(*convert(args))
+
+
+def _bound_target(instance, name, convert):
+    ''' The attribute name of instance, wrapped to convert its arguments if
+    convert is not None '''
+    target = getattr(instance, name, None)
+    if convert is None or target is None:
+        return target
+    return partial(_call_converted, target, convert)
 
 
 def to_pythonic(method_name):
@@ -185,16 +423,26 @@ class ExecutionContext(object):
         self._logger = logger
         self.instances = {}
         self._symbols = {}
+        self._symbol_objects = {}
+        self.symbol_objects = False  # pass stored objects, not strings?
         self.classes = {}
-        self.aliases = {}
+        self.methods = {}  # class: names of its methods
+        self._camel_cased = {}  # class: get_aliases() of its methods
+        self._dispatch = {}  # (class, method name): (attribute, converter)
 
     def get_type(self, fully_qualified_name):
         return self.classes.get(fully_qualified_name, None)
 
     def import_path(self, path):
-        for name, data in load_classes(path):
+        classes = _PRELOADED.get(_preload_key(path))
+        if classes is not None:
+            tracing.record('preloaded', path)
+        else:
+            classes = load_classes(path)
+        for name, data in classes:
             self.classes[name] = data['class']
-            self.aliases[name] = ExecutionContext.get_aliases(data['methods'])
+            self.methods[data['class']] = frozenset(data['methods'])
+        self._dispatch = {}
 
     @staticmethod
     def get_aliases(methods):
@@ -215,50 +463,151 @@ class ExecutionContext(object):
         return camel_caseds
 
     def target_for(self, instance, method_name):
-        class_name = instance.__class__.__name__
-        method_name = self.aliases[class_name][method_name]
-        if hasattr(instance, method_name):
-            return getattr(instance, method_name)
-        else:
-            return None
+        ''' The method of instance to call for method_name, or None if there
+        is no such method. The attribute method_name resolves to for the
+        class of the instance is cached, so repeated calls need just one dict
+        lookup and one getattr(). Methods with type annotations on their
+        parameters get a callable that converts the arguments first. '''
+        return _bound_target(instance,
+                             *self.dispatch_for(instance.__class__,
+                                                method_name))
+
+    def dispatch_for(self, cls, method_name):
+        ''' The (attribute, converter) pair to call on instances of cls for
+        method_name, from the dispatch cache. The cache is replaced, not
+        cleared, by import_path() and cleanup(), so whoever holds on to a
+        pair can tell whether it is still current. '''
+        key = (cls, method_name)
+        try:
+            return self._dispatch[key]
+        except KeyError:
+            name = self._resolve_method(cls, method_name)
+            resolution = (name, _annotated_conversion(cls, name))
+            self._dispatch[key] = resolution
+            return resolution
+
+    def _resolve_method(self, cls, method_name):
+        ''' The name of the attribute of instances of cls to call for
+        method_name. For an imported cls that is the method whose name, or
+        lowerCamelCase or UpperCamelCase form of its name, is method_name:
+        the likely candidates are tried first, then all of its methods. '''
+        methods = self.methods.get(cls)
+        if methods is None:
+            pythonic = to_pythonic(method_name)
+            if not hasattr(cls, method_name) and hasattr(cls, pythonic):
+                return pythonic
+            return method_name
+        if method_name in methods:
+            return method_name
+        for candidate in (to_pythonic(method_name),
+                          method_name[:1].lower() + method_name[1:],
+                          method_name[:1].upper() + method_name[1:]):
+            if candidate in methods and \
+                    (method_name == to_lower_camel_case(candidate)
+                     or method_name == to_upper_camel_case(candidate)):
+                return candidate
+        if cls not in self._camel_cased:
+            self._camel_cased[cls] = ExecutionContext.get_aliases(methods)
+        return self._camel_cased[cls].get(method_name, method_name)
 
     def store_instance(self, name, value):
         ''' Add a name=value pair to the context instances '''
-        _debug(self._logger, 'Storing instance %s=%r', (name, value))
+        tracing.record('instance', name, type(value).__name__)
         self.instances[name] = value
 
     def get_instance(self, name):
         return self.instances.get(name, None)
 
     def store_symbol(self, name, value):
-        _debug(self._logger, 'Storing symbol %s=%r', (name, value))
+        tracing.record('symbol', name, type(value).__name__)
         self._symbols[name] = to_string(value)
+        if self.symbol_objects:
+            self._symbol_objects[name] = value
 
     def get_symbol(self, name):
         if name in self._symbols:
             value = self._symbols[name]
-            _debug(self._logger, 'Restoring symbol %s=%r', (name, value))
+            tracing.record('restore symbol', name)
             return value
         else:
             return '$%s' % name
 
+    def get_symbol_value(self, name):
+        ''' The value to pass for an argument that is just the symbol name:
+        the object stored, if symbol_objects is set, else its string form '''
+        if name in self._symbol_objects:
+            value = self._symbol_objects[name]
+            tracing.record('restore symbol', name, type(value).__name__)
+            return value
+        return self.get_symbol(name)
+
     def to_args(self, params, from_position):
         return self._params_converter.to_args(params, from_position)
 
+    def cleanup(self):
+        ''' Drop everything this context holds at the end of a session, so a
+        long-lived server does not carry instances, symbols or imported
+        classes over into the next session '''
+        tracing.record('cleanup', len(self.instances))
+        self.instances.clear()
+        self._symbols.clear()
+        self._symbol_objects.clear()
+        self.classes.clear()
+        self.methods.clear()
+        self._camel_cased.clear()
+        self._dispatch = {}
+
+
+def preload(paths):
+    ''' Load the classes in each of the import paths once, up front, so that
+    later import instructions for the same paths need not load them again.
+    Everything loaded so far is then moved out of reach of the garbage
+    collector (where gc.freeze is available) so processes forked from this
+    one keep sharing its memory pages rather than copying them. '''
+    for path in paths:
+        _PRELOADED[_preload_key(path)] = list(load_classes(path))
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+
+def _preload_key(path):
+    ''' Key for a path, matching however the same file is referred to '''
+    on_path = find_in_sys_path(path)
+    if on_path is not None:
+        return os.path.realpath(on_path)
+    return path
+
+
+def set_fixture_cache(fixture_cache):
+    ''' Use a fixture_cache.FixtureCache (or None) for the metadata of the
+    classes in each module loaded by load_classes '''
+    global _FIXTURE_CACHE
+    _FIXTURE_CACHE = fixture_cache
+
 
 def load_classes(package_path):
     on_path = find_in_sys_path(package_path)
     if on_path is not None:
         if os.path.isfile(on_path):
-            for name, data in get_classes(load_source(on_path)):
+            for name, data in _get_classes(load_source(on_path)):
                 yield (name, data)
         else:
             for module in load_package(on_path):
-                for name, data in get_classes(module):
+                for name, data in _get_classes(module):
                     yield (name, data)
     else:
-        for name, data in get_classes(__import__(package_path)):
+        for name, data in _get_classes(__import__(package_path)):
             yield (name, data)
+    if _FIXTURE_CACHE is not None:
+        _FIXTURE_CACHE.save()
+
+
+def _get_classes(module):
+    ''' get_classes(module), from the fixture cache if enabled '''
+    if _FIXTURE_CACHE is None:
+        return get_classes(module)
+    return _FIXTURE_CACHE.get_classes(module, get_classes)
 
 
 def find_in_sys_path(path):
@@ -270,9 +619,18 @@ def find_in_sys_path(path):
 
 
 def load_source(source_path):
-    import imp
     name = os.path.splitext(os.path.basename(source_path))[0]
-    return imp.load_source(name, source_path)
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(name, source_path)
+    # unlike imp.load_source, this reuses compiled bytecode when up to date
+    spec = spec_from_file_location(name, source_path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
 
 def load_package(package_path):
@@ -0,0 +1,174 @@
+'''
+On-disk cache of the metadata of fixture classes: class names and method
+names, per fixture module.
+
+Finding the methods of every class in a module means inspecting each of
+them, which adds up for fixture packages with hundreds of classes. While a
+module's source file (and those of the classes it defines or imports, and
+of all their base classes) are unchanged, as judged by their modification
+time and size, the cached metadata is used instead. The module itself is
+still imported, to get its classes.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+_VERSION = 3
+_LOGGER_NAME = 'Execution'
+
+
+class FixtureCache(object):
+    ''' Fixture class metadata, loaded from and saved to a JSON file '''
+
+    def __init__(self, path):
+        ''' Specify the file to load the cache from and save it to '''
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._modules = None
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def get_classes(self, module, introspect):
+        ''' The (name, data) pairs for the classes in module, from the cache
+        if it is up to date, or else from introspect(module) -- in which
+        case the data is cached for next time '''
+        source = _source_file(module)
+        if source is None:
+            return list(introspect(module))
+        key = os.path.realpath(source)
+        with self._lock:
+            entry = self._load().get(key)
+        classes = entry and _from_entry(module, entry)
+        if classes is not None:
+            self.hits += 1
+            return classes
+
+        self.misses += 1
+        classes = list(introspect(module))
+        entry = _to_entry(source, classes)
+        with self._lock:
+            self._modules[key] = entry
+            self._changed[key] = entry
+        return classes
+
+    def save(self):
+        ''' Write any changes to the file (merged with changes other
+        processes may have saved since it was loaded) '''
+        with self._lock:
+            if not self._changed:
+                return
+            modules = _read(self.path)
+            modules.update(self._changed)
+            try:
+                _write(self.path, modules)
+                self._changed = {}
+            except (IOError, OSError) as error:
+                logging.getLogger(_LOGGER_NAME).warning(
+                    'Could not save fixture cache %s: %s' % (self.path, error))
+
+    def clear(self):
+        ''' Discard all cached metadata, and remove the file '''
+        with self._lock:
+            self._modules = {}
+            self._changed = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _load(self):
+        ''' The cached modules, reading the file the first time '''
+        if self._modules is None:
+            self._modules = _read(self.path)
+        return self._modules
+
+
+def default_path():
+    ''' The cache file used unless another is specified '''
+    base = os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'waferslim', 'fixtures.json')
+
+
+def _source_file(module):
+    ''' The source file a module was loaded from, if any '''
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return os.path.exists(path) and path or None
+
+
+def _stamp(path):
+    ''' The modification time and size of a file '''
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def _to_entry(source, classes):
+    ''' A cache entry for the classes of a module loaded from source,
+    stamping the source files of every class in their mro: a base class
+    gaining or losing a method changes the methods of its subclasses '''
+    files = set([source])
+    for name, data in classes:
+        for cls in data['class'].__mro__:
+            defining_module = sys.modules.get(cls.__module__)
+            defining_source = _source_file(defining_module)
+            if defining_source:
+                files.add(defining_source)
+    return {
+        'files': dict((path, _stamp(path)) for path in files),
+        'classes': [[name, data['methods']]
+                    for name, data in classes],
+    }
+
+
+def _from_entry(module, entry):
+    ''' The (name, data) pairs cached in entry, or None if out of date '''
+    try:
+        for path, stamp in entry['files'].items():
+            if _stamp(path) != stamp:
+                return None
+    except OSError:
+        return None
+    classes = []
+    for name, methods in entry['classes']:
+        cls = getattr(module, name, None)
+        if not isinstance(cls, type):
+            return None
+        classes.append((name, {'class': cls, 'methods': methods}))
+    return classes
+
+
+def _read(path):
+    ''' The modules in a cache file, or none if it is missing or invalid '''
+    try:
+        with open(path) as cache_file:
+            contents = json.load(cache_file)
+        if contents.get('version') == _VERSION:
+            return contents['modules']
+    except (IOError, OSError, ValueError, KeyError, AttributeError):
+        pass
+    return {}
+
+
+def _write(path, modules):
+    ''' Replace the cache file atomically, via a temporary file '''
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as temp_file:
+            json.dump({'version': _VERSION, 'modules': modules}, temp_file)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
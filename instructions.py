@@ -15,6 +15,7 @@ _NO_METHOD = 'NO_METHOD_IN_CLASS'
 
 class Instruction(object):
     ''' Base class for instructions '''
+    plan_step = None  # the execution.PlanStep that created it, if any
 
     def __init__(self, instruction_id, params):
         ''' Specify the id of this instruction, and its params.
@@ -28,6 +29,19 @@ class Instruction(object):
         ''' Return the id of this instruction '''
         return self._id
 
+    def target(self):
+        ''' Return what the instruction acts on, e.g. for tracing '''
+        return self._target(0, 1)
+
+    def fixture_method(self, execution_context):
+        ''' Return the (class name, method name) the instruction invokes on
+        a fixture, or None if it does not, e.g. for timing '''
+        return None
+
+    def _target(self, start, stop):
+        ''' Return the params from start to stop, joined with "." '''
+        return '.'.join(['%s' % param for param in self._params[start:stop]])
+
     def __repr__(self):
         ''' Return a meaningful representation of the Instruction '''
         return '%s %s: %s' % (type(self).__name__, self._id, self._params)
@@ -55,6 +69,16 @@ class Import(Instruction):
 class Make(Instruction):
     ''' A "make <instance>, <class>, <args>..." instruction '''
 
+    def target(self):
+        ''' Return the class to make an instance of '''
+        return self._target(1, 2)
+
+    def fixture_method(self, execution_context):
+        ''' Return the class to make an instance of, and its constructor '''
+        if len(self._params) < 2:
+            return None
+        return (self._params[1], '__init__')
+
     def execute(self, execution_context, results):
         ''' Create a class instance and add it to the execution context '''
         try:
@@ -79,6 +103,27 @@ class Make(Instruction):
 class Call(Instruction):
     ''' A "call <instance>, <function>, <args>..." instruction '''
 
+    def target(self):
+        ''' Return the instance and function to call '''
+        return self._target(0, 2)
+
+    def fixture_method(self, execution_context):
+        ''' Return the class of the instance, and the function to call '''
+        return self._fixture_method(execution_context, self._params)
+
+    def _fixture_method(self, execution_context, params):
+        ''' Return the class of the instance named in params, if there is
+        one, and the function to call '''
+        if len(params) < 2:
+            return None
+        try:
+            instance = execution_context.get_instance(params[0])
+        except TypeError:  # not a name
+            return None
+        if instance is None:
+            return None
+        return (type(instance).__name__, params[1])
+
     def execute(self, execution_context, results):
         ''' Delegate to _invoke_call then record results on completion '''
         result, is_ok = self._invoke(execution_context, results, self._params)
@@ -94,7 +139,11 @@ class Call(Instruction):
         instance_name, target_name = params[0], params[1]
         instance = execution_context.get_instance(instance_name)
         if instance is not None:
-            target = execution_context.target_for(instance, target_name)
+            if self.plan_step is not None:
+                target = self.plan_step.target_for(execution_context,
+                                                   instance, target_name)
+            else:
+                target = execution_context.target_for(instance, target_name)
             if target is not None:
                 args = execution_context.to_args(params, 2)
                 result = target(*args)
@@ -112,6 +161,14 @@ class CallAndAssign(Call):
     ''' A "callAndAssign <symbol>, <instance>, <function>, <args>..."
     instruction '''
 
+    def target(self):
+        ''' Return the instance and function to call '''
+        return self._target(1, 3)
+
+    def fixture_method(self, execution_context):
+        ''' Return the class of the instance, and the function to call '''
+        return self._fixture_method(execution_context, self._params[1:])
+
     def execute(self, execution_context, results):
         ''' Delegate to _invoke_call then set variable and record results
         on completion '''
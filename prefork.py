@@ -0,0 +1,236 @@
+'''
+Pre-fork server classes (POSIX only).
+
+Started by running waferslim.server with the --workers option: the
+listening socket is opened once, by a supervisor process, and shared by a
+pool of forked worker processes. Each worker accepts and handles one
+session at a time, through the usual SlimRequestHandler / RequestResponder,
+so CPU bound fixtures in concurrent sessions run on separate cores rather
+than contending for a single interpreter lock. Sessions all run on the
+worker's main thread, so converters registered by a session are forgotten
+when it ends, as they would be with a thread of its own.
+
+The supervisor replaces workers that crash, or that are recycled after
+handling --max-sessions sessions, and logs the session and byte counters
+each worker reports back to it over a pipe.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import errno
+import logging
+import os
+import select
+import signal
+from . import converters, recorder
+from .server import WaferSlimServer, SocketServer
+
+_LOGGER_NAME = 'WaferSlimServer'
+_POLL_INTERVAL = 0.5
+
+
+def _exit_on_signal(signum, frame):
+    ''' Signal handler for a worker to exit cleanly, by raising SystemExit '''
+    raise SystemExit(0)
+
+
+class WorkerCounters(object):
+    ''' Counters reported by a worker process to the supervisor '''
+
+    def __init__(self, pid, sessions=0, received=0, sent=0):
+        ''' Initialise the counters of worker process pid '''
+        self.pid = pid
+        self.sessions = sessions
+        self.received = received
+        self.sent = sent
+
+    def to_line(self):
+        ''' Format as a single line, short enough to be written atomically '''
+        return ('%s %s %s %s\n' % (self.pid, self.sessions,
+                                   self.received, self.sent)).encode('ascii')
+
+    @staticmethod
+    def from_line(line):
+        ''' Parse a line created by to_line() '''
+        return WorkerCounters(*[int(field) for field in line.split()])
+
+    def __str__(self):
+        return '%s sessions, %s bytes received, %s bytes sent' % \
+            (self.sessions, self.received, self.sent)
+
+
+class WorkerServer(WaferSlimServer):
+    ''' WaferSlimServer handling one session at a time, in the process it
+    is used from, and reporting its counters after each session '''
+
+    def __init__(self, options):
+        ''' Initialise as a WaferSlimServer, with recycling options '''
+        WaferSlimServer.__init__(self, options)
+        self.max_sessions = getattr(options, 'max_sessions', 0)
+        self.counters = None
+        self._report_fd = None
+
+    def serve_sessions(self, report_fd):
+        ''' Handle sessions until max_sessions have been handled (or
+        forever), writing counters to file descriptor report_fd. Whatever
+        has been recorded is written before returning. '''
+        self.counters = WorkerCounters(os.getpid())
+        self._report_fd = report_fd
+        try:
+            while not self.max_sessions \
+                    or self.counters.sessions < self.max_sessions:
+                self.handle_request()
+        finally:
+            # the worker exits without running atexit handlers, and is not
+            # to be stopped half way through writing
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            recording = recorder.current()
+            if recording is not None:
+                recording.close()
+
+    def process_request(self, request, client_address):
+        ''' Handle the request in this process, not in a new thread, then
+        forget any converters registered during it: sessions share this
+        thread, so they would otherwise leak into the next session '''
+        try:
+            SocketServer.TCPServer.process_request(self, request,
+                                                   client_address)
+        finally:
+            converters._swap_registry()
+
+    def done(self, request_handler):
+        ''' A request_handler has completed - report the counters '''
+        self.counters.sessions += 1
+        self.counters.received += request_handler.received
+        self.counters.sent += request_handler.sent
+        os.write(self._report_fd, self.counters.to_line())
+
+
+class PreforkServer(object):
+    ''' Supervises a pool of worker processes sharing a WorkerServer's
+    listening socket '''
+
+    def __init__(self, options, worker_server=WorkerServer):
+        ''' Open the listening socket for the workers to share '''
+        self.num_workers = int(getattr(options, 'workers', 1))
+        self.server = worker_server(options)
+        self.server_address = self.server.server_address
+        self.workers = {}  # pid: latest WorkerCounters
+        self.retired = []  # WorkerCounters of workers no longer running
+        self._running = False
+        self._report_fd, self._write_fd = os.pipe()
+        self._pending = b''
+
+    def serve_forever(self):
+        ''' Start the workers and keep the pool full until stop() '''
+        self._running = True
+        try:
+            while self._running:
+                while len(self.workers) < self.num_workers:
+                    self._spawn()
+                self._read_reports(_POLL_INTERVAL)
+                self._reap(os.WNOHANG)
+        finally:
+            self._stop_workers()
+            total = WorkerCounters(os.getpid())
+            for counters in self.retired:
+                total.sessions += counters.sessions
+                total.received += counters.received
+                total.sent += counters.sent
+            self._log('All workers: %s' % total)
+
+    def stop(self):
+        ''' Stop the workers and return from serve_forever(). May be called
+        from a signal handler or from another thread. '''
+        self._running = False
+
+    def stop_on_signal(self, *signums):
+        ''' Stop when any of the signals is received. Call from the main
+        thread, before serve_forever(). '''
+        def handler(signum, frame):
+            self._log('Shutting down on signal %s' % signum)
+            self.stop()
+        for signum in signums:
+            signal.signal(signum, handler)
+
+    def server_close(self):
+        ''' Close the listening socket and the report pipe '''
+        self.server.server_close()
+        os.close(self._report_fd)
+        os.close(self._write_fd)
+
+    def _spawn(self):
+        ''' Fork a new worker '''
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = WorkerCounters(pid)
+            self._log('Started worker %s' % pid)
+            return
+        status = 1
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, _exit_on_signal)
+            os.close(self._report_fd)
+            self.server.serve_sessions(self._write_fd)
+            status = 0
+        except SystemExit:  # stopped by the supervisor
+            status = 0
+        except BaseException as error:
+            logging.error(error, exc_info=1)
+        finally:
+            os._exit(status)
+
+    def _read_reports(self, timeout):
+        ''' Read counters reported by workers, waiting at most timeout '''
+        try:
+            readable = select.select([self._report_fd], [], [], timeout)[0]
+        except (OSError, select.error) as error:
+            if error.args[0] != errno.EINTR:
+                raise
+            return
+        if not readable:
+            return
+        lines = (self._pending + os.read(self._report_fd, 65536)).split(b'\n')
+        self._pending = lines.pop()
+        for line in lines:
+            counters = WorkerCounters.from_line(line)
+            if counters.pid in self.workers:
+                self.workers[counters.pid] = counters
+
+    def _reap(self, options):
+        ''' Collect the status of exited workers, logging their counters '''
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, options)
+            except OSError as error:
+                if error.errno == errno.EINTR:
+                    continue
+                raise
+            if not pid:
+                return
+            self._read_reports(0)
+            counters = self.workers.pop(pid)
+            self.retired.append(counters)
+            if not self._running:
+                self._log('Stopped worker %s: %s' % (pid, counters))
+            elif os.WIFEXITED(status) and not os.WEXITSTATUS(status):
+                self._log('Recycled worker %s: %s' % (pid, counters))
+            else:
+                msg = 'Worker %s died (status %s): %s' % \
+                    (pid, status, counters)
+                logging.getLogger(_LOGGER_NAME).warning(msg)
+
+    def _stop_workers(self):
+        ''' Terminate the workers and wait for them to exit '''
+        self._running = False
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self._reap(0)
+
+    def _log(self, msg):
+        ''' log an info msg '''
+        logging.getLogger(_LOGGER_NAME).info(msg)
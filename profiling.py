@@ -0,0 +1,162 @@
+'''
+Profiling of Slim sessions: each session is run under cProfile, and its
+profile written to a .pstats file named after the client address and the
+time the session started, for use with pstats, snakeviz etc.
+
+The whole session can be profiled, or only the execution of instructions
+(leaving out receiving, unpacking, packing and sending messages). The
+profile written can be focussed on the fixtures (the functions in modules
+outside waferslim and the python installation) or on waferslim itself.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import time
+
+SESSION = 'session'
+EXECUTION = 'execution'
+SCOPES = (SESSION, EXECUTION)
+ALL = 'all'
+FIXTURES = 'fixtures'
+WAFERSLIM = 'waferslim'
+FOCUSES = (ALL, FIXTURES, WAFERSLIM)
+_LOGGER_NAME = 'WaferSlimServer'
+_SETTINGS = None  # (directory, scope, focus), while profiling is enabled
+_WAFERSLIM_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_PYTHON_DIRS = tuple(set([os.path.abspath(getattr(sys, name)) + os.sep
+                          for name in ('prefix', 'exec_prefix',
+                                       'base_prefix', 'base_exec_prefix')
+                          if hasattr(sys, name)]))
+
+
+class SessionProfile(object):
+    ''' Profile of a single session, to be written to a file in directory
+    when it stops '''
+
+    def __init__(self, client_address, directory, scope=SESSION, focus=ALL):
+        ''' Specify the client the session is with, and where and how to
+        profile it '''
+        self.path = os.path.join(directory, _file_name(client_address))
+        self.scope = scope
+        self.focus = focus
+        self._profiler = cProfile.Profile()
+        self._profiled = False  # has the profiler been enabled at all?
+
+    def start(self):
+        ''' The session is starting: profile it, if profiling it all '''
+        if self.scope == SESSION:
+            self._enable()
+
+    def execute(self, instructions, execution_context, results):
+        ''' Execute instructions, profiling them if only profiling the
+        execution of instructions '''
+        if self.scope != EXECUTION or not self._enable():
+            return instructions.execute(execution_context, results)
+        try:
+            return instructions.execute(execution_context, results)
+        finally:
+            self._profiler.disable()
+
+    def _enable(self):
+        ''' Enable the profiler, returning whether it could be: only one
+        profiler can be active at a time in python 3.12+, so a session
+        concurrent with another being profiled goes unprofiled '''
+        try:
+            self._profiler.enable()
+        except ValueError as error:
+            logging.getLogger(_LOGGER_NAME).warning(
+                'Not profiling %s: %s' % (self.path, error))
+            return False
+        self._profiled = True
+        return True
+
+    def stop(self):
+        ''' The session has ended: write its profile, if it was profiled '''
+        self._profiler.disable()
+        if not self._profiled:
+            return
+        profile = pstats.Stats(self._profiler)
+        if self.focus != ALL:
+            _focus(profile, self.focus == FIXTURES and _is_fixture
+                   or _is_waferslim)
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        profile.dump_stats(self.path)
+        logging.getLogger(_LOGGER_NAME).info('Wrote profile %s' % self.path)
+
+
+def _file_name(client_address):
+    ''' The name of the file for the profile of a session with a client that
+    is starting now: host_port_YYYYmmdd-HHMMSS-micros.pstats '''
+    now = time.time()
+    timestamp = '%s-%06d' % (time.strftime('%Y%m%d-%H%M%S',
+                                           time.localtime(now)),
+                             (now % 1) * 1000000)
+    address = '_'.join(['%s' % part for part in client_address[:2]])
+    return '%s_%s.pstats' % (re.sub('[^\\w.-]', '-', address), timestamp)
+
+
+def _is_waferslim(filename):
+    ''' Is filename that of a waferslim module? '''
+    return os.path.abspath(filename).startswith(_WAFERSLIM_DIR)
+
+
+def _is_fixture(filename):
+    ''' Is filename that of a module from neither waferslim nor the python
+    installation (or a built-in function, which has none)? '''
+    if filename.startswith('~') or filename.startswith('<'):
+        return False
+    path = os.path.abspath(filename)
+    return not path.startswith(_WAFERSLIM_DIR) \
+        and not path.startswith(_PYTHON_DIRS)
+
+
+def _focus(profile, keep):
+    ''' Drop the functions from a pstats.Stats profile for which
+    keep(filename) is false, including as callers of those kept '''
+    kept = {}
+    for function, (primitive, calls, own_time, cumulative_time, callers) \
+            in profile.stats.items():
+        if keep(function[0]):
+            callers = dict((caller, timing)
+                           for caller, timing in callers.items()
+                           if keep(caller[0]))
+            kept[function] = (primitive, calls, own_time, cumulative_time,
+                              callers)
+    profile.stats = kept
+
+
+def enable(directory, scope=SESSION, focus=ALL):
+    ''' Profile each session from now on, writing the profiles to directory
+    -- either the whole SESSION or just the EXECUTION of instructions -- and
+    focussing on ALL functions, or just FIXTURES or WAFERSLIM ones '''
+    global _SETTINGS
+    if scope not in SCOPES:
+        raise ValueError('%r is not one of %s' % (scope, SCOPES))
+    if focus not in FOCUSES:
+        raise ValueError('%r is not one of %s' % (focus, FOCUSES))
+    _SETTINGS = (directory, scope, focus)
+
+
+def disable():
+    ''' Stop profiling sessions that start from now on '''
+    global _SETTINGS
+    _SETTINGS = None
+
+
+def session(client_address, scope=None):
+    ''' A SessionProfile for a session with a client that is starting, with
+    the scope specified (or enabled), or None unless profiling is enabled '''
+    if _SETTINGS is None:
+        return None
+    directory, enabled_scope, focus = _SETTINGS
+    return SessionProfile(client_address, directory, scope or enabled_scope,
+                          focus)
@@ -10,11 +10,17 @@ Copyright 2009-2010 by the author(s). All rights reserved
 
 from .slim_exceptions import WaferSlimException
 from .execution import Results, ExecutionContext, Instructions
+from . import recorder, stats, tracing
+import codecs
 import re
 import six
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
 
 BYTE_ENCODING = 'utf-8'  # can be altered by server startup options
-BUFFER_SIZE = 4098
+BUFFER_SIZE = 64 * 1024  # initial size of each connection's receive buffer
 _VERSION = 'Slim -- V0.3\n'
 _START_CHUNK = '['
 _END_CHUNK = ']'
@@ -26,6 +32,7 @@ _NUMERIC_BLOCK_LENGTH = len((_NUMERIC_ENCODING % 0).encode(BYTE_ENCODING)) \
     + _SEPARATOR_LENGTH
 _ITEM_ENCODING = _NUMERIC_ENCODING + '%s%s'
 _DISCONNECT = 'bye'
+_MAX_HEADER_LENGTH = 16
 
 
 class UnpackingError(WaferSlimException):
@@ -41,8 +48,11 @@ class UnpackingError(WaferSlimException):
         return 'MALFORMED_INSTRUCTION %s' % self.args[0]
 
 
-def unpack(packed_string):
-    ''' Unpack a chunked-up packed_string into a list '''
+def unpack(packed_string, lazy=False):
+    ''' Unpack a chunked-up packed_string into a list, or into a LazyChunk
+    if lazy is True '''
+    if lazy:
+        return unpack_bytes(packed_string.encode(BYTE_ENCODING), lazy=True)
     chunks = []
     _unpack_chunk(packed_string, chunks)
     return chunks
@@ -109,6 +119,301 @@ def _check_separator(packed_chunk, pos):
         raise UnpackingError(msg)
 
 
+_START_CHUNK_BYTE = b'['
+_END_CHUNK_BYTE = b']'
+_SEPARATOR_BYTE = b':'
+_CHUNK_BYTES_RE = re.compile(('\\[[0-9]{%s}:[0-9]{%s}:' % (_NUMERIC_LENGTH,
+                                                           _NUMERIC_LENGTH)
+                              ).encode('ascii'))
+_CHUNK_TEXT_RE = re.compile(_CHUNK_BYTES_RE.pattern.decode('ascii'))
+_NON_ASCII_RE = re.compile(b'[\x80-\xff]')
+_UTF8_CONTINUATION = bytes(bytearray(range(0x80, 0xc0)))
+_MEMORYVIEW_DECODE_SIZE = 4096  # smaller leaves decode faster from a copy
+
+
+def unpack_bytes(packed_bytes, encoding=None, lazy=False):
+    ''' Unpack chunked-up packed_bytes into a list, exactly as unpack() would
+    for the decoded string. Works on byte offsets with an explicit stack
+    (no recursion), so only the leaf strings are ever decoded - large leaves
+    straight out of a memoryview, without an intermediate copy.
+    Item lengths count characters, not bytes, so only pure ascii messages
+    are walked as bytes: multibyte utf-8 messages are decoded once and
+    unpacked as text, which is quicker than measuring their items one by
+    one, as are messages in other encodings.
+    If lazy is True a LazyChunk over packed_bytes is returned instead
+    (utf-8 only: other encodings are always unpacked eagerly). '''
+    encoding = encoding or BYTE_ENCODING
+    if codecs.lookup(encoding).name != 'utf-8':
+        return _unpack_text(bytes(packed_bytes).decode(encoding))
+    if not isinstance(packed_bytes, bytes):
+        packed_bytes = bytes(packed_bytes)
+    if lazy:
+        _check_bytes_chunk(packed_bytes, 0, len(packed_bytes))
+        return LazyChunk(packed_bytes, 0, len(packed_bytes), encoding,
+                         _is_ascii(packed_bytes, 0, len(packed_bytes)))
+
+    data = packed_bytes
+    limit = len(data)
+    if not _is_ascii(data, 0, limit):
+        return _unpack_text(data.decode(encoding))
+    view = memoryview(data)
+    _check_bytes_chunk(data, 0, limit)
+    unpacked = chunks = []
+    remaining, pos = _read_chunk_header(data, 0, limit)
+    lengths = {}  # numeric blocks repeat a lot: parse each one only once
+    stack = []
+    while True:
+        if not remaining:
+            if not stack:
+                return unpacked
+            chunks, remaining, pos, limit = stack.pop()
+            continue
+        remaining -= 1
+
+        block = data[pos:pos + _NUMERIC_BLOCK_LENGTH]
+        try:
+            item_len = lengths[block]
+        except KeyError:
+            item_len = lengths[block] = _read_number(data, pos, limit)
+        pos += _NUMERIC_BLOCK_LENGTH
+        end = pos + item_len
+        if end >= limit or data[end:end + 1] != _SEPARATOR_BYTE:
+            _raise_no_separator(end)
+
+        if data[pos:pos + 1] == _START_CHUNK_BYTE \
+                and _is_byte_chunk(data, pos, end):
+            sub_chunk = []
+            chunks.append(sub_chunk)
+            stack.append((chunks, remaining, end + _SEPARATOR_LENGTH, limit))
+            chunks, limit = sub_chunk, end
+            remaining, pos = _read_chunk_header(data, pos, end)
+            continue
+
+        if end - pos >= _MEMORYVIEW_DECODE_SIZE:
+            chunks.append(codecs.decode(view[pos:end], encoding))
+        else:
+            chunks.append(data[pos:end].decode())
+        pos = end + _SEPARATOR_LENGTH
+
+
+class LazyChunk(Sequence):
+    ''' List-like view of a packed chunk held in data[start:end]. Nothing is
+    unpacked until the chunk is indexed or iterated, and then only the items
+    at this level: leaves are decoded, nested chunks become LazyChunk-s that
+    stay as undecoded byte ranges until they in turn are used. '''
+
+    def __init__(self, data, start, end, encoding, is_ascii=False):
+        ''' Specify the (utf-8) data and the range of the packed chunk.
+        is_ascii is a hint that lengths can be read as byte counts '''
+        self._data = data
+        self._start = start
+        self._end = end
+        self._encoding = encoding
+        self._is_ascii = is_ascii
+        self._spans = None
+        self._items = None
+
+    def _scan(self):
+        ''' Find the byte range of each item at this level, once '''
+        if self._spans is not None:
+            return self._spans
+        data, limit = self._data, self._end
+        count, pos = _read_chunk_header(data, self._start, limit)
+        spans = []
+        for _ in range(count):
+            item_len = _read_number(data, pos, limit)
+            pos += _NUMERIC_BLOCK_LENGTH
+            if self._is_ascii:
+                end = pos + item_len
+            else:
+                end = _utf8_span(data, pos, item_len)
+            if end >= limit or data[end:end + 1] != _SEPARATOR_BYTE:
+                _raise_no_separator(end)
+            spans.append((pos, end))
+            pos = end + _SEPARATOR_LENGTH
+        self._spans = spans
+        self._items = [_NOT_UNPACKED] * count
+        return spans
+
+    def _item(self, index):
+        ''' Unpack (and remember) the item at index '''
+        item = self._items[index]
+        if item is _NOT_UNPACKED:
+            start, end = self._spans[index]
+            if _is_byte_chunk(self._data, start, end):
+                item = LazyChunk(self._data, start, end, self._encoding,
+                                 self._is_ascii)
+            else:
+                item = self._data[start:end].decode(self._encoding)
+            self._items[index] = item
+        return item
+
+    def __len__(self):
+        ''' Number of items, read from the chunk header alone '''
+        if self._spans is not None:
+            return len(self._spans)
+        return _read_chunk_header(self._data, self._start, self._end)[0]
+
+    def __getitem__(self, index):
+        ''' An item, or a list of items for a slice '''
+        indices = range(len(self._scan()))
+        if isinstance(index, slice):
+            return [self._item(i) for i in indices[index]]
+        return self._item(indices[index])
+
+    def __iter__(self):
+        ''' Iterate over the items, unpacking each in turn '''
+        for index in range(len(self._scan())):
+            yield self._item(index)
+
+    def __eq__(self, other):
+        ''' Equal to a list, tuple or LazyChunk with equal items -- nested
+        chunks comparing equal to nested lists or tuples alike, so that a
+        table argument compares as the tuples eager unpacking gives would '''
+        if not isinstance(other, (list, tuple, LazyChunk)) \
+                or len(self) != len(other):
+            return False
+        for mine, theirs in zip(self, other):
+            if not mine == theirs:
+                return False
+        return True
+
+    def __ne__(self, other):
+        ''' Python 2 does not derive != from == '''
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        ''' Summarise without unpacking anything '''
+        return '<LazyChunk of %s items, %s bytes>' % (
+            len(self), self._end - self._start)
+
+    def has_symbols(self):
+        ''' True if any item, however deeply nested, might hold a $symbol '''
+        return self._data.find(b'$', self._start, self._end) != -1
+
+    def to_list(self):
+        ''' Unpack everything, as unpack_bytes() would have done eagerly '''
+        return unpack_bytes(self._data[self._start:self._end],
+                            self._encoding)
+
+
+_NOT_UNPACKED = object()
+
+
+def _unpack_text(text):
+    ''' Unpack an already decoded chunk: the str counterpart of the loop in
+    unpack_bytes(), with character offsets and no decoding to do '''
+    limit = len(text)
+    _check_chunk(text)
+    unpacked = chunks = []
+    remaining = _read_number(text, 1, limit, _SEPARATOR)
+    pos = 1 + _NUMERIC_BLOCK_LENGTH
+    lengths = {}
+    stack = []
+    while True:
+        if not remaining:
+            if not stack:
+                return unpacked
+            chunks, remaining, pos, limit = stack.pop()
+            continue
+        remaining -= 1
+
+        block = text[pos:pos + _NUMERIC_BLOCK_LENGTH]
+        try:
+            item_len = lengths[block]
+        except KeyError:
+            item_len = lengths[block] = _read_number(text, pos, limit,
+                                                     _SEPARATOR)
+        pos += _NUMERIC_BLOCK_LENGTH
+        end = pos + item_len
+        if end >= limit or text[end] != _SEPARATOR:
+            _raise_no_separator(end)
+
+        if text.startswith(_START_CHUNK, pos, end) \
+                and text.endswith(_END_CHUNK, pos, end) \
+                and _CHUNK_TEXT_RE.match(text, pos, end) is not None:
+            sub_chunk = []
+            chunks.append(sub_chunk)
+            stack.append((chunks, remaining, end + _SEPARATOR_LENGTH, limit))
+            chunks, limit = sub_chunk, end
+            remaining = _read_number(text, pos + 1, limit, _SEPARATOR)
+            pos += 1 + _NUMERIC_BLOCK_LENGTH
+            continue
+
+        chunks.append(text[pos:end])
+        pos = end + _SEPARATOR_LENGTH
+
+
+def _is_ascii(data, start, end):
+    ''' True if data[start:end] holds only ascii bytes '''
+    chunk = data[start:end]
+    if hasattr(chunk, 'isascii'):
+        return chunk.isascii()
+    return _NON_ASCII_RE.search(chunk) is None
+
+
+def _utf8_span(data, start, num_chars):
+    ''' Byte offset just past num_chars utf-8 encoded chars from start '''
+    end = start + num_chars
+    chunk = data[start:end]
+    missing = len(chunk) - len(chunk.translate(None, _UTF8_CONTINUATION))
+    while missing:
+        chunk = data[end:end + missing]
+        end += missing
+        missing = len(chunk) - len(chunk.translate(None, _UTF8_CONTINUATION))
+    while b'\x80' <= data[end:end + 1] < b'\xc0':
+        end += 1
+    return end
+
+
+def _is_byte_chunk(data, start, end):
+    ''' Byte-offset equivalent of is_chunk() for data[start:end] '''
+    return (data.startswith(_START_CHUNK_BYTE, start, end)
+            and data.endswith(_END_CHUNK_BYTE, start, end)
+            and _CHUNK_BYTES_RE.match(data, start, end) is not None)
+
+
+def _check_bytes_chunk(data, start, end):
+    ''' Verify format of a packed chunk held in data[start:end] '''
+    if not data.startswith(_START_CHUNK_BYTE, start, end):
+        msg = '%r has no leading %r' % (data[start:end], _START_CHUNK)
+    elif not data.endswith(_END_CHUNK_BYTE, start, end):
+        msg = '%r has no trailing %r' % (data[start:end], _END_CHUNK)
+    else:
+        return
+    raise UnpackingError(msg)
+
+
+def _read_chunk_header(data, start, end):
+    ''' Read the item count of the chunk starting at start, returning it
+    with the position of the first item '''
+    pos = start + len(_START_CHUNK_BYTE)
+    count = _read_number(data, pos, end)
+    return count, pos + _NUMERIC_BLOCK_LENGTH
+
+
+def _read_number(data, pos, limit, separator=_SEPARATOR_BYTE):
+    ''' Read a numeric block (digits then separator) at position pos '''
+    separator_pos = pos + _NUMERIC_LENGTH
+    try:
+        number = int(data[pos:separator_pos])
+    except ValueError:
+        msg = '%r is not a numeric length at pos %s' % (
+            data[pos:separator_pos], pos)
+        raise UnpackingError(msg)
+    if separator_pos >= limit \
+            or data[separator_pos:separator_pos + 1] != separator:
+        _raise_no_separator(separator_pos)
+    return number
+
+
+def _raise_no_separator(pos):
+    ''' Fail to find a separator at position pos '''
+    raise UnpackingError('no %r separator at pos %s' % (_SEPARATOR, pos))
+
+
 def pack(item_list):
     ''' Pack each item from a list into the chunked-up format '''
     packed = [_pack_item(item) for item in item_list]
@@ -122,22 +427,303 @@ def _pack_item(item):
     [iiiiii:llllll:item...]'''
     if isinstance(item, list):
         return _pack_item(pack(item))
-    if isinstance(item, str):
+    if isinstance(item, six.binary_type):
         item = item.decode(BYTE_ENCODING, 'replace')
-    if isinstance(item, unicode):
+    if isinstance(item, six.text_type):
         return _ITEM_ENCODING % (len(item), _SEPARATOR, item)
     raise TypeError('%r is not a string' % item)
 
 
+_LENGTH_PLACEHOLDER = b'0' * _NUMERIC_LENGTH + _SEPARATOR_BYTE
+
+
+def pack_response(item_list, encoding=None):
+    ''' Pack each item from a list straight into the framed bytes of a
+    response: a numeric header with the byte length of the message, then
+    the chunked-up message itself. Everything is written in a single pass
+    into one bytearray; each length is filled in as soon as the item it
+    describes has been written, so every leaf is encoded exactly once. '''
+    encoding = encoding or BYTE_ENCODING
+    response = bytearray(_LENGTH_PLACEHOLDER)
+    _write_chunk(response, item_list, encoding)
+    _write_length(response, 0, len(response) - len(_LENGTH_PLACEHOLDER))
+    return response
+
+
+def _write_chunk(response, item_list, encoding):
+    ''' Append item_list in the chunked-up format to the response bytearray,
+    returning the number of characters written. Runs of leaf items are
+    formatted together and encoded once. '''
+    num_chars = 0
+    parts = [_START_CHUNK, _NUMERIC_ENCODING % len(item_list), _SEPARATOR]
+    for item in item_list:
+        if isinstance(item, list):
+            text = u''.join(parts)
+            response += text.encode(encoding)
+            length_pos = len(response)
+            response += _LENGTH_PLACEHOLDER
+            item_chars = _write_chunk(response, item, encoding)
+            response += _SEPARATOR_BYTE
+            num_chars += len(text) + item_chars + _SEPARATOR_LENGTH \
+                + _write_length(response, length_pos, item_chars)
+            parts = []
+            continue
+        if isinstance(item, six.binary_type):
+            item = item.decode(BYTE_ENCODING, 'replace')
+        elif not isinstance(item, six.text_type):
+            raise TypeError('%r is not a string' % item)
+        parts.append(_ITEM_ENCODING % (len(item), _SEPARATOR, item))
+        parts.append(_SEPARATOR)
+    parts.append(_END_CHUNK)
+    text = u''.join(parts)
+    response += text.encode(encoding)
+    return num_chars + len(text)
+
+
+def _write_length(response, pos, length):
+    ''' Fill in the numeric block at pos in the response bytearray with
+    length, returning the number of characters in the block '''
+    block = (_NUMERIC_ENCODING % length).encode('ascii') + _SEPARATOR_BYTE
+    response[pos:pos + len(_LENGTH_PLACEHOLDER)] = block  # may grow
+    return len(block)
+
+
+class FrameResults(Results):
+    ''' Results encoded straight into the framed response as each one is
+    added, rather than collected into a list to be packed afterwards '''
+
+    def __init__(self, *args):
+        ''' Start the frame, to be completed by frame() '''
+        Results.__init__(self, *args)
+        self._encoding = BYTE_ENCODING
+        self._frame = bytearray(_LENGTH_PLACEHOLDER + _START_CHUNK_BYTE
+                                + _LENGTH_PLACEHOLDER)
+
+    _RESULT_ENCODING = u''.join([_START_CHUNK, _NUMERIC_ENCODING % 2,
+                                 _SEPARATOR, _ITEM_ENCODING, _SEPARATOR,
+                                 _ITEM_ENCODING, _SEPARATOR, _END_CHUNK])
+
+    def _add(self, instruction_id, str_result):
+        ''' Encode the result of an instruction into the frame, as the chunk
+        [instruction_id, str_result] -- or nothing at all if that fails '''
+        if isinstance(str_result, six.text_type) \
+                and isinstance(instruction_id, six.text_type):
+            item = FrameResults._RESULT_ENCODING % (
+                len(instruction_id), _SEPARATOR, instruction_id,
+                len(str_result), _SEPARATOR, str_result)
+            self._frame += (_ITEM_ENCODING % (len(item), _SEPARATOR, item)
+                            + _SEPARATOR).encode(self._encoding)
+            return
+        frame = self._frame
+        length_pos = len(frame)
+        frame += _LENGTH_PLACEHOLDER
+        try:
+            item_chars = _write_chunk(frame, [instruction_id, str_result],
+                                      self._encoding)
+        except Exception:
+            del frame[length_pos:]
+            raise
+        frame += _SEPARATOR_BYTE
+        _write_length(frame, length_pos, item_chars)
+
+    def frame(self):
+        ''' The framed response with the results added so far, as
+        pack_response() would pack the collection() of them '''
+        response = self._frame + _END_CHUNK_BYTE
+        _write_length(response, len(_LENGTH_PLACEHOLDER + _START_CHUNK_BYTE),
+                      self.count)
+        _write_length(response, 0, len(response) - len(_LENGTH_PLACEHOLDER))
+        return response
+
+    def collection(self):
+        ''' The results added so far, unpacked from the frame '''
+        return unpack_bytes(bytes(self.frame()[len(_LENGTH_PLACEHOLDER):]))
+
+
+class MessageReader(object):
+    ''' Reads the length-framed messages sent on a socket, one at a time.
+    Bytes are received with recv_into() into a single buffer that grows to
+    fit the largest message, so short reads are retried and any bytes of a
+    following (pipelined) message are kept for the next read. '''
+
+    def __init__(self, sock, encoding=None):
+        ''' Specify the socket to read from and the encoding used to count
+        the characters in each message '''
+        self._sock = sock
+        self._encoding = encoding or BYTE_ENCODING
+        self._buffer = bytearray(BUFFER_SIZE)
+        self._start = 0  # first byte not yet read
+        self._end = 0  # first byte not yet received
+        self.received = 0
+        self.recv_calls = 0
+
+    def read_message(self):
+        ''' Receive the next message and return its raw bytes. The numeric
+        header holds the length of the message in characters. '''
+        return self.read_chars(self.read_length())
+
+    def read_length(self):
+        ''' Receive the numeric header of the next message '''
+        while True:
+            pos = self._buffer.find(_SEPARATOR_BYTE, self._start, self._end)
+            if pos != -1:
+                break
+            if self._end - self._start > _MAX_HEADER_LENGTH:
+                pos = self._end
+                break
+            self._receive(1)
+        digits = bytes(self._buffer[self._start:pos])
+        if not digits.isdigit():
+            msg = '%r is not a numeric message length' % digits
+            raise UnpackingError(msg)
+        self._consume(pos + _SEPARATOR_LENGTH)
+        return int(digits)
+
+    def read_response(self):
+        ''' Receive the next response and return its raw bytes. The numeric
+        header of a response, as framed by pack_response(), holds its length
+        in bytes rather than in characters. '''
+        return self.read_bytes(self.read_length())
+
+    def read_bytes(self, num_bytes):
+        ''' Receive and return the next num_bytes bytes '''
+        self._fill(num_bytes)
+        return self._consume(self._start + num_bytes)
+
+    def peek(self, num_bytes):
+        ''' Receive, but do not read, the next num_bytes bytes '''
+        self._fill(num_bytes)
+        return bytes(self._buffer[self._start:self._start + num_bytes])
+
+    def read_chars(self, num_chars):
+        ''' Receive and return the bytes of the next num_chars characters.
+        Pure ascii needs no decoding; otherwise an incremental decoder is fed
+        just enough bytes each time that it cannot go past the last one. '''
+        self._fill(num_chars)
+        end = self._start + num_chars
+        if not _is_ascii(self._buffer, self._start, end):
+            decoder = codecs.getincrementaldecoder(self._encoding)()
+            offset, decoded = 0, 0  # relative to _start, which _fill moves
+            while decoded < num_chars:
+                wanted = num_chars - decoded
+                self._fill(offset + wanted)
+                start = self._start + offset
+                decoded += len(decoder.decode(
+                    self._buffer[start:start + wanted]))
+                offset += wanted
+            end = self._start + offset
+        return self._consume(end)
+
+    def _fill(self, num_bytes):
+        ''' Receive until at least num_bytes unread bytes are buffered '''
+        while self._end - self._start < num_bytes:
+            self._receive(num_bytes - (self._end - self._start))
+
+    def _receive(self, num_bytes):
+        ''' Receive as much as is available, making space for num_bytes '''
+        if self._end + num_bytes > len(self._buffer):
+            unread = self._end - self._start
+            self._buffer[:unread] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, unread
+            if unread + num_bytes > len(self._buffer):
+                size = max(unread + num_bytes, 2 * len(self._buffer))
+                self._buffer.extend(bytearray(size - len(self._buffer)))
+        received = self._sock.recv_into(memoryview(self._buffer)[self._end:])
+        self.recv_calls += 1
+        if not received:
+            raise EOFError('Connection closed while reading a message')
+        self._end += received
+
+    def _consume(self, end):
+        ''' Mark the buffered bytes up to end as read, and return them '''
+        data = bytes(memoryview(self._buffer)[self._start:end])
+        self.received += end - self._start
+        self._start = end
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(self._buffer) > 4 * BUFFER_SIZE:
+                self._buffer = bytearray(BUFFER_SIZE)
+        return data
+
+
+class StreamedInstructions(object):
+    ''' Iterable over the instructions of a message, each unpacked as soon
+    as it has been received rather than once the whole message has been.
+    Only the outer list is read incrementally: each instruction (with any
+    table arguments) is unpacked in full, or lazily if lazy is True. '''
+
+    def __init__(self, reader, num_chars, lazy=False, keep=False):
+        ''' Specify the reader positioned just after the numeric header
+        of a message of num_chars characters, and whether to keep the bytes
+        received (e.g. for recording) '''
+        self._reader = reader
+        self._num_chars = self._remaining = num_chars
+        self._lazy = lazy
+        self._parts = None
+        if keep:
+            self._parts = []
+
+    def __iter__(self):
+        ''' Receive and unpack instructions one at a time '''
+        header = self._read(len(_START_CHUNK) + _NUMERIC_BLOCK_LENGTH)
+        if not header.startswith(_START_CHUNK_BYTE):
+            raise UnpackingError('%r has no leading %r' % (header,
+                                                           _START_CHUNK))
+        count = _read_chunk_header(header, 0, len(header))[0]
+        for _ in range(count):
+            block = self._read(_NUMERIC_BLOCK_LENGTH)
+            item_len = _read_number(block, 0, len(block))
+            item = self._read(item_len)
+            if self._read(_SEPARATOR_LENGTH) != _SEPARATOR_BYTE:
+                _raise_no_separator(self._num_chars - self._remaining - 1)
+            if _is_byte_chunk(item, 0, len(item)):
+                yield unpack_bytes(item, lazy=self._lazy)
+            else:
+                yield item.decode(BYTE_ENCODING)
+        rest = self._read(self._remaining)
+        if not rest.endswith(_END_CHUNK_BYTE):
+            raise UnpackingError('%r has no trailing %r' % (rest, _END_CHUNK))
+
+    def _read(self, num_chars):
+        ''' Receive the next num_chars chars, as long as they are within
+        the message '''
+        if num_chars > self._remaining:
+            msg = 'message has only %s more chars, not %s' % (
+                self._remaining, num_chars)
+            raise UnpackingError(msg)
+        self._remaining -= num_chars
+        data = self._reader.read_chars(num_chars)
+        if self._parts is not None:
+            self._parts.append(data)
+        return data
+
+    def drain(self):
+        ''' Receive (and ignore) whatever remains of the message '''
+        if self._remaining:
+            self._read(self._remaining)
+
+    def received(self):
+        ''' The bytes of the message received so far, if kept '''
+        if self._parts is not None:
+            return b''.join(self._parts)
+        return None
+
+
 class RequestResponder(object):
     ''' Mixin class for responding to Slim requests.
     Logic mostly reverse engineered from Java test classes especially
     fitnesse.responders.run.slimResponder.SlimTestSystemTest '''
 
+    lazy_unpacking = False  # unpack instructions into LazyChunk-s?
+    streaming = False  # execute instructions while receiving the message?
+    plan_cache = None  # execution.InstructionPlans shared by all sessions
+    symbol_objects = False  # pass stored objects for "$symbol" arguments?
+    profile = None  # profiling.SessionProfile of the session, if profiled
+
     def respond_to_request(self,
                            instructions=Instructions,
                            execution_context=ExecutionContext,
-                           results=Results):
+                           results=FrameResults):
         ''' Entry point for mixin: respond to a Slim protocol request.
         Basic format of every interaction is:
         - every request requires an initial ACK with the Slim Version
@@ -146,77 +732,114 @@ class RequestResponder(object):
         '''
         ack_bytes = self._send_ack(self.request)
         context = execution_context()
-        received, sent = self._message_loop(instructions,
-                                            context,
-                                            results)
+        context.symbol_objects = self.symbol_objects
+        reader = MessageReader(self.request)
+        try:
+            received, sent = self._message_loop(reader,
+                                                instructions,
+                                                context,
+                                                results)
+        finally:
+            context.cleanup()
+            tracing.dump(new_only=True)
+            stats.write()
         return received, sent + ack_bytes
 
     def _send_ack(self, request):
         ''' Acknowledge the request by sending the Slim Version '''
         response = _VERSION.encode(BYTE_ENCODING)
-        self.debug('Send Ack')
+        tracing.record('ack')
         return request.send(response)
 
-    def _message_loop(self, instructions, execution_context, new_result):
-        ''' Receive messages from the request and send responses.
+    def _message_loop(self, reader, instructions, execution_context,
+                      new_result):
+        ''' Receive messages from the reader and send responses.
         Each message starts with a numeric header (number of digits defined
-        in _NUMERIC_LENGTH) which contains the byte length
+        in _NUMERIC_LENGTH) which contains the character length
         of the message contents. The message contents can then be read,
-        their instructions executed, and the results returned.'''
-        received, sent = 0, 0
+        their instructions executed, and the results returned.
+        When streaming, each instruction is executed as soon as it has been
+        received. If the message then turns out to be malformed, the results
+        of any instructions already executed are discarded and the response
+        is the same as if the message had been rejected before executing
+        anything (though their side effects remain).'''
+        sent = 0
+        recording = recorder.current()
+        session = recording and recording.new_session()
+        number = 0
 
         while True:
-            message_length, bytes_received = self._get_message_length()
-            self.debug('Next message %s bytes' % message_length)
-            received += bytes_received
-
-            message = self._get_message(message_length)
-            received += message_length
-
-            if _DISCONNECT == message:
-                break
-
-            result = new_result()
-            try:
-                instruction_list = instructions(unpack(message))
+            length = reader.read_length()
+            received = recording and stats.clock()
+            if self.streaming and length \
+                    and reader.peek(1) == _START_CHUNK_BYTE:
+                tracing.record('streaming', length)
+                message = StreamedInstructions(reader, length,
+                                               self.lazy_unpacking,
+                                               keep=recording is not None)
+            else:
+                message = reader.read_chars(length)
+                tracing.record('message', len(message))
+                if _DISCONNECT.encode(BYTE_ENCODING) == message:
+                    break
+
+            executing = recording and stats.clock()
+            response = self._respond(message, instructions,
+                                     execution_context, new_result)
+            timings = stats.current()
+            start = (timings or recording) and stats.clock()
+            self.request.sendall(response)
+            if timings is not None:
+                timings.add(stats.PROTOCOL, 'send', stats.clock() - start)
+            sent += len(response)
+            if recording is not None:
+                number += 1
+                if isinstance(message, StreamedInstructions):
+                    # received while executing
+                    message, received = message.received(), executing
+                recording.record(session, number, message, response,
+                                 executing - received, start - executing,
+                                 stats.clock() - start)
+
+        return reader.received, sent
+
+    def _respond(self, message, instructions, execution_context, new_result):
+        ''' Execute the instructions in a message - raw bytes or
+        StreamedInstructions - and return the framed response '''
+        result = new_result()
+        timings = stats.current()
+        try:
+            if isinstance(message, StreamedInstructions):
+                unpacked = message
+            else:
+                start = timings and stats.clock()
+                unpacked = unpack_bytes(message, lazy=self.lazy_unpacking)
+                if timings is not None:
+                    timings.add(stats.PROTOCOL, 'unpack',
+                                stats.clock() - start)
+            if self.plan_cache is not None and unpacked is not message:
+                instruction_list = instructions(unpacked,
+                                                plans=self.plan_cache)
+            else:
+                instruction_list = instructions(unpacked)
+            if self.profile is not None:
+                self.profile.execute(instruction_list, execution_context,
+                                     result)
+            else:
                 instruction_list.execute(execution_context, result)
-            except UnpackingError as error:
-                result.failed(error, error.description())
-
-            results = result.collection()
-            self.debug('Results: %r' % results)
-            formatted_response = self._format_response(pack(results))
-            sent += self.request.send(formatted_response)
-
-        return received, sent
-
-    def _get_message_length(self):
-        ''' Get the length of the message from an initial numeric header '''
-        header_format = (_NUMERIC_ENCODING % 0) + _SEPARATOR
-        byte_size = len(header_format.encode(BYTE_ENCODING))
-        data = self.request.recv(byte_size).decode(BYTE_ENCODING)
-        length = int(data[0:_NUMERIC_LENGTH])
-        return length, byte_size
-
-    def _get_message(self, message_length):
-        ''' Receive a message of a known length, in parts'''
-        parts = []
-        remaining = message_length
-        while remaining > 0:
-            # Try 1k to work around incorrect message_length with utf-8
-            data = self.request.recv(BUFFER_SIZE)
-            received = len(data)
-            self.debug('Recv %s bytes...' % received)
-            parts.append(data)
-            remaining -= received
-        return six.binary_type().join(parts).decode(BYTE_ENCODING)
-
-    def _format_response(self, msg):
-        ''' Encode the bytes and add the length in an initial numeric header'''
-        msg_bytes = msg.encode(BYTE_ENCODING)
-        response_str = _ITEM_ENCODING % (len(msg_bytes), _SEPARATOR, msg)
-        return response_str.encode(BYTE_ENCODING)
-
-    def debug(self, msg):
-        ''' log a debug msg '''
-        pass
+        except UnpackingError as error:
+            result = new_result()
+            result.failed(error, error.description())
+        if isinstance(message, StreamedInstructions):
+            message.drain()
+
+        start = timings and stats.clock()
+        if isinstance(result, FrameResults):
+            response = result.frame()
+        else:
+            response = pack_response(result.collection())
+        if timings is not None:
+            timings.add(stats.PROTOCOL, 'pack', stats.clock() - start)
+        tracing.record('response', result.count, result.failures,
+                       len(response))
+        return response
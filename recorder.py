@@ -0,0 +1,218 @@
+'''
+Recording of Slim traffic: every message received, the response sent back
+and how long receiving, executing and sending took, appended to a file as
+JSON lines -- one session after another -- that can be replayed by the
+replay benchmark (python -m waferslim.bench replay FILE). Each line is:
+
+    {"request_id": "<session>-<n>", "session": "<session>",
+     "body": "<message>", "response": "<response>", "time": <when received>,
+     "receive": <seconds>, "execute": <seconds>, "send": <seconds>}
+
+where messages and responses are without their length header, and the
+session is "<process id>-<n>" so that workers' sessions are told apart.
+
+Recording a message only queues it: a background thread formats and
+writes the lines. The file may be capped in size, in which case it is
+rotated (to FILE.1, FILE.2, ...) if there are to be backups or else
+recording stops once the cap is reached.
+
+A process forked after recording was enabled -- such as a pre-fork worker
+-- records to a file of its own, named after its process id: with FILE
+"record.jsonl", worker 1234 records to "record.1234.jsonl". Every file is
+thus appended to, capped and rotated by a single process only.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import atexit
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from six.moves import queue
+
+_LOGGER_NAME = 'WaferSlimServer'
+_RECORDER = None  # the Recorder that messages are recorded by, while enabled
+_STOP = object()  # queued to stop the writer thread
+
+
+class Recorder(object):
+    ''' Records messages to a file through a background writer thread '''
+
+    def __init__(self, path, max_bytes=0, backups=0, encoding='utf-8'):
+        ''' Specify the file to append to, its maximum size in bytes (or 0
+        for no maximum), how many rotated backups of it to keep and the
+        byte-encoding of messages '''
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.encoding = encoding
+        self.written = 0  # messages written
+        self.dropped = 0  # messages not written, once the cap was reached
+        self._sessions = itertools.count(1)
+        self._full = False  # capped and not to be rotated?
+        self._owner = os.getpid()  # the process recording to path itself
+        self._pid = None
+        self._path = path  # the file this process records to
+        self._queue = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def path_for(self, pid):
+        ''' The file that process pid records to '''
+        if pid == self._owner:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return '%s.%s%s' % (root, pid, ext)
+
+    def new_session(self):
+        ''' The name of a session that is starting '''
+        return '%s-%s' % (os.getpid(), next(self._sessions))
+
+    def record(self, session, number, message, response,
+               receive, execute, send):
+        ''' Record message number of session (bytes without the length
+        header, or None if unavailable), the response (bytes with it) and
+        the seconds spent receiving, executing and sending '''
+        if self._pid != os.getpid():  # first message, or in a forked worker
+            self._start()
+        self._queue.put((session, number, message, response, time.time(),
+                         receive, execute, send))
+
+    def _start(self):
+        ''' Start the writer thread of this process '''
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            path = self.path_for(os.getpid())
+            if path != self._path:  # forked: starting a file of its own
+                self._path, self._full = path, False
+            self._writer = threading.Thread(target=self._write_queued,
+                                            name='Recorder')
+            self._writer.daemon = True
+            self._writer.start()
+            self._pid = os.getpid()
+
+    def flush(self):
+        ''' Wait until everything recorded so far has been written '''
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        ''' Write everything recorded so far, then stop the writer thread '''
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._pid = None
+
+    def _write_queued(self):
+        ''' Write the lines for recorded messages as they are queued,
+        flushing the file whenever the queue is empty. If writing fails,
+        the rest are dropped. '''
+        record_file = None
+        failed = False
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is _STOP:
+                        return
+                    if not failed:
+                        try:
+                            record_file = self._write(record_file, item)
+                        except (IOError, OSError) as error:
+                            logging.getLogger(_LOGGER_NAME).error(
+                                'Recording to %s failed: %s'
+                                % (self._path, error))
+                            failed = True
+                    if failed:
+                        self.dropped += 1
+                finally:
+                    self._queue.task_done()
+        finally:
+            if record_file is not None:
+                record_file.close()
+
+    def _write(self, record_file, item):
+        ''' Write the line for a recorded message to the file (opening or
+        rotating it as needed), returning the file to write the next to '''
+        if self._full:
+            self.dropped += 1
+            return None
+        line = self._line(*item)
+        record_file = self._file_for(record_file, len(line))
+        if record_file is None:
+            self.dropped += 1
+            return None
+        record_file.write(line)
+        self.written += 1
+        if self._queue.empty():
+            record_file.flush()
+        return record_file
+
+    def _line(self, session, number, message, response, when,
+              receive, execute, send):
+        ''' The JSON line for a recorded message '''
+        if message is not None:
+            message = message.decode(self.encoding)
+        response = response[response.find(b':') + 1:]
+        record = {'request_id': '%s-%s' % (session, number),
+                  'session': session, 'body': message,
+                  'response': response.decode(self.encoding),
+                  'time': when, 'receive': receive, 'execute': execute,
+                  'send': send}
+        return (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+
+    def _file_for(self, record_file, size):
+        ''' The file to write a line of size bytes to -- rotating it, or
+        None once it is full and not to be rotated '''
+        if record_file is None:
+            record_file = open(self._path, 'ab')
+        if not self.max_bytes \
+                or record_file.tell() + size <= self.max_bytes \
+                or not record_file.tell():
+            return record_file
+        record_file.close()
+        if not self.backups:
+            logging.getLogger(_LOGGER_NAME).warning(
+                'Recording to %s stopped at %s bytes'
+                % (self._path, self.max_bytes))
+            self._full = True
+            return None
+        for backup in range(self.backups - 1, 0, -1):
+            older = '%s.%s' % (self._path, backup)
+            if os.path.exists(older):
+                os.rename(older, '%s.%s' % (self._path, backup + 1))
+        os.rename(self._path, self._path + '.1')
+        return open(self._path, 'ab')
+
+
+def enable(path, max_bytes=0, backups=0, encoding='utf-8'):
+    ''' Start recording messages, returning the Recorder; everything
+    recorded is written before exiting (or, by pre-fork workers, which exit
+    without running atexit handlers, before each worker exits) '''
+    global _RECORDER
+    disable()
+    _RECORDER = Recorder(path, max_bytes, backups, encoding)
+    atexit.register(_RECORDER.close)
+    return _RECORDER
+
+
+def disable():
+    ''' Stop recording messages, once those recorded have been written '''
+    global _RECORDER
+    recorder, _RECORDER = _RECORDER, None
+    if recorder is not None:
+        recorder.close()
+
+
+def current():
+    ''' The Recorder messages are being recorded by, or None if disabled.
+    Get this once per session and record only if it is not None. '''
+    return _RECORDER
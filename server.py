@@ -17,6 +17,68 @@ Run this module to start the WaferSlimServer listening on a host / port:
                                  (default: False)
      -l FILE, --logconf=...      use logging configuration from FILE
      -s PATH, --syspath=...      add entries from PATH to sys.path
+     --lazy                      only unpack table arguments when used:
+                                 fixtures get sequences rather than tuples
+                                 (default: False)
+     --streaming                 execute instructions while still receiving
+                                 the rest of a message (default: False)
+     --symbol-objects            pass the object stored as a symbol, not
+                                 its string form, for an argument that is
+                                 just "$symbol" (default: False)
+     --plan-cache SIZE           reuse the execution plans of up to SIZE
+                                 differently shaped messages (default: 0)
+     --async                     serve connections on an asyncio event loop
+                                 until interrupted (python 3.7+ only)
+     --threads N                 execute instructions in N threads when
+                                 serving with --async (default: chosen by
+                                 concurrent.futures.ThreadPoolExecutor)
+     --persistent                keep serving sessions, each in a fresh
+                                 execution context, until signalled to stop
+                                 (default: stop after the first session)
+     --idle-timeout=SECONDS      with --persistent, stop after no session has
+                                 been active for SECONDS (default: never)
+     --preload PATH[,PATH]       load the fixture classes from each PATH at
+                                 startup, for import instructions to reuse
+     --fixture-cache=FILE        cache the metadata of fixture classes in
+                                 FILE (default: ~/.cache/waferslim/
+                                 fixtures.json)
+     --no-fixture-cache          do not cache fixture class metadata
+     --workers N                 serve sessions in N forked worker processes
+                                 until signalled to stop (POSIX only)
+     --max-sessions N            with --workers, replace each worker after
+                                 it has served N sessions (default: never)
+     --trace N                   keep a trace of the latest N events, dumped
+                                 at the end of each session and on SIGUSR1
+                                 (default: 0, or 1000 if verbose)
+     --trace-file FILE           append the trace to FILE, rather than
+                                 logging it
+     --stats FILE                time fixture methods and protocol phases,
+                                 writing a report to FILE (and FILE.json) at
+                                 the end of each session and on SIGUSR2
+                                 (with --workers, each worker writes to
+                                 FILE with its process id inserted before
+                                 the extension, e.g. stats.1234.txt)
+     --profile DIR               profile each session, writing a .pstats
+                                 file named by client address and time to
+                                 DIR
+     --profile-scope SCOPE       with --profile, profile the whole
+                                 "session" or only the "execution" of
+                                 instructions (default: session, and always
+                                 execution with --async)
+     --profile-focus FOCUS       with --profile, keep "all" functions in the
+                                 profile, or only those of the "fixtures"
+                                 or of "waferslim" (default: all)
+     --record FILE               append each message received, its response
+                                 and timings to FILE as JSON lines, for
+                                 python -m waferslim.bench replay FILE
+                                 (with --workers, each worker appends to
+                                 FILE with its process id inserted before
+                                 the extension, e.g. record.1234.jsonl)
+     --record-max-bytes N        with --record, cap FILE at N bytes
+                                 (default: 0, no cap)
+     --record-backups N          with --record-max-bytes, rotate FILE to
+                                 FILE.1 ... FILE.N when full, rather than
+                                 stop recording (default: 0)
 
     A "trailing" numeric value is assumed to be a port number
     if no explicit PORT is specified, so the following are equivalent
@@ -31,17 +93,21 @@ Copyright 2009-2010 by the author(s). All rights reserved
 import codecs
 import logging.config
 import os
+import signal
 import sys
+import threading
 try:
     import SocketServer
 except ImportError:
     import socketserver as SocketServer
 from optparse import OptionParser
-from . import protocol
+from . import execution, fixture_cache, profiling, protocol, recorder, \
+    stats, tracing
 
 
 _LOGGER_NAME = 'WaferSlimServer'
-_ALL_LOGGER_NAMES = (_LOGGER_NAME, 'Instructions', 'Execution')
+_ALL_LOGGER_NAMES = (_LOGGER_NAME, 'Instructions', 'Execution', 'Trace')
+_VERBOSE_TRACE_SIZE = 1000
 
 
 class SlimRequestHandler(SocketServer.BaseRequestHandler,
@@ -54,10 +120,22 @@ class SlimRequestHandler(SocketServer.BaseRequestHandler,
         ''' log some info about the request then pass off to mixin class '''
         from_addr = '%s:%s' % self.client_address
         self.info('Handling request from %s' % from_addr)
+        self.lazy_unpacking = self.server.lazy_unpacking
+        self.streaming = self.server.streaming
+        self.plan_cache = self.server.plan_cache
+        self.symbol_objects = self.server.symbol_objects
+        self.profile = profiling.session(self.client_address)
+        self.received, self.sent = 0, 0
         try:
-            received, sent = self.respond_to_request()
+            if self.profile is not None:
+                self.profile.start()
+            try:
+                self.received, self.sent = self.respond_to_request()
+            finally:
+                if self.profile is not None:
+                    self.profile.stop()
             done_msg = 'Done with %s: %s bytes received, %s bytes sent'
-            self.info(done_msg % (from_addr, received, sent))
+            self.info(done_msg % (from_addr, self.received, self.sent))
         except Exception as error:
             logging.error(error, exc_info=1)
         self.server.done(self)
@@ -66,14 +144,14 @@ class SlimRequestHandler(SocketServer.BaseRequestHandler,
         ''' log an info msg - present in this class to allow use from mixin'''
         logging.getLogger(_LOGGER_NAME).info(msg)
 
-    def debug(self, msg):
-        ''' log a debug msg - present in this class to allow use from mixin'''
-        logging.getLogger(_LOGGER_NAME).debug(msg)
-
 
 class WaferSlimServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
     ''' Standard python library threaded TCP socket server __init__-ed
-    to delegate request handling to SlimRequestHandler '''
+    to delegate request handling to SlimRequestHandler. Unless persistent,
+    the server shuts down once the first request has been handled; a
+    persistent server carries on until shutdown() is called, a signal passed
+    to shutdown_on_signal() is received, or it has been idle for longer than
+    the idle timeout. '''
 
     def __init__(self, options):
         ''' Initialise socket server on host and port, with logging '''
@@ -81,10 +159,17 @@ class WaferSlimServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
             for name in _ALL_LOGGER_NAMES:
                 logging.getLogger(name).setLevel(logging.DEBUG)
 
-        if not hasattr(self, 'shutdown'):  # only introduced in 2.6
-            self._up = [True]
-            self.shutdown = lambda: self._up and self._up.pop() or self._up
-            self.serve_forever = self._serve_until_shutdown
+        self.lazy_unpacking = getattr(options, 'lazy', False)
+        self.streaming = getattr(options, 'streaming', False)
+        self.symbol_objects = getattr(options, 'symbol_objects', False)
+        plan_cache_size = getattr(options, 'plan_cache', 0)
+        self.plan_cache = plan_cache_size \
+            and execution.InstructionPlans(plan_cache_size) or None
+        self.persistent = getattr(options, 'persistent', False)
+        self.idle_timeout = getattr(options, 'idle_timeout', None)
+        self._sessions = 0
+        self._idle_timer = None
+        self._lock = threading.Lock()
 
         prestart_msg = "Starting server with options: %s" % (options,)
         logging.getLogger(_LOGGER_NAME).info(prestart_msg)
@@ -94,17 +179,66 @@ class WaferSlimServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
         start_msg = "Started and listening on %s:%s" % self.server_address
         logging.getLogger(_LOGGER_NAME).info(start_msg)
 
+    def serve_forever(self, *args, **kwargs):
+        ''' Handle requests until shutdown, timing out when idle '''
+        with self._lock:
+            self._start_idle_timer()
+        try:
+            SocketServer.TCPServer.serve_forever(self, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._cancel_idle_timer()
+
+    def process_request(self, request, client_address):
+        ''' A session is starting - the server is no longer idle '''
+        with self._lock:
+            self._sessions += 1
+            self._cancel_idle_timer()
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    client_address)
+
     def done(self, request_handler):
-        ''' A request_handler has completed - shut down the server'''
-        logging.getLogger(_LOGGER_NAME).info('Shutting down')
+        ''' A request_handler has completed - shut down the server unless
+        persistent, in which case it may now be idle'''
+        if not self.persistent:
+            self._shutdown('Shutting down')
+            return
+        with self._lock:
+            self._sessions -= 1
+            if not self._sessions:
+                self._start_idle_timer()
+
+    def shutdown_on_signal(self, *signums):
+        ''' Shut down when any of the signals is received. Call from the
+        main thread, before serve_forever(). '''
+        def handler(signum, frame):
+            msg = 'Shutting down on signal %s' % signum
+            # shutdown() waits for serve_forever(), so must not be called
+            # from the thread serving (which is the one handling signals)
+            threading.Thread(target=self._shutdown, args=(msg,)).start()
+        for signum in signums:
+            signal.signal(signum, handler)
+
+    def _start_idle_timer(self):
+        ''' Shut down after idle_timeout seconds, unless cancelled first '''
+        if self.persistent and self.idle_timeout:
+            msg = 'Shutting down after %ss idle' % self.idle_timeout
+            self._idle_timer = threading.Timer(self.idle_timeout,
+                                               self._shutdown, (msg,))
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _cancel_idle_timer(self):
+        ''' A session has started, or the server is stopping '''
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _shutdown(self, msg):
+        ''' Log why the server is shutting down, then shut it down '''
+        logging.getLogger(_LOGGER_NAME).info(msg)
         self.shutdown()
 
-    def _serve_until_shutdown(self):
-        ''' Handle requests until shutdown is called '''
-        self.handle_request()
-        while self._up:
-            pass
-
 
 def _get_options():
     ''' Convenience method to parse command line args'''
@@ -127,6 +261,97 @@ def _get_options():
     parser.add_option('-s', '--syspath', dest='syspath',
                       metavar='SYSPATH', default='',
                       help='add entries from SYSPATH to sys.path')
+    parser.add_option('--lazy', dest='lazy',
+                      default=False, action='store_true',
+                      help='only unpack table arguments when used, '
+                           'passing fixtures sequences rather than tuples '
+                           '(default: False)')
+    parser.add_option('--streaming', dest='streaming',
+                      default=False, action='store_true',
+                      help='execute instructions while still receiving the '
+                           'rest of a message (default: False)')
+    parser.add_option('--symbol-objects', dest='symbol_objects',
+                      default=False, action='store_true',
+                      help='pass the object stored as a symbol, not its '
+                           'string form, for a "$symbol" argument '
+                           '(default: False)')
+    parser.add_option('--plan-cache', dest='plan_cache',
+                      metavar='SIZE', type='int', default=0,
+                      help='reuse the execution plans of up to SIZE '
+                           'differently shaped messages (default: 0)')
+    parser.add_option('--async', dest='use_async',
+                      default=False, action='store_true',
+                      help='serve connections on an asyncio event loop '
+                           'until interrupted (python 3.7+ only)')
+    parser.add_option('--threads', dest='threads',
+                      metavar='N', type='int', default=None,
+                      help='execute instructions in N threads with --async')
+    parser.add_option('--persistent', dest='persistent',
+                      default=False, action='store_true',
+                      help='keep serving sessions until signalled to stop '
+                           '(default: False)')
+    parser.add_option('--idle-timeout', dest='idle_timeout',
+                      metavar='SECONDS', type='float', default=None,
+                      help='with --persistent, stop after SECONDS idle')
+    parser.add_option('--preload', dest='preload',
+                      metavar='PATHS', default='',
+                      help='load fixture classes from the comma separated '
+                           'PATHS at startup')
+    parser.add_option('--fixture-cache', dest='fixture_cache',
+                      metavar='FILE', default=fixture_cache.default_path(),
+                      help='cache the metadata of fixture classes in FILE')
+    parser.add_option('--no-fixture-cache', dest='fixture_cache',
+                      action='store_const', const='',
+                      help='do not cache fixture class metadata')
+    parser.add_option('--workers', dest='workers',
+                      metavar='N', type='int', default=0,
+                      help='serve sessions in N forked worker processes')
+    parser.add_option('--max-sessions', dest='max_sessions',
+                      metavar='N', type='int', default=0,
+                      help='with --workers, replace each worker after it has '
+                           'served N sessions')
+    parser.add_option('--trace', dest='trace',
+                      metavar='N', type='int', default=0,
+                      help='keep a trace of the latest N events, dumped at '
+                           'the end of each session and on SIGUSR1 '
+                           '(default: 0, or %s if verbose)'
+                           % _VERBOSE_TRACE_SIZE)
+    parser.add_option('--trace-file', dest='trace_file',
+                      metavar='FILE', default='',
+                      help='append the trace to FILE, rather than logging it')
+    parser.add_option('--stats', dest='stats',
+                      metavar='FILE', default='',
+                      help='time fixture methods and protocol phases, writing '
+                           'a report to FILE (and FILE.json), or with '
+                           '--workers a FILE per worker, after each '
+                           'session and on SIGUSR2')
+    parser.add_option('--profile', dest='profile',
+                      metavar='DIR', default='',
+                      help='profile each session, writing a .pstats file to '
+                           'DIR')
+    parser.add_option('--profile-scope', dest='profile_scope',
+                      type='choice', choices=list(profiling.SCOPES),
+                      default=profiling.SESSION,
+                      help='profile the whole "session" or only the '
+                           '"execution" of instructions (default: session)')
+    parser.add_option('--profile-focus', dest='profile_focus',
+                      type='choice', choices=list(profiling.FOCUSES),
+                      default=profiling.ALL,
+                      help='keep "all" functions in profiles, or only those '
+                           'of the "fixtures" or "waferslim" (default: all)')
+    parser.add_option('--record', dest='record',
+                      metavar='FILE', default='',
+                      help='append messages, responses and timings to FILE '
+                           '(or, with --workers, a FILE per worker) as JSON '
+                           'lines, for replaying')
+    parser.add_option('--record-max-bytes', dest='record_max_bytes',
+                      metavar='N', type='int', default=0,
+                      help='with --record, cap FILE at N bytes (default: 0, '
+                           'no cap)')
+    parser.add_option('--record-backups', dest='record_backups',
+                      metavar='N', type='int', default=0,
+                      help='rotate a full FILE to FILE.1 ... FILE.N rather '
+                           'than stop recording (default: 0)')
     return parser.parse_args()
 
 
@@ -140,12 +365,60 @@ def _setup_logging(options):
             logging.warn('Invalid logging config file: %s' % options.logconf)
 
 
+def _setup_tracing(options):
+    ''' Keep a trace of events, if required (as it is when verbose) '''
+    size = options.trace or (options.verbose and _VERBOSE_TRACE_SIZE)
+    if not size:
+        return
+    tracing.enable(size, options.trace_file or None)
+    logger = logging.getLogger('Trace')
+    if not options.trace_file and logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    if hasattr(signal, 'SIGUSR1'):
+        tracing.dump_on_signal(signal.SIGUSR1)
+
+
+def _setup_stats(options):
+    ''' Collect latency statistics, if required '''
+    if options.stats:
+        stats.enable(options.stats)
+        if hasattr(signal, 'SIGUSR2'):
+            stats.write_on_signal(signal.SIGUSR2)
+
+
+def _setup_profiling(options):
+    ''' Profile each session, if required '''
+    if options.profile:
+        profiling.enable(options.profile, options.profile_scope,
+                         options.profile_focus)
+
+
+def _setup_recording(options):
+    ''' Record the messages received, if required '''
+    if options.record:
+        recorder.enable(options.record, options.record_max_bytes,
+                        options.record_backups, options.encoding)
+
+
 def _setup_syspath(options):
     ''' Configure syspath '''
     for element in options.syspath.split(os.pathsep):
         sys.path.append(element)
 
 
+def _setup_fixture_cache(options):
+    ''' Configure the on-disk cache of fixture class metadata '''
+    if options.fixture_cache:
+        cache = fixture_cache.FixtureCache(options.fixture_cache)
+        execution.set_fixture_cache(cache)
+
+
+def _setup_preload(options):
+    ''' Load fixture classes to be shared by all sessions '''
+    if options.preload:
+        execution.preload(options.preload.split(','))
+
+
 def _setup_encoding(options):
     ''' Configure byte (de-)encoding to use '''
     if codecs.lookup(options.encoding):
@@ -168,10 +441,34 @@ def start_server():
     (options, args) = _get_options()
 
     _setup_logging(options)
+    _setup_tracing(options)
+    _setup_stats(options)
+    _setup_profiling(options)
     _setup_syspath(options)
+    _setup_fixture_cache(options)
+    _setup_preload(options)
     _setup_encoding(options)
+    _setup_recording(options)
     _setup_port(options, args)
-    WaferSlimServer(options).serve_forever()
+    if options.use_async:
+        from .async_server import AsyncWaferSlimServer
+        AsyncWaferSlimServer(options).serve_forever()
+    elif options.workers:
+        from .prefork import PreforkServer
+        server = PreforkServer(options)
+        server.stop_on_signal(signal.SIGINT, signal.SIGTERM)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+    else:
+        server = WaferSlimServer(options)
+        if options.persistent:
+            server.shutdown_on_signal(signal.SIGINT, signal.SIGTERM)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
 
 
 if __name__ == '__main__':
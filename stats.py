@@ -0,0 +1,212 @@
+'''
+Latency statistics: how many times each fixture method was called (made,
+for constructors) and how long the calls took, alongside the time spent in
+each phase of the protocol -- unpacking messages, packing responses and
+sending them -- so that slow fixtures can be told apart from protocol
+overhead.
+
+Each latency is added to a histogram with logarithmic buckets, so memory
+is bounded however many calls there are, and percentiles are accurate to
+within a bucket (about 9%). The report is written, sorted by total time,
+as text and as JSON at the end of each session or on demand, e.g. on a
+signal.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import json
+import math
+import os
+import signal
+import threading
+from .tracing import clock
+
+FIXTURE = 'fixture'
+PROTOCOL = 'protocol'
+PERCENTILES = (50, 90, 99)
+_STATS = None  # the Stats that latencies are added to, while enabled
+_BUCKETS_PER_DOUBLING = 8
+_SMALLEST = 1e-7  # seconds: the upper bound of the first bucket
+
+
+class Histogram(object):
+    ''' Count, total, min, max and percentiles of latencies in seconds '''
+
+    def __init__(self):
+        ''' Start with no latencies '''
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = {}  # bucket index: count
+
+    def add(self, seconds):
+        ''' Add a latency '''
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        bucket = _bucket(seconds)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent):
+        ''' The latency that percent of those added were no greater than
+        (or rather, the upper bound of its bucket) '''
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return max(self.min, min(self.max, _upper_bound(bucket)))
+        return self.max
+
+    def mean(self):
+        ''' The mean latency '''
+        return self.total / self.count if self.count else None
+
+
+def _bucket(seconds):
+    ''' The index of the bucket for a latency '''
+    if seconds <= _SMALLEST:
+        return 0
+    return int(math.ceil(math.log(seconds / _SMALLEST, 2)
+                         * _BUCKETS_PER_DOUBLING))
+
+
+def _upper_bound(bucket):
+    ''' The largest latency in a bucket '''
+    return _SMALLEST * 2 ** (float(bucket) / _BUCKETS_PER_DOUBLING)
+
+
+class Stats(object):
+    ''' Histograms of latencies, by group (FIXTURE or PROTOCOL) and name
+    (e.g. "Class.method" or "unpack"). May be added to from several
+    threads. '''
+
+    def __init__(self, path=None):
+        ''' Specify the file to write the text report to; the JSON report
+        is written to the same path plus ".json" '''
+        self.path = path
+        self._owner = os.getpid()  # the process writing to path itself
+        self._histograms = {}  # (group, name): Histogram
+        self._lock = threading.RLock()  # may be reentered by a signal
+
+    def add(self, group, name, seconds):
+        ''' Add a latency for name in group '''
+        key = (group, name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(seconds)
+
+    def summary(self):
+        ''' A dict for each name, with its group, count, total, mean, min,
+        max and percentiles, most total time first '''
+        with self._lock:
+            items = [(key, histogram) for key, histogram
+                     in self._histograms.items()]
+            rows = []
+            for (group, name), histogram in items:
+                row = {'group': group, 'name': name,
+                       'count': histogram.count, 'total': histogram.total,
+                       'mean': histogram.mean(), 'min': histogram.min,
+                       'max': histogram.max}
+                for percent in PERCENTILES:
+                    row['p%s' % percent] = histogram.percentile(percent)
+                rows.append(row)
+        rows.sort(key=lambda row: (-row['total'], row['group'], row['name']))
+        return rows
+
+    def report(self):
+        ''' A text report of the summary, a section per group '''
+        rows = self.summary()
+        columns = ['count', 'total', 'mean'] \
+            + ['p%s' % percent for percent in PERCENTILES] + ['max']
+        lines = []
+        for group in (FIXTURE, PROTOCOL):
+            lines.append('%-40s %8s %10s' % (group, 'count', 'total s')
+                         + ''.join(['%10s' % ('%s ms' % column)
+                                    for column in columns[2:]]))
+            for row in rows:
+                if row['group'] != group:
+                    continue
+                lines.append('%-40s %8d %10.3f' % (row['name'], row['count'],
+                                                   row['total'])
+                             + ''.join([_cell(row[column])
+                                        for column in columns[2:]]))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def path_for(self, pid):
+        ''' The file that process pid writes its text report to: forked
+        processes, e.g. pre-fork workers, each write their own '''
+        if pid == self._owner:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return '%s.%s%s' % (root, pid, ext)
+
+    def write(self):
+        ''' Write the text and JSON reports, if there is a path for them '''
+        if not self.path:
+            return
+        path = self.path_for(os.getpid())
+        with open(path, 'w') as report_file:
+            report_file.write(self.report())
+        with open(path + '.json', 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=1)
+
+
+def _cell(seconds):
+    ''' A column of the text report for a latency in seconds, or None '''
+    if seconds is None:
+        return '%10s' % '-'
+    return '%10.3f' % (seconds * 1000)
+
+
+def enable(path=None):
+    ''' Start collecting latencies, returning the Stats '''
+    global _STATS
+    _STATS = Stats(path)
+    return _STATS
+
+
+def disable():
+    ''' Stop collecting latencies, discarding those collected '''
+    global _STATS
+    _STATS = None
+
+
+def current():
+    ''' The Stats latencies are being added to, or None if disabled. For
+    loops, get this once and add to it only if it is not None. '''
+    return _STATS
+
+
+def add(group, name, seconds):
+    ''' Add a latency, if collecting them '''
+    stats = _STATS
+    if stats is not None:
+        stats.add(group, name, seconds)
+
+
+def write():
+    ''' Write the reports, if collecting latencies '''
+    stats = _STATS
+    if stats is not None:
+        stats.write()
+
+
+def write_on_signal(*signums):
+    ''' Write the reports whenever any of the signals is received. Call from
+    the main thread. '''
+    def handler(signum, frame):
+        ''' Write the reports '''
+        write()
+    for signum in signums:
+        signal.signal(signum, handler)
@@ -0,0 +1,17 @@
+from waferslim.converters import register_converter
+
+
+class Shouty(object):
+    def from_string(self, value):
+        return value.lower()
+
+    def to_string(self, value):
+        return str(value).upper()
+
+
+class ConverterFixture(object):
+    def shout(self):
+        register_converter(str, Shouty())
+
+    def number(self):
+        return 'number'
@@ -1,8 +1,34 @@
+import datetime
+import decimal
+import gc
+import json
+import os
+import pstats
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from waferslim import converters
 from waferslim import execution
+from waferslim import fixture_cache
+from waferslim import profiling
+from waferslim import protocol
+from waferslim import recorder
+from waferslim import server
+from waferslim import stats
+from waferslim import tracing
 from waferslim.tests.fixtures import echo_fixture
 
 
+ECHO_FIXTURE = os.path.join(os.path.dirname(__file__),
+                            'fixtures', 'echo_fixture.py')
+CONVERTER_FIXTURE = os.path.join(os.path.dirname(__file__),
+                                 'fixtures', 'converter_fixture.py')
+
+
 class ConventionsTestCase(unittest.TestCase):
     def test_lower_camel_case(self):
         self.assertEqual(
@@ -74,5 +100,1168 @@ class GetClassesTestCase(unittest.TestCase):
         )
 
 
+class TargetForTestCase(unittest.TestCase):
+    class Dynamic(object):
+        def __getattr__(self, name):
+            if name == 'dynamic':
+                return lambda: 'dynamic'
+            raise AttributeError(name)
+
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.context.import_path(ECHO_FIXTURE)
+        self.echoer = self.context.get_type('EchoFixture')()
+
+    def call(self, instance, method_name, *args):
+        target = self.context.target_for(instance, method_name)
+        return target and target(*args)
+
+    def test_methods_resolve(self):
+        for method_name in ('echo', 'staticEcho', 'ClassEcho'):
+            self.assertEqual(self.call(self.echoer, method_name, 'x'), 'x')
+            self.assertEqual(self.call(self.echoer, method_name, 'y'), 'y')
+
+    def test_resolves_as_eager_aliases_did(self):
+        class Fixture(object):
+            def pythonic_case(self): pass
+            def CamelCase(self): pass
+            def getX(self): pass
+            def setX(self): pass
+            def get_XMLValue(self): pass
+        methods = [name for name in dir(Fixture) if '__' not in name]
+        self.context.methods[Fixture] = frozenset(methods)
+        fixture = Fixture()
+        for slim_name, method_name in \
+                execution.ExecutionContext.get_aliases(methods).items():
+            self.assertEqual(self.context.target_for(fixture, slim_name),
+                             getattr(fixture, method_name))
+
+    def test_not_found(self):
+        self.assertEqual(self.call(self.echoer, 'noSuchMethod'), None)
+        self.assertEqual(self.call(object(), 'echo'), None)
+
+    def test_instance_attributes(self):
+        self.echoer.echo = lambda value: value * 2
+        self.assertEqual(self.call(self.echoer, 'echo', 'x'), 'xx')
+        self.assertEqual(self.call(self.Dynamic(), 'dynamic'), 'dynamic')
+
+    def test_import_invalidates(self):
+        self.call(self.echoer, 'echo', 'x')
+        self.context.import_path(ECHO_FIXTURE)
+        echoer = self.context.get_type('EchoFixture')()
+        self.assertEqual(self.call(echoer, 'echo', 'x'), 'x')
+        self.assertEqual(self.call(self.echoer, 'echo', 'y'), 'y')
+
+    def test_annotated_args_convert(self):
+        class Fixture(object):
+            def add(self, a, b, label, *more):
+                return a + b + sum(more), label
+            add.__annotations__ = {'a': int, 'b': float, 'label': str,
+                                   'more': int}
+
+            @staticmethod
+            def negate(a):
+                return -a
+            negate.__func__.__annotations__ = {
+                'a': converters.FromConstructorConverter(decimal.Decimal)}
+        self.context.methods[Fixture] = frozenset(['add', 'negate'])
+        fixture = Fixture()
+        self.assertEqual(self.call(fixture, 'add', '1', '2.5', 'x', '3', 4),
+                         (10.5, 'x'))
+        self.assertEqual(self.call(fixture, 'negate', '1.5'),
+                         decimal.Decimal('-1.5'))
+        self.assertEqual(self.call(self.echoer, 'echo', '1'), '1')
+
+
+class InstructionPlansTestCase(unittest.TestCase):
+    def test_lru(self):
+        plans = execution.InstructionPlans(2)
+        make = [u'id', u'make', u'instance', u'Class']
+        call = [u'id', u'call', u'instance', u'method']
+        plan = plans.plan_for([make, call])
+        self.assertEqual([step.instruction_class for step in plan],
+                         [execution.Make, execution.Call])
+        self.assertTrue(plans.plan_for([make, call]) is plan)
+        plans.plan_for([call])
+        plans.plan_for([[u'id', u'bad']])
+        self.assertEqual(plans.plan_for([call])[0].instruction_class,
+                         execution.Call)
+        self.assertFalse(plans.plan_for([make, call]) is plan)
+        self.assertEqual((plans.hits, plans.misses), (2, 4))
+
+    def test_malformed(self):
+        plans = execution.InstructionPlans(2)
+        self.assertEqual(plans.plan_for([u'x']), None)
+        self.assertEqual(plans.plan_for([[u'id']]), None)
+
+    def test_bind(self):
+        step, bad = execution.PlanStep(u'call'), execution.PlanStep(u'bad')
+        item = [u'call_1', u'call', u'echoer', u'echo', u'x']
+        self.assertEqual(repr(step.bind(item)),
+                         repr(execution.instruction_for(list(item))))
+        self.assertEqual(repr(bad.bind([u'bad_1', u'bad', u'x'])),
+                         repr(execution.instruction_for([u'bad_1', u'bad'])))
+
+    def test_step_resolves_again_when_stale(self):
+        context = execution.ExecutionContext()
+        context.import_path(ECHO_FIXTURE)
+        step = execution.PlanStep(u'call')
+        echoer = context.get_type('EchoFixture')()
+        self.assertEqual(step.target_for(context, echoer, 'echo')('x'), 'x')
+        self.assertEqual(step.target_for(context, echoer, 'echo')('y'), 'y')
+        self.assertEqual(step.target_for(context, echoer, 'staticEcho')('z'),
+                         'z')
+        self.assertEqual(step.target_for(context, object(), 'echo'), None)
+        echoer.echo = lambda value: value * 2
+        self.assertEqual(step.target_for(context, echoer, 'echo')('x'), 'xx')
+        context.import_path(ECHO_FIXTURE)
+        echoer = context.get_type('EchoFixture')()
+        self.assertEqual(step.target_for(context, echoer, 'echo')('x'), 'x')
+
+        class Fixture(object):
+            def doIt(self): return 'doIt'
+            def do_it(self): return 'do_it'
+        context.methods[Fixture] = frozenset(['do_it'])
+        other = execution.ExecutionContext()
+        other.methods[Fixture] = frozenset(['doIt'])
+        self.assertEqual(step.target_for(context, Fixture(), 'doIt')(),
+                         'do_it')
+        self.assertEqual(step.target_for(other, Fixture(), 'doIt')(), 'doIt')
+
+
+class ParamsConverterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.context.store_symbol('a', 1)
+        self.context.store_symbol('b_2', u'caf\xe9')
+
+    def test_substitution(self):
+        params = [u'plain', u'$a', u'$a+$b_2=$c', u'$$a$', [u'$a', [u'$b_2']],
+                  u'$'.join([u'$a'] * 20)]
+        self.assertEqual(self.context.to_args(params, 0), (
+            u'plain', u'1', u'1+caf\xe9=$c', u'$1$', (u'1', (u'caf\xe9',)),
+            u'$'.join([u'1'] * 20)
+        ))
+
+    def test_symbol_objects(self):
+        self.context.symbol_objects = True
+        value = decimal.Decimal('1.5')
+        self.context.store_symbol('c', value)
+        args = self.context.to_args([u'$c', u'$c!', u'$a'], 0)
+        self.assertEqual(args, (value, u'1.5!', u'1'))
+        self.assertTrue(args[0] is value)
+
+
+class ConverterRegistryTestCase(unittest.TestCase):
+    class Row(dict):
+        pass
+
+    class Shouty(object):
+        def from_string(self, value):
+            return value.lower()
+
+        def to_string(self, value):
+            return str(value).upper()
+
+    def in_thread(self, fn):
+        ''' Run fn in a new thread, returning its result '''
+        result = []
+        thread = threading.Thread(target=lambda: result.append(fn()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_subclasses_use_base_converter(self):
+        self.assertEqual(converters.to_string(True), 'true')
+        self.assertEqual(converters.to_string(self.Row(a=1)),
+                         converters.to_string({'a': 1}))
+        self.assertTrue(isinstance(converters.converter_for(self.Row),
+                                   converters.DictConverter))
+
+    def test_registration_is_per_thread(self):
+        def register_and_convert():
+            converters.to_string(self.Row())
+            converters.register_converter(dict, self.Shouty())
+            converters.register_converter(str, self.Shouty())
+            return converters.to_string(self.Row(a=1)), \
+                converters.to_string('quiet')
+        self.assertEqual(self.in_thread(register_and_convert),
+                         ("{'A': 1}", 'QUIET'))
+        self.assertEqual(converters.to_string('quiet'), 'quiet')
+        self.assertTrue(isinstance(converters.converter_for(dict),
+                                   converters.DictConverter))
+
+
+class BatchConversionTestCase(unittest.TestCase):
+    TABLE = [['1', '1.5', 'true', 'a'], ['-2', ' 2 ', 'False', 'b']]
+
+    def test_convert_table(self):
+        self.assertEqual(
+            converters.convert_table(self.TABLE, (int, float, bool, str)),
+            [[1, 1.5, True, 'a'], [-2, 2.0, False, 'b']])
+        self.assertEqual(
+            converters.convert_table(self.TABLE,
+                                     using=converters.YesNoConverter()),
+            [[False] * 4, [False] * 4])
+        self.assertEqual(converters.convert_table([], int), [])
+        self.assertRaises(converters.WaferSlimException,
+                          converters.convert_table, self.TABLE, (int, float))
+        self.assertRaises(converters.WaferSlimException,
+                          converters.convert_table, [['1'], ['1', '2']], int)
+        self.assertRaises(ValueError,
+                          converters.convert_table, self.TABLE, int)
+
+    def test_columns(self):
+        columns = converters.convert_table(self.TABLE, (int, float, bool, str),
+                                           as_array=True)
+        self.assertEqual([list(column) for column in columns],
+                         [[1, -2], [1.5, 2.0], [True, False], ['a', 'b']])
+        if converters.numpy is not None:
+            self.assertEqual(columns[0].dtype, converters.numpy.dtype(int))
+            self.assertEqual(list(converters.convert_column(
+                ['1', str(2 ** 70)], int, as_array=True)), [1, 2 ** 70])
+        else:
+            self.assertEqual(columns[0], (1, -2))
+        self.assertRaises(ValueError, converters.convert_column,
+                          ['1', 'x'], int, as_array=True)
+
+
+class DateTimeConvertersTestCase(unittest.TestCase):
+    FORMATS = {
+        converters.DateConverter: ('%Y-%m-%d',),
+        converters.TimeConverter: ('%H:%M:%S.%f', '%H:%M:%S'),
+        converters.DatetimeConverter: ('%Y-%m-%d %H:%M:%S.%f',
+                                       '%Y-%m-%d %H:%M:%S'),
+    }
+    VALUES = ['2009-02-28', '2009-2-8', '2009-02- 8', '2009-02-29',
+              '2009-02-28x', '09-02-28', '01:02:03', '1:2:3.4', '23:59:60',
+              '01:02:03.1234567', '01:02:03.', '2009-02-28 21:54:32.987654',
+              '2009-02-28 \t1:2:3', '2009-02-2821:54:32', '', u'\uff12']
+
+    def strptime(self, formats, value):
+        for format in formats[:-1]:
+            try:
+                return datetime.datetime.strptime(value, format)
+            except ValueError:
+                pass
+        return datetime.datetime.strptime(value, formats[-1])
+
+    def test_same_as_strptime(self):
+        for converter_class, formats in self.FORMATS.items():
+            converter = converter_class()
+            for value in self.VALUES * 2:  # and again from the memo
+                try:
+                    expected = self.strptime(formats, value)
+                except ValueError:
+                    self.assertRaises(ValueError,
+                                      converter.from_string, value)
+                    continue
+                if converter_class is converters.DateConverter:
+                    expected = expected.date()
+                elif converter_class is converters.TimeConverter:
+                    expected = expected.time()
+                self.assertEqual(converter.from_string(value), expected)
+                self.assertEqual(converter.to_string(expected),
+                                 str(expected))
+
+
+class DictConverterTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        a_dict = {'id': 7, 'name': 'Bob <b>', 'address': {'city': 'Paris'}}
+        markup = converters.DictConverter().to_string(a_dict)
+        self.assertEqual(converters.DictConverter().from_string(markup), {
+            'id': '7', 'name': 'Bob <b>',
+            'address': converters.DictConverter().to_string(
+                {'city': 'Paris'})})
+        converter = converters.DictConverter(
+            {'id': int, 'address': converters.DictConverter()})
+        self.assertEqual(converter.from_string(markup), a_dict)
+
+    def test_fitnesse_markup(self):
+        markup = '<table class="hash_table">\n' \
+            '  <tr class="hash_row">\n' \
+            '    <td class="hash_key">name</td>\n' \
+            '    <td class="hash_value"> Bob </td>\n' \
+            '  </tr>\n' \
+            '  <TR><TD>unclosed</TD><TD>row</TD>\n' \
+            '</table>'
+        self.assertEqual(converters.DictConverter().from_string(markup),
+                         {'name': 'Bob', 'unclosed': 'row'})
+        self.assertEqual(converters.DictConverter().from_string(
+            '<table></table>'), {})
+        for not_markup in ('', 'name', '<table><tr><td>a</td><td>b</td>'):
+            self.assertRaises(ValueError,
+                              converters.DictConverter().from_string,
+                              not_markup)
+
+
+class ConvertArgTestCase(unittest.TestCase):
+    class Fixture(object):
+        @converters.convert_arg(to_type=(int, float))
+        def int_float(self, an_int, a_float):
+            return an_int, a_float
+
+        @converters.convert_arg(to_type=bool)
+        def bools(self, *values):
+            return values
+
+    def test_per_position_conversion(self):
+        fixture = self.Fixture()
+        self.assertEqual(fixture.int_float('1', '2.5'), (1, 2.5))
+        self.assertEqual(fixture.bools('true', 'false', 'true'),
+                         (True, False, True))
+        self.assertRaises(converters.WaferSlimException,
+                          fixture.int_float, '1', '2', '3')
+
+    def test_concurrent_calls(self):
+        fixture = self.Fixture()
+        failures = []
+
+        def convert(offset):
+            for value in range(offset, offset + 2000):
+                if fixture.int_float(str(value), '0.5') != (value, 0.5):
+                    failures.append(value)
+        threads = [threading.Thread(target=convert, args=(offset * 2000,))
+                   for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+
+class PreloadTestCase(unittest.TestCase):
+    def tearDown(self):
+        execution._PRELOADED.clear()
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    def imported_class(self, path):
+        context = execution.ExecutionContext()
+        context.import_path(path)
+        return context.get_type('EchoFixture')
+
+    def test_import_reuses_preloaded_classes(self):
+        self.assertFalse(self.imported_class(ECHO_FIXTURE)
+                         is self.imported_class(ECHO_FIXTURE))
+        execution.preload([ECHO_FIXTURE])
+        self.assertTrue(self.imported_class(ECHO_FIXTURE)
+                        is self.imported_class(ECHO_FIXTURE))
+
+    def test_preloaded_module_without_classes_is_not_reloaded(self):
+        path = os.path.join(os.path.dirname(__file__),
+                            'fixtures', '__init__.py')
+        execution.preload([path])
+        loaded = []
+        load_classes = execution.load_classes
+        execution.load_classes = lambda path: loaded.append(path) or []
+        try:
+            execution.ExecutionContext().import_path(path)
+        finally:
+            execution.load_classes = load_classes
+        self.assertEqual(loaded, [])
+
+
+class FixtureCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixture = os.path.join(self.directory, 'cached_fixture.py')
+        shutil.copy(ECHO_FIXTURE, self.fixture)
+        self.path = os.path.join(self.directory, 'cache', 'fixtures.json')
+
+    def tearDown(self):
+        execution.set_fixture_cache(None)
+        shutil.rmtree(self.directory)
+
+    def import_fixture(self):
+        cache = fixture_cache.FixtureCache(self.path)
+        execution.set_fixture_cache(cache)
+        context = execution.ExecutionContext()
+        context.import_path(self.fixture)
+        return cache, context
+
+    def test_introspect_only_when_changed(self):
+        cache, context = self.import_fixture()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertTrue(os.path.exists(self.path))
+
+        cache, cached_context = self.import_fixture()
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cached_type = cached_context.get_type('EchoFixture')
+        self.assertEqual(cached_type.__name__, 'EchoFixture')
+        self.assertEqual(cached_context.methods[cached_type],
+                         context.methods[context.get_type('EchoFixture')])
+
+        with open(self.fixture, 'a') as fixture:
+            fixture.write('\n')
+        cache, context = self.import_fixture()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_base_class_changes_invalidate(self):
+        base = os.path.join(self.directory, 'cached_base.py')
+        with open(base, 'w') as base_file:
+            base_file.write('class Base(object):\n'
+                            '    def inherited(self):\n'
+                            '        pass\n')
+        with open(self.fixture, 'w') as fixture:
+            fixture.write('import cached_base\n\n\n'
+                          'class Derived(cached_base.Base):\n'
+                          '    pass\n')
+        sys.path.insert(0, self.directory)
+        try:
+            cache, context = self.import_fixture()
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            with open(base, 'a') as base_file:
+                base_file.write('\n    def added(self):\n'
+                                '        pass\n')
+            cache, context = self.import_fixture()
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+        finally:
+            sys.path.remove(self.directory)
+            sys.modules.pop('cached_base', None)
+
+
+def packed(items):
+    ''' Pack a (nested) list of str, with lengths counting characters '''
+    items = [isinstance(i, list) and packed(i) or i for i in items]
+    return u'[%06d:%s]' % (len(items),
+                           u''.join(u'%06d:%s:' % (len(i), i) for i in items))
+
+
+class UnpackBytesTestCase(unittest.TestCase):
+    def test_same_as_unpack(self):
+        message = packed([
+            [u'make_1', u'make', u'table', u'Fixture'],
+            [u'call_1', u'call', u'table', u'doTable',
+             [[u'a', u'[b]'], [u'', u'c:d']]],
+        ])
+        self.assertEqual(
+            protocol.unpack_bytes(message.encode('utf-8')),
+            protocol.unpack(message)
+        )
+
+    def test_multibyte_lengths_count_characters(self):
+        row = [u'caf\xe9', u'\u20ac%s' % (u'x' * 5000)]
+        message = packed([[u'id', u'call', u'i', u'm', [row, [u'ascii']]]])
+        self.assertEqual(
+            protocol.unpack_bytes(message.encode('utf-8')),
+            [[u'id', u'call', u'i', u'm', [row, [u'ascii']]]]
+        )
+
+    def test_malformed(self):
+        for message in (b'', b'bye', b'[000001:000005:abc:]', b'[00001x:]',
+                        b'caf\xc3\xa9', b'[000001:000002:\xc3\xa9:]'):
+            self.assertRaises(protocol.UnpackingError,
+                              protocol.unpack_bytes, message)
+
+
+class LazyUnpackTestCase(unittest.TestCase):
+    table = [[u'a', u'caf\xe9'], [u'$sym', u'']]
+    message = packed([[u'id', u'call', u'i', u'm', table]])
+
+    def test_same_as_unpack_when_used(self):
+        lazy = protocol.unpack(self.message, lazy=True)
+        self.assertEqual(len(lazy), 1)
+        self.assertEqual(lazy, protocol.unpack(self.message))
+        self.assertEqual(list(lazy[0])[:4], [u'id', u'call', u'i', u'm'])
+
+    def test_nested_chunks_stay_packed(self):
+        table = protocol.unpack(self.message, lazy=True)[0][4]
+        self.assertTrue(isinstance(table, protocol.LazyChunk))
+        self.assertTrue(table.has_symbols())
+        self.assertFalse(table[0].has_symbols())
+        self.assertEqual(table[0][1], u'caf\xe9')
+        self.assertEqual(table[-1], [u'$sym', u''])
+
+    def test_instruction_args_compare_as_tuples(self):
+        context = execution.ExecutionContext()
+        context.store_symbol('sym', u'x')
+        lazy = protocol.unpack(self.message, lazy=True)[0]
+        args = context.to_args(lazy, 4)
+        self.assertTrue(args[0][0] is lazy[4][0])
+        eager = protocol.unpack(self.message)[0]
+        self.assertEqual(args, context.to_args(eager, 4))
+        self.assertEqual(args, (((u'a', u'caf\xe9'), (u'x', u'')),))
+        self.assertEqual(args[0][0], (u'a', u'caf\xe9'))
+        self.assertNotEqual(args[0][0], (u'a', u'cafe'))
+
+
+class PackResponseTestCase(unittest.TestCase):
+    results = [[u'make_1', u'OK'],
+               [u'call_1', [[u'pass', u'caf\xe9'], [u'fail:\u20ac']]]]
+
+    def test_framed_pack(self):
+        message = protocol.pack(self.results).encode('utf-8')
+        self.assertEqual(
+            bytes(protocol.pack_response(self.results)),
+            ('%06d:' % len(message)).encode('ascii') + message
+        )
+
+    def test_round_trip(self):
+        response = bytes(protocol.pack_response(self.results))
+        self.assertEqual(protocol.unpack_bytes(response[7:]), self.results)
+
+    def test_not_a_string(self):
+        self.assertRaises(TypeError, protocol.pack_response, [[u'id', 1]])
+
+
+class FrameResultsTestCase(unittest.TestCase):
+    class Uncomparable(object):
+        def __eq__(self, other):
+            raise AssertionError('compared')
+        __hash__ = object.__hash__
+
+        def __str__(self):
+            return u'caf\xe9'
+
+    def add_results(self, results):
+        results.completed(execution.Instruction(u'make_1', []))
+        results.completed(execution.Instruction(u'call_1', []), None)
+        results.completed(execution.Instruction(u'call_2', []),
+                          self.Uncomparable())
+        results.completed(execution.Instruction(u'call_3', []),
+                          [[u'pass', True], [u'fail:\u20ac']])
+        results.failed(execution.Instruction(u'call_4', []), u'cause',
+                       stop_test=True)
+        return results
+
+    def test_same_as_pack_response(self):
+        collected = self.add_results(execution.Results())
+        framed = self.add_results(protocol.FrameResults())
+        self.assertEqual(framed.count, 5)
+        self.assertEqual(framed.collection(), collected.collection())
+        self.assertEqual(bytes(framed.frame()),
+                         bytes(protocol.pack_response(collected.collection())))
+        self.assertEqual(bytes(protocol.FrameResults().frame()),
+                         bytes(protocol.pack_response([])))
+
+    def test_unpackable_result_is_not_added(self):
+        results = protocol.FrameResults(lambda value: value)
+        results.completed(execution.Instruction(u'call_1', []), u'one')
+        self.assertRaises(TypeError, results.completed,
+                          execution.Instruction(u'call_2', []), 2)
+        self.assertEqual(results.count, 1)
+        self.assertEqual(results.collection(), [[u'call_1', u'one']])
+
+
+def framed(message):
+    ''' Add the numeric header, counting characters, and encode '''
+    return (u'%06d:%s' % (len(message), message)).encode('utf-8')
+
+
+class TrickleSocket(object):
+    ''' Socket stand-in that returns at most max_bytes from each recv '''
+    def __init__(self, data, max_bytes):
+        self._data = data
+        self._max_bytes = max_bytes
+
+    def recv_into(self, buf):
+        count = min(len(buf), self._max_bytes, len(self._data))
+        buf[:count] = self._data[:count]
+        self._data = self._data[count:]
+        return count
+
+
+class MessageReaderTestCase(unittest.TestCase):
+    messages = [u'[000000:]', u'caf\xe9 \u20ac' * 3000, u'bye']
+
+    def test_short_reads_and_pipelined_messages(self):
+        data = b''.join(framed(message) for message in self.messages)
+        for max_bytes in (1, 7, 4096, len(data)):
+            reader = protocol.MessageReader(TrickleSocket(data, max_bytes))
+            self.assertEqual(
+                [reader.read_message() for message in self.messages],
+                [message.encode('utf-8') for message in self.messages]
+            )
+            self.assertEqual(reader.received, len(data))
+            self.assertRaises(EOFError, reader.read_message)
+
+    def test_multibyte_message_larger_than_buffer(self):
+        message = u'\xe9' * (protocol.BUFFER_SIZE // 2 + 8000)
+        data = framed(message) + framed(u'bye')
+        for max_bytes in (4096, len(data)):
+            reader = protocol.MessageReader(TrickleSocket(data, max_bytes))
+            self.assertEqual(reader.read_message(), message.encode('utf-8'))
+            self.assertEqual(reader.read_message(), b'bye')
+
+    def test_not_a_length(self):
+        reader = protocol.MessageReader(TrickleSocket(b'12a456:bye', 3))
+        self.assertRaises(protocol.UnpackingError, reader.read_message)
+
+
+def respond(messages, streaming=False,
+            serve=protocol.RequestResponder.respond_to_request):
+    ''' Send messages to a RequestResponder over a socketpair, serving the
+    request with serve(responder), and return the ack and the raw response
+    bytes '''
+    client, server = socket.socketpair()
+    responder = protocol.RequestResponder()
+    responder.request = server
+    responder.streaming = streaming
+    thread = threading.Thread(target=serve, args=(responder,))
+    thread.start()
+    client.sendall(b''.join(framed(message) for message in messages))
+    thread.join()
+    server.close()
+    chunks = []
+    while True:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    client.close()
+    data = b''.join(chunks)
+    return data[:len(protocol._VERSION)], data[len(protocol._VERSION):]
+
+
+class RequestResponderTestCase(unittest.TestCase):
+    streaming = False
+
+    def respond(self, *messages):
+        ''' Send messages to a RequestResponder and return the ack and the
+        raw response bytes '''
+        return respond(messages, self.streaming)
+
+    def test_import_make_call_bye(self):
+        message = protocol.pack([
+            [u'import_1', u'import', ECHO_FIXTURE],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            [u'call_1', u'call', u'echoer', u'echo', u'caf\xe9'],
+        ])
+        ack, response = self.respond(message, u'bye')
+        self.assertEqual(ack, protocol._VERSION.encode('ascii'))
+        self.assertEqual(
+            protocol.unpack_bytes(response[7:]),
+            [[u'import_1', u'OK'], [u'make_1', u'OK'],
+             [u'call_1', u'caf\xe9']]
+        )
+        self.assertEqual(int(response[:6]), len(response) - 7)
+
+    def test_malformed_message(self):
+        message = protocol.pack([
+            [u'import_1', u'import', ECHO_FIXTURE],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+        ])[:-1] + u'x'
+        next_message = protocol.pack([[u'call_1', u'call', u'e', u'echo']])
+        ack, response = self.respond(message, next_message, u'bye')
+        first_len = int(response[:6]) + 7
+        first = protocol.unpack_bytes(response[7:first_len])
+        self.assertEqual(len(first), 1)
+        self.assertEqual(first[0][0], u'UnpackingError')
+        self.assertEqual(
+            protocol.unpack_bytes(response[first_len + 7:]),
+            [[u'call_1', u'__EXCEPTION__: message:<<NO_INSTANCE e>>']]
+        )
+
+
+class StreamingRequestResponderTestCase(RequestResponderTestCase):
+    streaming = True
+
+
+class PlanCacheRequestResponderTestCase(RequestResponderTestCase):
+    def setUp(self):
+        self.plans = execution.InstructionPlans(2)
+
+    def respond(self, *messages):
+        ''' Send messages to a RequestResponder sharing self.plans and
+        return the ack and the raw response bytes '''
+        def serve(responder):
+            responder.plan_cache = self.plans
+            responder.respond_to_request()
+        return respond(messages, self.streaming, serve)
+
+    def test_same_shape_hits(self):
+        message = protocol.pack([
+            [u'import_1', u'import', ECHO_FIXTURE],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            [u'call_1', u'call', u'echoer', u'echo', u'x'],
+        ])
+        _, response = self.respond(message, message, protocol.pack(
+            [[u'call_1', u'call', u'echoer', u'echo', u'y']]), u'bye')
+        self.assertEqual((self.plans.hits, self.plans.misses), (1, 2))
+        replies = []
+        while response:
+            length = int(response[:6])
+            replies.append(protocol.unpack_bytes(response[7:7 + length]))
+            response = response[7 + length:]
+        expected = [[u'import_1', u'OK'], [u'make_1', u'OK'],
+                    [u'call_1', u'x']]
+        self.assertEqual(replies[:2], [expected, expected])
+        self.assertEqual(replies[2], [[u'call_1', u'y']])
+
+
+class TracingRequestResponderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.log')
+        self.trace = tracing.enable(100, self.path)
+
+    def tearDown(self):
+        tracing.disable()
+        shutil.rmtree(self.directory)
+
+    def test_events_dumped_at_session_end(self):
+        message = protocol.pack([
+            [u'import_1', u'import', ECHO_FIXTURE],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            [u'call_1', u'call', u'echoer', u'echo', u'x'],
+            [u'call_2', u'call', u'echoer', u'noSuchMethod'],
+        ])
+        respond([message, u'bye'])
+        events = [event[3:] for event in self.trace.events()]
+        self.assertEqual(events[0], ('ack',))
+        instructions = [event[:5] for event in events
+                        if event[0] == 'instruction']
+        self.assertEqual(instructions, [
+            ('instruction', u'import_1', 'Import', ECHO_FIXTURE, 'ok'),
+            ('instruction', u'make_1', 'Make', u'EchoFixture', 'ok'),
+            ('instruction', u'call_1', 'Call', u'echoer.echo', 'ok'),
+            ('instruction', u'call_2', 'Call', u'echoer.noSuchMethod',
+             'failed')])
+        self.assertTrue(('instance', u'echoer', 'EchoFixture') in events)
+        self.assertEqual([event[:3] for event in events
+                          if event[0] == 'response'], [('response', 4, 1)])
+        with open(self.path) as trace_file:
+            lines = trace_file.read().splitlines()
+        self.assertEqual(len(lines), len(events))
+        self.assertEqual(lines[-1].split()[3:], ['cleanup', '1'])
+        self.assertEqual(self.trace.dump(new_only=True), 0)
+
+    def test_ring_buffer(self):
+        for n in range(150):
+            tracing.record('event', n)
+        self.assertEqual([event[4] for event in self.trace.events()],
+                         list(range(50, 150)))
+
+
+class StatsRequestResponderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stats.txt')
+        self.stats = stats.enable(self.path)
+
+    def tearDown(self):
+        stats.disable()
+        shutil.rmtree(self.directory)
+
+    def test_report_written_at_session_end(self):
+        message = protocol.pack([
+            [u'import_1', u'import', ECHO_FIXTURE],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            [u'call_1', u'call', u'echoer', u'echo', u'x'],
+            [u'call_2', u'callAndAssign', u's', u'echoer', u'echo', u'y'],
+            [u'call_3', u'call', u'nobody', u'echo'],
+        ])
+        respond([message, u'bye'])
+        with open(self.path + '.json') as json_file:
+            summary = json.load(json_file)
+        counts = dict(((row['group'], row['name']), row['count'])
+                      for row in summary)
+        self.assertEqual(counts, {
+            ('fixture', 'EchoFixture.__init__'): 1,
+            ('fixture', 'EchoFixture.echo'): 2,
+            ('protocol', 'unpack'): 1,
+            ('protocol', 'pack'): 1,
+            ('protocol', 'send'): 1})
+        totals = [row['total'] for row in summary]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        with open(self.path) as report_file:
+            report = report_file.read()
+        self.assertTrue('EchoFixture.echo' in report)
+        self.assertTrue(report.index('protocol') > report.index('fixture'))
+
+    def test_histogram(self):
+        histogram = stats.Histogram()
+        for millis in range(1, 10001):
+            histogram.add(millis / 1000.0)
+        self.assertEqual(histogram.count, 10000)
+        self.assertEqual(histogram.max, 10.0)
+        for percent in (50, 90, 99):
+            self.assertAlmostEqual(histogram.percentile(percent) / percent,
+                                   0.1, delta=0.01)
+        self.assertTrue(len(histogram._buckets) < 150)
+        self.assertEqual(histogram.percentile(100), 10.0)
+
+    def test_zero_latencies(self):
+        self.stats.add(stats.PROTOCOL, 'send', 0.0)
+        self.assertEqual(self.stats.summary()[0]['mean'], 0.0)
+        self.assertTrue('0.000' in self.stats.report())
+        self.assertEqual(stats.Histogram().mean(), None)
+        self.assertEqual(stats._cell(None).strip(), '-')
+
+
+class ProfilingRequestResponderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiles = os.path.join(self.directory, 'profiles')
+        self.fixture = os.path.join(self.directory, 'profiled_fixture.py')
+        shutil.copy(ECHO_FIXTURE, self.fixture)
+        profiling.enable(self.profiles)
+
+    def tearDown(self):
+        profiling.disable()
+        shutil.rmtree(self.directory)
+
+    def serve(self, responder):
+        ''' Respond to the request in a profiled session, as
+        SlimRequestHandler does '''
+        responder.profile = profiling.session(('127.0.0.1', 1234))
+        responder.profile.start()
+        try:
+            responder.respond_to_request()
+        finally:
+            responder.profile.stop()
+
+    def profiled_functions(self):
+        ''' Send a message and return the (file name, function name)-s in the
+        profile written '''
+        message = protocol.pack([
+            [u'import_1', u'import', self.fixture],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            [u'call_1', u'call', u'echoer', u'echo', u'x'],
+        ])
+        respond([message, u'bye'], serve=self.serve)
+        names = os.listdir(self.profiles)
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].startswith('127.0.0.1_1234_'))
+        self.assertTrue(names[0].endswith('.pstats'))
+        profile = pstats.Stats(os.path.join(self.profiles, names[0]))
+        return set((os.path.basename(function[0]), function[2])
+                   for function in profile.stats)
+
+    def test_session_profiled(self):
+        functions = self.profiled_functions()
+        self.assertTrue(('profiled_fixture.py', 'echo') in functions)
+        self.assertTrue(('protocol.py', 'unpack_bytes') in functions)
+        self.assertTrue(('protocol.py', '_send_ack') in functions)
+
+    def test_execution_profiled(self):
+        profiling.enable(self.profiles, scope=profiling.EXECUTION)
+        functions = self.profiled_functions()
+        self.assertTrue(('profiled_fixture.py', 'echo') in functions)
+        self.assertTrue(('execution.py', 'execute') in functions)
+        self.assertFalse(('protocol.py', 'unpack_bytes') in functions)
+        self.assertFalse(('protocol.py', '_send_ack') in functions)
+
+    def test_focus_on_fixtures(self):
+        profiling.enable(self.profiles, focus=profiling.FIXTURES)
+        functions = self.profiled_functions()
+        self.assertTrue(('profiled_fixture.py', 'echo') in functions)
+        self.assertEqual(set(name for name, function in functions),
+                         set(['profiled_fixture.py']))
+
+    def test_focus_on_waferslim(self):
+        profiling.enable(self.profiles, focus=profiling.WAFERSLIM)
+        functions = self.profiled_functions()
+        self.assertTrue(('protocol.py', 'unpack_bytes') in functions)
+        self.assertFalse(('profiled_fixture.py', 'echo') in functions)
+
+    def test_not_profiled_unless_enabled(self):
+        profiling.disable()
+        self.assertEqual(profiling.session(('127.0.0.1', 1234)), None)
+
+
+class RecordingRequestResponderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'record.jsonl')
+        self.recorder = recorder.enable(self.path)
+
+    def tearDown(self):
+        recorder.disable()
+        shutil.rmtree(self.directory)
+
+    def records(self, path=None):
+        ''' The records written to the file at path (by default, the one
+        being recorded to) '''
+        self.recorder.flush()
+        with open(path or self.path) as record_file:
+            return [json.loads(line) for line in record_file]
+
+    def test_messages_recorded(self):
+        messages = [
+            protocol.pack([[u'import_1', u'import', ECHO_FIXTURE],
+                           [u'make_1', u'make', u'echoer', u'EchoFixture']]),
+            protocol.pack([[u'call_1', u'call', u'echoer', u'echo',
+                            u'caf\xe9']]),
+        ]
+        respond(messages + [u'bye'])
+        respond([messages[0], u'bye'])
+        records = self.records()
+        self.assertEqual([record['body'] for record in records],
+                         messages + messages[:1])
+        self.assertEqual(records[1]['response'], protocol.pack(
+            [[u'call_1', u'caf\xe9']]))
+        sessions = [record['session'] for record in records]
+        self.assertEqual(sessions[0], sessions[1])
+        self.assertNotEqual(sessions[1], sessions[2])
+        self.assertEqual(records[1]['request_id'], sessions[0] + '-2')
+        for record in records:
+            for timing in ('receive', 'execute', 'send'):
+                self.assertTrue(record[timing] >= 0)
+        from waferslim.bench import replay
+        self.assertEqual(replay.load(self.path),
+                         [messages, messages[:1]])
+
+    def test_recorded_sessions_replay(self):
+        from waferslim.bench import replay
+        message = protocol.pack([
+            [u'import_1', u'import', ECHO_FIXTURE],
+            [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            [u'call_1', u'call', u'echoer', u'echo', u'caf\xe9'],
+        ])
+        respond([message, u'bye'])
+        self.recorder.flush()
+        replays = []
+        thread = threading.Thread(target=lambda: replays.append(
+            replay.replay_socketpair(replay.load(self.path))))
+        thread.daemon = True  # rather than hang if a response is misread
+        thread.start()
+        thread.join(10)
+        self.assertEqual(replays[0].messages, 1)
+
+    def test_streamed_messages_recorded(self):
+        message = protocol.pack([[u'import_1', u'import', ECHO_FIXTURE]])
+        respond([message, u'bye'], streaming=True)
+        self.assertEqual([record['body'] for record in self.records()],
+                         [message])
+
+    def test_rotation(self):
+        self.recorder = recorder.enable(self.path, max_bytes=1000,
+                                        backups=2)
+        message = protocol.pack([[u'id_%s' % n, u'bad'] for n in range(10)])
+        respond([message] * 10 + [u'bye'])
+        records = self.records()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(len(self.records(self.path + '.1')), 1)
+        self.assertEqual(len(self.records(self.path + '.2')), 1)
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        self.assertEqual(records[0]['request_id'][-3:], '-10')
+
+    def test_cap(self):
+        self.recorder = recorder.enable(self.path, max_bytes=1000)
+        message = protocol.pack([[u'id_%s' % n, u'bad'] for n in range(10)])
+        respond([message] * 10 + [u'bye'])
+        self.assertEqual(len(self.records()), 1)
+        self.assertEqual((self.recorder.written, self.recorder.dropped),
+                         (1, 9))
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio server needs 3.7+')
+class AsyncRequestResponderTestCase(RequestResponderTestCase):
+    executor = None
+
+    def respond(self, *messages):
+        ''' Send messages to an AsyncRequestResponder over a socketpair and
+        return the ack and the raw response bytes '''
+        import asyncio
+        from waferslim.async_server import AsyncRequestResponder
+        client, server = socket.socketpair()
+        client.sendall(b''.join(framed(message) for message in messages))
+
+        async def serve():
+            reader, writer = await asyncio.open_connection(sock=server)
+            try:
+                responder = AsyncRequestResponder(reader, writer,
+                                                  self.executor)
+                await responder.respond_to_request()
+            finally:
+                writer.close()
+        asyncio.run(serve())
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        client.close()
+        data = b''.join(chunks)
+        return data[:len(protocol._VERSION)], data[len(protocol._VERSION):]
+
+    def test_converters_registered_per_session(self):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(1)
+        make = protocol.pack([
+            [u'import_1', u'import', CONVERTER_FIXTURE],
+            [u'make_1', u'make', u'fixture', u'ConverterFixture'],
+        ])
+        shout = protocol.pack([[u'call_1', u'call', u'fixture', u'shout']])
+        number = protocol.pack([[u'call_2', u'call', u'fixture', u'number']])
+        try:
+            response = self.respond(make, shout, number, u'bye')[1]
+            self.assertTrue(response.endswith(
+                protocol.pack([[u'call_2', u'NUMBER']]).encode()))
+            response = self.respond(make, number, u'bye')[1]
+            self.assertTrue(response.endswith(
+                protocol.pack([[u'call_2', u'number']]).encode()))
+            self.assertEqual(self.executor.submit(converters.to_string,
+                                                  'quiet').result(), 'quiet')
+        finally:
+            self.executor.shutdown()
+
+
+def slim_session(address, *messages):
+    ''' Run a session with a server, returning the responses '''
+    client = socket.create_connection(address)
+    client.sendall(b''.join(framed(message) for message in messages))
+    client.sendall(framed(u'bye'))
+    reader = protocol.MessageReader(client)
+    reader.read_chars(len(protocol._VERSION))
+    responses = [reader.read_response() for message in messages]
+    client.close()
+    return responses
+
+
+class PersistentServerTestCase(unittest.TestCase):
+    class Options(object):
+        inethost, port, verbose = '127.0.0.1', 0, False
+        persistent, idle_timeout = True, 0.5
+
+    def test_fresh_context_per_session_until_idle(self):
+        slim_server = server.WaferSlimServer(self.Options())
+        thread = threading.Thread(target=slim_server.serve_forever)
+        thread.start()
+        try:
+            make = protocol.pack([
+                [u'import_1', u'import', ECHO_FIXTURE],
+                [u'make_1', u'make', u'echoer', u'EchoFixture'],
+            ])
+            call = protocol.pack([
+                [u'call_1', u'call', u'echoer', u'echo', u'hi'],
+            ])
+            address = slim_server.server_address
+            self.assertEqual(slim_session(address, make, call)[1],
+                             protocol.pack([[u'call_1', u'hi']]).encode())
+            self.assertTrue(b'__EXCEPTION__'
+                            in slim_session(address, call)[0])
+        finally:
+            thread.join(10)
+            slim_server.server_close()
+        self.assertFalse(thread.is_alive())
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'pre-fork server needs os.fork')
+class PreforkServerTestCase(unittest.TestCase):
+    class Options(PersistentServerTestCase.Options):
+        workers, max_sessions = 2, 1
+
+    def test_workers_are_recycled_and_counted(self):
+        from waferslim.prefork import PreforkServer
+        slim_server = PreforkServer(self.Options())
+        thread = threading.Thread(target=slim_server.serve_forever)
+        thread.start()
+        call = protocol.pack([[u'call_1', u'call', u'nobody', u'echo']])
+        try:
+            for session in range(3):
+                slim_session(slim_server.server_address, call)
+            deadline = time.time() + 10
+            while len(slim_server.retired) < 3 and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            slim_server.stop()
+            thread.join(10)
+            slim_server.server_close()
+        finished = slim_server.retired[:3]
+        self.assertEqual(len(finished), 3)
+        self.assertEqual(len(set(c.pid for c in finished)), 3)
+        self.assertTrue(all(c.received and c.sent for c in finished))
+
+    def test_recording_written_before_workers_exit(self):
+        from waferslim.prefork import PreforkServer
+
+        class SlowRecorder(recorder.Recorder):
+            def _write(self, record_file, item):
+                time.sleep(0.2)
+                return recorder.Recorder._write(self, record_file, item)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'record.jsonl')
+        recorder._RECORDER = SlowRecorder(path)
+        call = protocol.pack([[u'call_1', u'call', u'nobody', u'echo']])
+        pids = []
+        try:
+            for max_sessions in (1, 0):  # recycled, then stopped
+                options = self.Options()
+                options.workers, options.max_sessions = 1, max_sessions
+                slim_server = PreforkServer(options)
+                thread = threading.Thread(target=slim_server.serve_forever)
+                thread.start()
+                try:
+                    slim_session(slim_server.server_address, call)
+                    deadline = time.time() + 10
+                    while not (slim_server.retired or any(
+                            c.sessions for c in slim_server.workers.values())
+                            ) and time.time() < deadline:
+                        time.sleep(0.05)
+                finally:
+                    slim_server.stop()
+                    thread.join(10)
+                    slim_server.server_close()
+                pids.extend(c.pid for c in slim_server.retired
+                            if c.sessions)
+            names = sorted(os.listdir(directory))
+            self.assertEqual(names, sorted('record.%s.jsonl' % pid
+                                           for pid in pids))
+            for name in names:
+                with open(os.path.join(directory, name)) as record_file:
+                    self.assertEqual(len(record_file.readlines()), 1)
+        finally:
+            recorder.disable()
+            shutil.rmtree(directory)
+
+    def test_stats_written_per_worker(self):
+        from waferslim.prefork import PreforkServer
+        directory = tempfile.mkdtemp()
+        stats.enable(os.path.join(directory, 'stats.txt'))
+        slim_server = PreforkServer(self.Options())
+        thread = threading.Thread(target=slim_server.serve_forever)
+        thread.start()
+        call = protocol.pack([[u'call_1', u'call', u'nobody', u'echo']])
+        try:
+            for session in range(2):
+                slim_session(slim_server.server_address, call)
+            deadline = time.time() + 10
+            while len(slim_server.retired) < 2 and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            slim_server.stop()
+            thread.join(10)
+            slim_server.server_close()
+            stats.disable()
+        try:
+            pids = [c.pid for c in slim_server.retired if c.sessions]
+            self.assertEqual(len(pids), 2)
+            self.assertEqual(sorted(os.listdir(directory)), sorted(
+                name % pid for pid in pids
+                for name in ('stats.%s.txt', 'stats.%s.txt.json')))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_converters_forgotten_between_sessions(self):
+        from waferslim.prefork import PreforkServer
+        options = self.Options()
+        options.workers, options.max_sessions = 1, 2
+        slim_server = PreforkServer(options)
+        thread = threading.Thread(target=slim_server.serve_forever)
+        thread.start()
+        make = protocol.pack([
+            [u'import_1', u'import', CONVERTER_FIXTURE],
+            [u'make_1', u'make', u'fixture', u'ConverterFixture'],
+        ])
+        shout = protocol.pack([[u'call_1', u'call', u'fixture', u'shout']])
+        number = protocol.pack([[u'call_2', u'call', u'fixture', u'number']])
+        try:
+            address = slim_server.server_address
+            self.assertEqual(
+                slim_session(address, make, shout, number)[2],
+                protocol.pack([[u'call_2', u'NUMBER']]).encode())
+            self.assertEqual(
+                slim_session(address, make, number)[1],
+                protocol.pack([[u'call_2', u'number']]).encode())
+        finally:
+            slim_server.stop()
+            thread.join(10)
+            slim_server.server_close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,126 @@
+'''
+In-memory trace of what the server has been doing: a ring buffer of the
+latest events (messages received, instructions executed with their
+outcome and duration, symbols stored, ...), each a tuple of the values
+involved rather than a formatted message. Recording an event is an append
+to a deque; while tracing is disabled it is a single check of a global.
+
+The events are formatted only when the trace is dumped: at the end of each
+session (just the events since the last dump) or on demand, e.g. on a
+signal.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import collections
+import itertools
+import logging
+import signal
+import time
+from six.moves import _thread
+
+_LOGGER_NAME = 'Trace'
+_TRACE = None  # the Trace that events are recorded in, while enabled
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Trace(object):
+    ''' Ring buffer of the latest size events, each a tuple of (sequence
+    number, clock() time, thread id, kind, fields...) '''
+
+    def __init__(self, size, path=None):
+        ''' Specify how many events to keep, and the file to dump them to
+        (or None to log them) '''
+        self.path = path
+        self.started = clock()
+        self._events = collections.deque(maxlen=size)
+        self._sequence = itertools.count(1)
+        self._dumped = 0  # sequence number of the last event dumped
+
+    def record(self, kind, *fields):
+        ''' Record an event of some kind, with the values of its fields '''
+        self._events.append((next(self._sequence), clock(),
+                             _thread.get_ident(), kind) + fields)
+
+    def events(self):
+        ''' The events currently held, oldest first '''
+        return list(self._events)
+
+    def format(self, event):
+        ''' A line describing an event '''
+        sequence, timestamp, thread, kind = event[:4]
+        line = '%s %.6f %s %s' % (sequence, timestamp - self.started, thread,
+                                  kind)
+        return ' '.join([line] + [_format_field(field)
+                                  for field in event[4:]])
+
+    def dump(self, new_only=False):
+        ''' Write the events held (or only those not dumped before) to the
+        file, or else the log, returning how many were written '''
+        events = self.events()
+        if new_only:
+            events = [event for event in events if event[0] > self._dumped]
+        if not events:
+            return 0
+        self._dumped = max(self._dumped, events[-1][0])
+        lines = [self.format(event) for event in events]
+        if self.path:
+            with open(self.path, 'a') as trace_file:
+                trace_file.write(''.join([line + '\n' for line in lines]))
+        else:
+            logger = logging.getLogger(_LOGGER_NAME)
+            for line in lines:
+                logger.info(line)
+        return len(lines)
+
+
+def _format_field(value):
+    ''' Format a field value for a line of the trace '''
+    if isinstance(value, float):
+        return '%.6f' % value
+    return '%s' % (value,)
+
+
+def enable(size, path=None):
+    ''' Start recording the latest size events, returning the Trace '''
+    global _TRACE
+    _TRACE = Trace(size, path)
+    return _TRACE
+
+
+def disable():
+    ''' Stop recording events, discarding any held '''
+    global _TRACE
+    _TRACE = None
+
+
+def current():
+    ''' The Trace events are being recorded in, or None if disabled. For
+    loops, get this once and record in it only if it is not None. '''
+    return _TRACE
+
+
+def record(kind, *fields):
+    ''' Record an event, if tracing is enabled '''
+    trace = _TRACE
+    if trace is not None:
+        trace.record(kind, *fields)
+
+
+def dump(new_only=False):
+    ''' Dump the events recorded, if tracing is enabled '''
+    trace = _TRACE
+    if trace is not None:
+        trace.dump(new_only)
+
+
+def dump_on_signal(*signums):
+    ''' Dump all the events held whenever any of the signals is received.
+    Call from the main thread. '''
+    def handler(signum, frame):
+        ''' Dump the trace '''
+        dump()
+    for signum in signums:
+        signal.signal(signum, handler)